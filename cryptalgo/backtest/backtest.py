@@ -1,13 +1,17 @@
+import copy
 import decimal
+import time
 from datetime import datetime
 from decimal import Decimal
 from pathlib import Path
-import csv
-from typing import Tuple
+from typing import Tuple, List, Iterable
 
+from cryptalgo.backtest.metrics import RISK_METRICS, bars_per_year, equity_curve, risk_metrics
 from cryptalgo.brain.models import AlgoFishHLOCModel, Signal, SignalEvent
+from cryptalgo.coredata.candles import CandleStore, DEFAULT_STORE_ROOT
 from cryptalgo.coredata.holdings import FeeModel, Account
-from cryptalgo.inputs.feed_agg import OHLC, AggPeriod
+from cryptalgo.coredata.rollup import RollupPyramid, rollup_ohlc
+from cryptalgo.inputs.feed_agg import OHLCBatch, AggPeriod
 import numpy as np
 import pandas as pd
 import logging
@@ -15,16 +19,36 @@ logging.getLogger(__name__).addHandler(logging.NullHandler())
 logger = logging.getLogger(__name__)
 
 
+
+def resample_ohlc(data: pd.DataFrame, agg_period: AggPeriod, rollups: RollupPyramid = None) -> pd.DataFrame:
+    """
+    Aggregates 5 minute candles up to the given period. Returns the data unchanged for FIVE_MINUTES. With rollups,
+    levels are computed once per distinct series and served from that cache afterwards; without, every call
+    aggregates again.
+    """
+    if agg_period == AggPeriod.FIVE_MINUTES:
+        return data
+    if agg_period not in [AggPeriod.FIFTEEN_MINUTES, AggPeriod.ONE_HOUR, AggPeriod.ONE_DAY]:
+        raise NotImplementedError("minimum backtest is 5 mins")
+    if rollups is None:
+        return rollup_ohlc(data, agg_period)
+    return rollups.get(data, agg_period)
+
+
+
 class BacktestHarness:
 
-    def __init__(self, alpha_model: AlgoFishHLOCModel, backtest_data: Path = None, seed_investment: float = 1000.0, brokerage_model: FeeModel = None, agg_period: AggPeriod = AggPeriod.FIVE_MINUTES) -> None:
+    def __init__(self, alpha_model: AlgoFishHLOCModel, backtest_data: Path = None, seed_investment: float = 1000.0, brokerage_model: FeeModel = None, agg_period: AggPeriod = AggPeriod.FIVE_MINUTES, candle_store: CandleStore = None, rollups: RollupPyramid = None, fixed_point: bool = False) -> None:
         self.alpha_model = alpha_model
         self.alpha_model.subscribe(self)
         self.data_path = backtest_data
         if self.data_path is not None:
             assert self.data_path.is_file()
+        # only needed to load backtest_data; get_candle_store creates the default one on first use
+        self.candle_store = candle_store
+        self.rollups = rollups
 
-        self.account = Account(start_cash_balance=seed_investment, default_currency='USD', default_trade_fee_model=brokerage_model)
+        self.account = Account(start_cash_balance=seed_investment, default_currency='USD', default_trade_fee_model=brokerage_model, fixed_point=fixed_point)
         self.seed_investment: Decimal = Decimal(seed_investment)
 
         self.last_buy_price = np.NaN
@@ -33,6 +57,8 @@ class BacktestHarness:
         self.end_price = Decimal()
 
         self.agg_period = agg_period
+        # the (aggregated) bars of the last backtest, for the equity curve
+        self.bars: pd.DataFrame = None
 
 
     @classmethod
@@ -43,16 +69,20 @@ class BacktestHarness:
 
 
     def generate_report(self) -> Tuple:
+        return self._build_report(self.account, self.start_price, self.end_price)
+
+
+    def _build_report(self, account: Account, start_price: Decimal, end_price: Decimal) -> Tuple:
         # start, end, price_chg, num_trades, start_bal, end_bal, gain, growth
         with decimal.localcontext() as ctx:
             ctx.prec = 10
-            start_bal = self.account.initial_cash_balance
-            end_bal = self.account.get_account_value({self.alpha_model.symbol: self.end_price})
+            start_bal = account.initial_cash_balance
+            end_bal = account.get_account_value({self.alpha_model.symbol: end_price})
             return (
-                round(self.start_price, 2),
-                round(self.end_price, 2),
-                (self.end_price / self.start_price) - Decimal('1.0'),
-                self.account.num_trades(),
+                round(start_price, 2),
+                round(end_price, 2),
+                (end_price / start_price) - Decimal('1.0'),
+                account.num_trades(),
                 start_bal,
                 end_bal,
                 end_bal - start_bal,
@@ -60,6 +90,40 @@ class BacktestHarness:
             )
 
 
+    @classmethod
+    def generate_risk_report_header(cls) -> Tuple:
+        return RISK_METRICS
+
+
+    def generate_equity_curve(self) -> pd.DataFrame:
+        """
+        Marks the account to market at every bar of the last backtest from the trade log and the close series alone,
+        without replaying the account.
+        :return: close, cash, position and equity per bar
+        """
+        if self.bars is None:
+            raise ValueError("no backtest has been run")
+        log = self.account.trade_history
+        rows = log.select(self.alpha_model.symbol)
+        signed = log.sides[rows] * log.amount[rows]
+        closes = self.bars['close'].to_numpy(dtype=np.float64)
+        cash, position, equity = equity_curve(self.bars.index.asi8, closes, log.time_ns[rows], signed,
+                                              -signed * log.price[rows] - log.fee[rows], float(self.seed_investment))
+        return pd.DataFrame({'close': closes, 'cash': cash, 'position': position, 'equity': equity},
+                            index=self.bars.index)
+
+
+    def generate_risk_report(self) -> Tuple:
+        """
+        :return: the generate_risk_report_header() metrics of the last backtest's equity curve
+        """
+        curve = self.generate_equity_curve()
+        metrics = risk_metrics(curve['equity'].to_numpy(), curve['position'].to_numpy(),
+                               self.account.trade_history.turnover(self.alpha_model.symbol),
+                               bars_per_year(self.agg_period))
+        return tuple([float(metrics[k]) for k in RISK_METRICS])
+
+
     def report_as_string(self) -> str:
         headers = BacktestHarness.generate_report_header()
         data = self.generate_report()
@@ -67,36 +131,22 @@ class BacktestHarness:
 
 
 
+    def get_candle_store(self) -> CandleStore:
+        """
+        :return: the candle_store given to the constructor, or else a store at DEFAULT_STORE_ROOT created now
+        """
+        if self.candle_store is None:
+            self.candle_store = CandleStore(DEFAULT_STORE_ROOT)
+        return self.candle_store
+
+
     def backtest_single_pass(self, data = None) -> pd.DataFrame:
         if data is None:
             # "symbol","time","high","low","open","close","volume","duration_secs"
-            data = pd.read_csv(self.data_path, sep=",", quotechar='"', parse_dates=['time'])
-            data.set_index('time', inplace=True)
-            data.sort_index(ascending=True, inplace=True)
-
-        if self.agg_period != AggPeriod.FIVE_MINUTES:
-            if self.agg_period == AggPeriod.FIFTEEN_MINUTES:
-                freq = '15T'
-                duration_secs = 900
-            elif self.agg_period == AggPeriod.ONE_HOUR:
-                freq = '1H'
-                duration_secs = 3600
-            elif self.agg_period == AggPeriod.ONE_DAY:
-                freq = '1D'
-                duration_secs = 3600 * 24
-            elif self.agg_period == AggPeriod.ONE_MINUTE:
-                raise NotImplementedError("minimum backtest is 5 mins")
-
-            data = data.resample(freq).agg({
-                'symbol': 'first',
-                'high': np.max,
-                'low': np.min,
-                'open': 'first',
-                'close': 'last',
-                'volume': np.sum,
-                'duration_secs': 'first',
-            })
-            data['duration_secs'] = duration_secs
+            data = self.get_candle_store().load_csv(self.data_path)
+
+        data = resample_ohlc(data, self.agg_period, self.rollups)
+        self.bars = data
 
         self.alpha_model.load_data(data)
         evts: pd.DataFrame = self.alpha_model.get_historical_signal_events()
@@ -105,28 +155,7 @@ class BacktestHarness:
             ctx.prec = 5
             logger.debug("processing {0} signal events".format(len(evts)))
             for idx, row in evts.iterrows():
-                if row['positions'] == Signal.BUY.value:
-                    price = Decimal(row['price'])
-                    # TODO: make this model driven
-                    shares = self.account.get_cash_balance() * Decimal(0.9) / price
-                    self.account.buy_shares(symbol=self.alpha_model.symbol, amount=shares, price=price)
-                    logger.debug("BUY {0} at {1} (total cash: {2}".format(
-                        self.account.get_num_shares_for(self.alpha_model.symbol),
-                        price,
-                        self.account.get_cash_balance(),
-                    ))
-                    self.last_buy_price = price
-                elif row['positions'] == Signal.SELL.value:
-                    price = Decimal(row['price'])
-                    # TODO: make this model driven
-                    shares = self.account.get_num_shares_for(self.alpha_model.symbol)
-                    self.account.sell_shares(symbol=self.alpha_model.symbol, amount=shares, price=price)
-                    logger.debug("SELL {0} at {1} (bought at {2}) for gain of {3}".format(
-                        self.account.get_num_shares_for(self.alpha_model.symbol),
-                        price,
-                        self.last_buy_price,
-                        "TBD", # TODO: create returns model
-                    ))
+                self._apply_position(self.account, row['positions'], row['price'], idx)
 
             self.start_price = Decimal(data.iloc[0]['open'])
             self.end_price = Decimal(data.iloc[-1]['close'])
@@ -146,78 +175,147 @@ class BacktestHarness:
 
             return evts
 
-    def backtest_by_replay(self, max_records: int = -1):
-        logger.info("starting backtest_by_replay...")
-        with open(self.data_path, "r") as f:
-            csvreader = csv.reader(f, delimiter=',', quotechar='"')
-            header = next(csvreader)
-            num_rows: int = 0
-            for row in csvreader:
-                # start = datetime.now()
-                num_rows += 1
-                if max_records > 0 and num_rows > max_records:
-                    break
-                hloc = OHLC.from_csv(row, timestamp_as_str=True)
-                if num_rows % 100 == 0:
-                    logger.debug("processing row #{1}: hloc={0}".format(hloc, num_rows))
-                # logger.debug("processing hloc={0}".format(hloc))
-                self.alpha_model.on_hloc(hloc)
-                # print((datetime.now() - start).microseconds)
-
-        self.start_price = self.alpha_model.hloc_data.iloc[0]['price']
-        self.end_price = self.alpha_model.hloc_data.iloc[-1]['price']
-        self.net_gain = (self.holdings * self.end_price) + self.cash - self.seed_inv
-
-        logger.info("Finished. Starting portfolio cash={5} and price={6} || Final portfolio cash={0} | holdings={1} at {2} ({3}) | net gain={4} ({7}) || baseline gain={8}".format(
-            self.cash,
-            self.holdings,
-            self.end_price,
-            self.holdings * self.end_price,
-            self.net_txn_gain,
-            self.seed_inv,
-            self.start_price,
-            self.net_gain / self.seed_inv,
-            self.start_price / self.end_price,
-        ))
-
-    def on_signal(self, signal: Signal):
-        logger.info("on signal {0}".format(signal))
-        if signal == Signal.BUY:
-            if self.holdings == 0.0:
-                price = self.alpha_model.hloc_data.iloc[-1]['price']
-                self.holdings = self.cash / price
-                logger.info("BUY {0} at {1} (total cash: {2}".format(
-                    self.holdings,
-                    price,
-                    self.cash,
-                ))
-                self.cash = 0.0
-                self.last_buy_price = price
-                self.num_trades += 1
-                if self.brokerage_model is not None:
-                    self.total_fees += self.brokerage_model.get_fee(self.holdings, price)
-            else:
-                logger.warning("Got a BUY signal with holdings")
-                # raise AssertionError()
-        elif signal == Signal.SELL:
-            if self.holdings > 0.0:
-                price = self.alpha_model.hloc_data.iloc[-1]['price']
-                self.cash = self.holdings * price
-                gain = (self.holdings * price) - (self.holdings * self.last_buy_price)
-                logger.info("SELL {0} at {1} (bought at {2}) for gain of {3}".format(
-                    self.holdings,
-                    price,
-                    self.last_buy_price,
-                    gain,
-                ))
-                self.net_txn_gain += gain
-                if self.brokerage_model is not None:
-                    self.total_fees += self.brokerage_model.get_fee(self.holdings, price)
-                self.holdings = 0.0
-                self.last_buy_price = 0.0
-                self.num_trades += 1
+
+    def _apply_position(self, account: Account, position: float, price: float, time: datetime = None) -> None:
+        """
+        Trades the account on a position change. Must be called inside a decimal context with prec = 5.
+        :param time: time of the bar, recorded with the trade
+        """
+        if position == Signal.BUY.value:
+            price = Decimal(price)
+            # TODO: make this model driven
+            shares = account.get_cash_balance() * Decimal(0.9) / price
+            account.buy_shares(symbol=self.alpha_model.symbol, amount=shares, price=price, time=time)
+            logger.debug("BUY {0} at {1} (total cash: {2}".format(
+                account.get_num_shares_for(self.alpha_model.symbol),
+                price,
+                account.get_cash_balance(),
+            ))
+            self.last_buy_price = price
+        elif position == Signal.SELL.value:
+            price = Decimal(price)
+            # TODO: make this model driven
+            shares = account.get_num_shares_for(self.alpha_model.symbol)
+            account.sell_shares(symbol=self.alpha_model.symbol, amount=shares, price=price, time=time)
+            logger.debug("SELL {0} at {1} (bought at {2}) for gain of {3}".format(
+                account.get_num_shares_for(self.alpha_model.symbol),
+                price,
+                self.last_buy_price,
+                "TBD", # TODO: create returns model
+            ))
+
+
+    def backtest_walk_forward(self, data: pd.DataFrame, dates: Iterable[datetime]) -> List[Tuple]:
+        """
+        Produces the same rows as running backtest_single_pass(data[data.index <= date]) followed by generate_report()
+        on a fresh harness for every date, but the model and account are only advanced over the bars that are new since
+        the previous date. The alpha model must be fresh and support update_signal / peek_signal.
+
+        A bar that is still forming at a date (e.g. the current hour with ONE_HOUR aggregation) is only peeked; it is
+        committed once a later date sees it complete.
+        :param data: candles with a sorted datetime index
+        :param dates: ascending cut off dates
+        :return: one generate_report() tuple per date
+        """
+        full = resample_ohlc(data, self.agg_period, self.rollups)
+        self.bars = full
+        raw_times = data.index
+        raw_closes = data['close'].to_numpy()
+        full_closes = full['close'].to_numpy()
+        # bucket of the aggregated series each raw bar falls into
+        bucket_of = np.searchsorted(full.index.values, raw_times.values, side='right') - 1
+
+        self.start_price = Decimal(full.iloc[0]['open'])
+        committed = 0
+        reports = []
+        with decimal.localcontext() as ctx:
+            ctx.prec = 5
+            for date in dates:
+                num_raw = raw_times.searchsorted(date, side='right')
+                if num_raw == 0:
+                    raise ValueError("no data on or before {0}".format(date))
+                tail = bucket_of[num_raw - 1]
+                tail_close = raw_closes[num_raw - 1]
+
+                # advance over the complete bars since the last date
+                for i in range(committed, tail):
+                    self._apply_position(self.account, self.alpha_model.update_signal(full_closes[i]), full_closes[i],
+                                         full.index[i])
+                committed = tail
+
+                # the tail bar may still be forming, so trade it on a copy
+                account = self.account
+                position = self.alpha_model.peek_signal(tail_close)
+                if position in (Signal.BUY.value, Signal.SELL.value):
+                    account = copy.deepcopy(self.account)
+                    self._apply_position(account, position, tail_close, raw_times[num_raw - 1])
+
+                self.end_price = Decimal(tail_close)
+                reports.append(self._build_report(account, self.start_price, self.end_price))
+        return reports
+
+
+    def backtest_by_replay(self, data: pd.DataFrame = None, max_records: int = -1, batch_size: int = 1) -> float:
+        """
+        Event driven backtest. The (aggregated) candles are streamed through the model bar by bar, as a live feed
+        would deliver them, and every SignalEvent the model fires trades the account at the event's bar close and
+        time (on_signal_event). The account, report and equity curve then reconcile with backtest_single_pass on the
+        same data as long as the model fires on the bars get_historical_signal_events reports.
+        :param max_records: replay only the first max_records bars
+        :param batch_size: hand the model blocks of this many bars through on_hloc_batch instead; signals still fire
+            per bar, and streaming models update their indicators vectorized
+        :return: bars replayed per second
+        """
+        if data is None:
+            data = self.get_candle_store().load_csv(self.data_path)
+        data = resample_ohlc(data, self.agg_period, self.rollups)
+        if max_records > 0:
+            data = data.iloc[:max_records]
+        self.bars = data
+        # every bar is the model's symbol, including those of empty periods
+        batch = OHLCBatch(
+            [self.alpha_model.symbol],
+            np.zeros(len(data), dtype=np.int16),
+            data.index.asi8,
+            np.ascontiguousarray(data[OHLCBatch.price_fields].to_numpy(dtype=np.float64).T),
+            data['duration_secs'].to_numpy(dtype=np.int64),
+        )
+        logger.info("starting backtest_by_replay over {0} bars...".format(len(batch)))
+
+        start = time.perf_counter()
+        with decimal.localcontext() as ctx:
+            ctx.prec = 5
+            if batch_size > 1:
+                for i in range(0, len(batch), batch_size):
+                    self.alpha_model.on_hloc_batch(batch[i:i + batch_size])
             else:
-                logger.warning("Got a SELL signal with no holdings")
-                # raise AssertionError()
+                on_hloc = self.alpha_model.on_hloc
+                for hloc in batch:
+                    on_hloc(hloc)
+        elapsed = time.perf_counter() - start
+        bars_per_sec = len(batch) / elapsed if elapsed > 0 else float('inf')
+
+        self.start_price = Decimal(data.iloc[0]['open'])
+        self.end_price = Decimal(data.iloc[-1]['close'])
+        logger.info("replayed {0} bars in {1:.3f}s ({2:.0f} bars/sec) with {3} trades".format(
+            len(batch), elapsed, bars_per_sec, self.account.num_trades()))
+        return bars_per_sec
 
 
+    def on_signal_event(self, event: SignalEvent) -> None:
+        """
+        Trades the account on a model signal during backtest_by_replay: a BUY spends 90% of the cash, a SELL sells
+        the whole position, at the price and time of the bar that fired it. Signals for another symbol, a BUY while
+        holding and a SELL with nothing to sell are ignored. Sets its own decimal context, so it gives the same numbers
+        when delivered from a QueuedListener's thread.
+        """
+        if event.symbol != self.alpha_model.symbol:
+            logger.warning("signal for {0} ignored, trading {1}".format(event.symbol, self.alpha_model.symbol))
+            return
+        held = self.account.get_num_shares_for(event.symbol)
+        if (event.signal == Signal.BUY and held > 0) or (event.signal == Signal.SELL and held == 0):
+            logger.debug("{0} signal at {1} ignored with holdings of {2}".format(event.signal.name, event.time, held))
+            return
+        with decimal.localcontext() as ctx:
+            ctx.prec = 5
+            self._apply_position(self.account, event.signal.value, event.price, event.time)
@@ -0,0 +1,192 @@
+import hashlib
+import json
+import os
+import pickle
+import tempfile
+from pathlib import Path
+from typing import Dict, Type, Union
+
+import pandas as pd
+
+from cryptalgo.backtest.backtest import BacktestHarness
+from cryptalgo.brain.models import AlgoFishHLOCModel
+from cryptalgo.coredata.holdings import FeeModel
+from cryptalgo.coredata.rollup import RollupPyramid, data_hash
+from cryptalgo.inputs.feed_agg import AggPeriod
+
+import logging
+
+logging.getLogger(__name__).addHandler(logging.NullHandler())
+logger = logging.getLogger(__name__)
+
+DEFAULT_CACHE_ROOT = Path('./data/cache/backtests')
+
+
+
+class BacktestCache:
+    """
+    On-disk memo of backtest results: the generate_report() tuple and, when asked for, the signal events frame.
+
+    Entries are keyed (make_key) by the candles' content hash, the model class, its `version` and parameters, the agg
+    period, seed investment and brokerage model, and pickled to <cache_dir>/<key[:2]>/<key>.pkl. Every write goes to a
+    temporary file in the same directory followed by an atomic rename, so any number of processes can share a cache
+    directory: readers never see a partial entry and concurrent writers of one key just store the same result twice.
+
+    The cache is bounded to about `max_bytes`: reads refresh an entry's mtime, and once a process has written a tenth
+    of the bound since it last looked, the least recently used entries are deleted down to 90% of it. Entries that
+    vanish or fail to load, e.g. under another process' eviction, count as misses.
+    """
+
+    # bump when the stored layout changes
+    format_version: int = 1
+
+
+    def __init__(self, cache_dir: Union[str, Path] = DEFAULT_CACHE_ROOT, max_bytes: int = 256 * 1024 * 1024) -> None:
+        self.cache_dir = Path(cache_dir)
+        self.max_bytes = max_bytes
+        self.bytes_since_evict = 0
+        self.hits = 0
+        self.misses = 0
+
+
+    @classmethod
+    def make_key(cls, data_key: str, model_cls: Type[AlgoFishHLOCModel], params: Dict, agg_period: AggPeriod,
+                 seed_investment: float = 1000.0, brokerage_model: FeeModel = None) -> str:
+        """
+        :param data_key: data_hash() of the candles
+        """
+        brokerage = None
+        if brokerage_model is not None:
+            brokerage = [type(brokerage_model).__module__, type(brokerage_model).__qualname__, vars(brokerage_model)]
+        description = json.dumps({
+            'format': cls.format_version,
+            'data': data_key,
+            'model': [model_cls.__module__, model_cls.__qualname__, getattr(model_cls, 'version', 0)],
+            'params': params,
+            'agg_period': agg_period.value,
+            'seed_investment': str(seed_investment),
+            'brokerage': brokerage,
+        }, sort_keys=True, default=str)
+        return hashlib.sha1(description.encode('utf-8')).hexdigest()
+
+
+    def _path_for(self, key: str) -> Path:
+        return Path(self.cache_dir, key[:2], key + ".pkl")
+
+
+    def get(self, key: str) -> Union[Dict, None]:
+        """
+        :return: the stored entry ({'report': tuple, 'signals': DataFrame or None}) or None on a miss
+        """
+        path = self._path_for(key)
+        try:
+            with open(path, "rb") as f:
+                entry = pickle.load(f)
+            os.utime(path)
+        except FileNotFoundError:
+            self.misses += 1
+            return None
+        except Exception as e:
+            logger.warning("dropping unreadable backtest cache entry {0}: {1}".format(path, e))
+            self._remove(path)
+            self.misses += 1
+            return None
+        self.hits += 1
+        return entry
+
+
+    def put(self, key: str, entry: Dict) -> None:
+        path = self._path_for(key)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        data = pickle.dumps(entry, protocol=pickle.HIGHEST_PROTOCOL)
+        fd, tmp = tempfile.mkstemp(dir=path.parent, prefix=".tmp-", suffix=".pkl")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(data)
+            os.replace(tmp, path)
+        except BaseException:
+            self._remove(Path(tmp))
+            raise
+        self.bytes_since_evict += len(data)
+        if self.bytes_since_evict >= self.max_bytes // 10:
+            self.evict()
+
+
+    def evict(self) -> int:
+        """
+        Deletes least recently used entries until the cache is within 90% of max_bytes.
+        :return: number of entries deleted
+        """
+        self.bytes_since_evict = 0
+        entries = []
+        total = 0
+        if not self.cache_dir.is_dir():
+            return 0
+        for shard in os.scandir(self.cache_dir):
+            if not shard.is_dir():
+                continue
+            for entry in os.scandir(shard.path):
+                if not entry.name.endswith(".pkl") or entry.name.startswith(".tmp-"):
+                    continue
+                try:
+                    stat = entry.stat()
+                except FileNotFoundError:
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, entry.path))
+                total += stat.st_size
+        if total <= self.max_bytes:
+            return 0
+        target = self.max_bytes * 0.9
+        removed = 0
+        for mtime, size, path in sorted(entries):
+            if total <= target:
+                break
+            self._remove(Path(path))
+            total -= size
+            removed += 1
+        logger.debug("evicted {0} backtest cache entries from {1}".format(removed, self.cache_dir))
+        return removed
+
+
+    def clear(self) -> None:
+        if not self.cache_dir.is_dir():
+            return
+        for shard in os.scandir(self.cache_dir):
+            if shard.is_dir():
+                for entry in os.scandir(shard.path):
+                    self._remove(Path(entry.path))
+
+
+    @staticmethod
+    def _remove(path: Path) -> None:
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+
+
+    def run(self, model_cls: Type[AlgoFishHLOCModel], params: Dict, data: pd.DataFrame, agg_period: AggPeriod,
+            seed_investment: float = 1000.0, brokerage_model: FeeModel = None, with_signals: bool = False,
+            symbol: str = None, data_key: str = None, rollups: RollupPyramid = None) -> Dict:
+        """
+        BacktestHarness.backtest_single_pass(data) for model_cls(symbol, **params), served from the cache when it can
+        be.
+        :param with_signals: the entry must hold the signal events frame too; an entry stored without one is rerun
+        :param symbol: default the symbol of the candles
+        :param data_key: data_hash(data), if the caller already has it
+        :return: {'report': generate_report() tuple, 'signals': signal events frame or None}
+        """
+        if data_key is None:
+            data_key = data_hash(data)
+        key = self.make_key(data_key, model_cls, params, agg_period, seed_investment, brokerage_model)
+        entry = self.get(key)
+        if entry is not None and (not with_signals or entry['signals'] is not None):
+            return entry
+        if symbol is None:
+            symbol = str(data['symbol'].iloc[0])
+        bt = BacktestHarness(model_cls(symbol, **params), seed_investment=seed_investment,
+                             brokerage_model=brokerage_model, agg_period=agg_period, rollups=rollups)
+        signals = bt.backtest_single_pass(data)
+        entry = {'report': bt.generate_report(), 'signals': signals if with_signals else None}
+        self.put(key, entry)
+        return entry
@@ -0,0 +1,221 @@
+from typing import List, Tuple, Dict
+
+import numpy as np
+import pandas as pd
+
+from cryptalgo.backtest.backtest import resample_ohlc
+from cryptalgo.backtest.metrics import RISK_METRICS, bars_per_year, forward_fill, risk_metrics
+from cryptalgo.inputs.feed_agg import AggPeriod
+
+import logging
+
+logging.getLogger(__name__).addHandler(logging.NullHandler())
+logger = logging.getLogger(__name__)
+
+
+
+class SMACParameterGrid:
+    """
+    Evaluates a whole grid of SMACModel (short_lb, long_lb) pairs in one pass with NumPy.
+
+    Every window mean is taken from a single cumulative sum of the close series, the crossovers for all parameter sets
+    are produced as a (params x time) matrix and the PnL is derived from the prices at the crossovers using the same
+    trading rules as BacktestHarness.backtest_single_pass (buy with 90% of cash, sell the whole position).
+
+    The results are approximate: balances are computed in float64, so they agree with the Decimal based Account to
+    within its 5 significant digit rounding (about 1e-3 relative) rather than digit for digit. Crossovers and trade
+    counts are exact. Use BacktestHarness (or ParameterSweep) for figures that must match it exactly.
+    """
+
+    # fraction of cash spent on a BUY; mirrors BacktestHarness.backtest_single_pass
+    buy_fraction: float = 0.9
+
+    # balances agree with BacktestHarness only to about 1e-3, see above
+    approximate: bool = True
+
+
+    def __init__(self, data: pd.DataFrame, params: List[Tuple[int, int]], seed_investment: float = 1000.0,
+                 fee_rate: float = 0.0, agg_period: AggPeriod = AggPeriod.FIVE_MINUTES, chunk_size: int = 64) -> None:
+        if len(params) == 0:
+            raise ValueError("at least one (short_lb, long_lb) pair is required")
+        self.data = resample_ohlc(data, agg_period)
+        self.params = params
+        self.short_lbs = np.array([p[0] for p in params], dtype=np.int64)
+        self.long_lbs = np.array([p[1] for p in params], dtype=np.int64)
+        self.seed_investment = seed_investment
+        self.fee_rate = fee_rate
+        self.agg_period = agg_period
+        self.chunk_size = chunk_size
+        self.closes: np.ndarray = self.data['close'].to_numpy(dtype=np.float64)
+        self.window_means: Dict[int, np.ndarray] = None
+
+
+    def get_window_means(self) -> Dict[int, np.ndarray]:
+        """
+        Calculates rolling(window, min_periods=1).mean() of the close for every distinct window in the grid from one
+        cumulative sum.
+        :return: dict of window -> array of means
+        """
+        if self.window_means is None:
+            closes = self.closes
+            n = len(closes)
+            valid = ~np.isnan(closes)
+            # shift by the first valid close to keep the cumulative sum small and precise
+            base = closes[valid][0] if valid.any() else 0.0
+            csum = np.concatenate(([0.0], np.cumsum(np.where(valid, closes - base, 0.0))))
+            ccount = np.concatenate(([0], np.cumsum(valid)))
+
+            # length of the run of identical closes ending at each bar; windows entirely inside a run are exact
+            idx = np.arange(n)
+            run_start = np.ones(n, dtype=bool)
+            run_start[1:] = closes[1:] != closes[:-1]
+            run_len = idx - np.maximum.accumulate(np.where(run_start, idx, 0)) + 1
+
+            self.window_means = {}
+            for w in np.unique(np.concatenate((self.short_lbs, self.long_lbs))):
+                lo = np.maximum(idx + 1 - w, 0)
+                total = csum[idx + 1] - csum[lo]
+                count = ccount[idx + 1] - ccount[lo]
+                with np.errstate(invalid='ignore', divide='ignore'):
+                    means = np.where(count > 0, total / count + base, np.nan)
+                means = np.where(run_len >= np.minimum(idx + 1, w), closes, means)
+                self.window_means[int(w)] = means
+        return self.window_means
+
+
+    def _signals(self, rows: slice) -> np.ndarray:
+        means = self.get_window_means()
+        short_lbs = self.short_lbs[rows]
+        long_lbs = self.long_lbs[rows]
+        short = np.stack([means[int(w)] for w in short_lbs])
+        long = np.stack([means[int(w)] for w in long_lbs])
+        n = len(self.closes)
+        return (short > long) & (np.arange(n)[np.newaxis, :] >= short_lbs[:, np.newaxis])
+
+
+    def _positions(self, signals: np.ndarray) -> np.ndarray:
+        positions = np.zeros(signals.shape, dtype=np.int8)
+        positions[:, 1:] = np.diff(signals.astype(np.int8), axis=1)
+        return positions
+
+
+    def get_signal_matrix(self) -> np.ndarray:
+        """
+        :return: (params x time) matrix equivalent to the 'signal' column of SMACModel.get_signal_df
+        """
+        return self._signals(slice(None)).astype(np.float64)
+
+
+    def get_position_matrix(self) -> np.ndarray:
+        """
+        :return: (params x time) matrix of crossovers; 1 = BUY, -1 = SELL, 0 = none
+        """
+        return self._positions(self._signals(slice(None)))
+
+
+    def get_account_values(self) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Replays the crossovers of every parameter set against the close series with array ops.
+        :return: (end account value, number of trades) per parameter set
+        """
+        closes = self.closes
+        n = len(closes)
+        f = self.fee_rate
+        b = self.buy_fraction
+        end_values = np.empty(len(self.params), dtype=np.float64)
+        num_trades = np.empty(len(self.params), dtype=np.int64)
+        idx = np.arange(n)
+
+        for start in range(0, len(self.params), self.chunk_size):
+            rows = slice(start, start + self.chunk_size)
+            signals = self._signals(rows)
+            positions = self._positions(signals)
+
+            # price of the most recent BUY at every bar
+            last_buy = np.maximum.accumulate(np.where(positions == 1, idx, -1), axis=1)
+            buy_price = closes[np.maximum(last_buy, 0)]
+
+            # every round trip multiplies cash by (1 - b - b*f) + b*(1 - f)*(sell / buy)
+            sells = positions == -1
+            with np.errstate(invalid='ignore', divide='ignore'):
+                factors = np.where(sells, (1.0 - b - b * f) + b * (1.0 - f) * (closes / buy_price), 1.0)
+            values = self.seed_investment * np.prod(factors, axis=1)
+
+            # an open position at the end is marked at the last close
+            holding = signals[:, -1]
+            open_factor = (1.0 - b - b * f) + b * (closes[-1] / buy_price[:, -1])
+            values = np.where(holding, values * open_factor, values)
+
+            end_values[rows] = values
+            num_trades[rows] = np.count_nonzero(positions, axis=1)
+
+        return end_values, num_trades
+
+
+    def generate_reports(self) -> List[Tuple]:
+        """
+        :return: one tuple per parameter set in the BacktestHarness.generate_report_header() layout; the balance
+            figures are approximate (see SMACParameterGrid)
+        """
+        start_price = float(self.data.iloc[0]['open'])
+        end_price = float(self.data.iloc[-1]['close'])
+        price_chg = (end_price / start_price) - 1.0
+        start_bal = float(self.seed_investment)
+        end_values, num_trades = self.get_account_values()
+        return [
+            (
+                round(start_price, 2),
+                round(end_price, 2),
+                price_chg,
+                int(num_trades[i]),
+                start_bal,
+                float(end_values[i]),
+                float(end_values[i]) - start_bal,
+                float(end_values[i]) / start_bal - 1.0,
+            )
+            for i in range(len(self.params))
+        ]
+
+
+    def get_equity_curves(self, rows: slice = slice(None)) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """
+        Marks every parameter set's account to market at every bar with the same rules as get_account_values and
+        metrics.equity_curve.
+        :return: (params x time) equity, (params x time) holding flags and traded notional per parameter set
+        """
+        closes = self.closes
+        n = len(closes)
+        f = self.fee_rate
+        b = self.buy_fraction
+        idx = np.arange(n)
+        signals = self._signals(rows)
+        positions = self._positions(signals)
+        last_buy = np.maximum.accumulate(np.where(positions == 1, idx, -1), axis=1)
+        buy_price = closes[np.maximum(last_buy, 0)]
+        sells = positions == -1
+        with np.errstate(invalid='ignore', divide='ignore'):
+            factors = np.where(sells, (1.0 - b - b * f) + b * (1.0 - f) * (closes / buy_price), 1.0)
+            # cash while flat is the seed times the round trips so far; while holding, mark the shares at the close,
+            # or the last one before it for bars without a close
+            flat_value = self.seed_investment * np.cumprod(factors, axis=1)
+            equity = np.where(signals, flat_value * ((1.0 - b - b * f) + b * (forward_fill(closes) / buy_price)),
+                              flat_value)
+            before = np.concatenate((np.full((len(flat_value), 1), float(self.seed_investment)), flat_value[:, :-1]),
+                                    axis=1)
+            notional = np.where(positions == 1, b * flat_value, 0.0) + \
+                np.where(sells, b * before * (closes / buy_price), 0.0)
+        return equity, signals, np.sum(notional, axis=1)
+
+
+    def generate_risk_reports(self) -> List[Tuple]:
+        """
+        :return: one tuple per parameter set in the BacktestHarness.generate_risk_report_header() layout, computed a
+            chunk of equity curves at a time
+        """
+        periods_per_year = bars_per_year(self.agg_period)
+        reports = []
+        for start in range(0, len(self.params), self.chunk_size):
+            equity, holding, notional = self.get_equity_curves(slice(start, start + self.chunk_size))
+            metrics = risk_metrics(equity, holding, notional, periods_per_year)
+            reports.extend(zip(*[metrics[k].tolist() for k in RISK_METRICS]))
+        return reports
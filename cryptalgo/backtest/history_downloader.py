@@ -1,73 +1,177 @@
-import datetime
-import os
+import logging
+import threading
 import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Dict, List, Tuple
+
 import cbpro
-import csv
-
-# columns=['time', 'low', 'high', 'open', 'close', 'volume']
-# ticker = 'ETH-USD'
-# out_dir = "/Users/dan/dev/code/projects/python/cryptotrader/data"
-# with open(os.path.join(out_dir, "{0}.csv".format(ticker)), "w") as out_file:
-#     writer = csv.writer(out_file, dialect="excel")
-#     writer.writerow(columns)
-#
-#     pub = cbpro.PublicClient()
-#     num_records = 0
-#     record_start = datetime.datetime(2017, 1, 1, 0, 0, 0)
-#     record_end = datetime.datetime(2021, 2, 15, 0, 0, 0)
-#     marker = record_start
-#     while marker < record_end:
-#         start = marker
-#         end = start + datetime.timedelta(minutes=5 * 300)
-#         res = pub.get_product_historic_rates(ticker, start=start, end=end, granularity=300)
-#         try:
-#             res2 = [[datetime.datetime.fromtimestamp(x[0]), x[1], x[2], x[3], x[4], x[5]] for x in res]
-#         except TypeError:
-#             print("TypeError; res={0}".format(res))
-#             break
-#         num_records += len(res)
-#         print("start: {0} len={1}".format(start, num_records))
-#         writer.writerows(res2)
-#         marker = end
-#         time.sleep(1)
-
-# wsClient = cbpro.WebsocketClient(url="wss://ws-feed.pro.coinbase.com",
-#                                 products="ETH-USD",
-#                                 channels=["ticker"])
-#
-# # Do other stuff...
-# wsClient.close()
-
-import cbpro, time
-
-
-
-class myWebsocketClient(cbpro.WebsocketClient):
-    def on_open(self):
-        self.url = "wss://ws-feed.pro.coinbase.com/"
-        self.products = ["LTC-USD"]
-        self.channels = ["ticker"]
-        self.message_count = 0
-        print("Lets count the messages!")
-
-
-    def on_message(self, msg):
-        self.message_count += 1
-        print(msg)
-        if 'price' in msg and 'type' in msg:
-            print("Message type:", msg["type"],
-                  "\t@ {:.3f}".format(float(msg["price"])))
-
-
-    def on_close(self):
-        print("-- Goodbye! --")
-
-
-
-wsClient = myWebsocketClient()
-wsClient.start()
-print(wsClient.url, wsClient.products)
-while (wsClient.message_count < 500):
-    print("\nmessage_count =", "{} \n".format(wsClient.message_count))
-    time.sleep(1)
-wsClient.close()
+import numpy as np
+
+from cryptalgo.coredata.candles import CandleStore, CandleSeries, DEFAULT_STORE_ROOT
+from cryptalgo.utils.ratelimit import TokenBucket
+
+logging.getLogger(__name__).addHandler(logging.NullHandler())
+logger = logging.getLogger(__name__)
+
+NANOS = 1000000000
+
+
+
+class HistoryDownloader:
+    """
+    Backfills candles for many products into a CandleStore.
+
+    Each product's range is split into windows of at most `max_candles` candles that are fetched concurrently under a
+    shared token bucket rate limit, with retries per window. Downloads resume from the last stored candle, so only
+    new data is requested. Windows are written to the store in time order; ranges the exchange returned no candles for
+    are recorded as gaps. If a window still fails after its retries, nothing after it is written for that product,
+    so the next run resumes from the hole.
+    """
+
+    max_candles: int = 300
+
+
+    def __init__(self, client, store: CandleStore, requests_per_sec: float = 4.0, max_workers: int = 4,
+                 retries: int = 3, retry_delay_sec: float = 1.0) -> None:
+        """
+        :param client: anything with cbpro.PublicClient's get_product_historic_rates(product, start, end, granularity)
+        """
+        self.client = client
+        self.store = store
+        self.bucket = TokenBucket(requests_per_sec, capacity=requests_per_sec)
+        self.max_workers = max_workers
+        self.retries = retries
+        self.retry_delay_sec = retry_delay_sec
+        self.request_ct = 0
+        self.failed: List[Tuple[str, datetime, datetime]] = []
+        self.lock = threading.Lock()
+
+
+    def get_windows(self, start: datetime, end: datetime, granularity: int) -> List[Tuple[int, int]]:
+        """
+        :return: (first, last) candle start times in epoch seconds for each request window covering [start, end)
+        """
+        first = int(_utc(start).timestamp())
+        first += (-first) % granularity
+        stop = int(_utc(end).timestamp())
+        span = self.max_candles * granularity
+        return [(t, min(t + span, stop) - granularity) for t in range(first, stop, span) if t < stop]
+
+
+    def fetch_window(self, product: str, first: int, last: int, granularity: int) -> List[List]:
+        """
+        Requests one window, retrying on errors.
+        :return: rows of [time, low, high, open, close, volume] within [first, last], oldest first
+        """
+        start = datetime.fromtimestamp(first, tz=timezone.utc)
+        end = datetime.fromtimestamp(last, tz=timezone.utc)
+        for attempt in range(self.retries + 1):
+            self.bucket.acquire()
+            with self.lock:
+                self.request_ct += 1
+            try:
+                res = self.client.get_product_historic_rates(product, start.isoformat(), end.isoformat(), granularity)
+                if not isinstance(res, list):
+                    raise ValueError("unexpected response: {0}".format(res))
+                rows = [row for row in res if first <= int(row[0]) <= last]
+                return sorted(rows, key=lambda row: row[0])
+            except Exception as e:
+                logger.warning("{0} {1}-{2} attempt {3} failed: {4}".format(product, start, end, attempt + 1, e))
+                if attempt < self.retries:
+                    time.sleep(self.retry_delay_sec * (attempt + 1))
+        raise IOError("giving up on {0} {1}-{2}".format(product, start, end))
+
+
+    def download(self, products: List[str], start: datetime, end: datetime, granularity: int = 300) -> Dict[str, int]:
+        """
+        Fetches [start, end) for every product, skipping what is already stored.
+        :return: product -> number of candles written
+        """
+        windows: Dict[str, List[Tuple[int, int]]] = {}
+        for product in products:
+            last = self.store.get_last_time(product, granularity)
+            product_start = _utc(start)
+            if last is not None:
+                product_start = max(product_start,
+                                    datetime.fromtimestamp(last // NANOS + granularity, tz=timezone.utc))
+            windows[product] = self.get_windows(product_start, end, granularity)
+            logger.info("{0}: {1} windows from {2}".format(product, len(windows[product]), product_start))
+
+        written = {product: 0 for product in products}
+        pending: Dict[str, Dict[int, List]] = {product: {} for product in products}
+        next_window = {product: 0 for product in products}
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            futures = {
+                executor.submit(self.fetch_window, product, first, last, granularity): (product, i)
+                for product in products for i, (first, last) in enumerate(windows[product])
+            }
+            for future in as_completed(futures):
+                product, i = futures[future]
+                try:
+                    pending[product][i] = future.result()
+                except IOError as e:
+                    logger.error(str(e))
+                    first, last = windows[product][i]
+                    self.failed.append((product, datetime.fromtimestamp(first, tz=timezone.utc),
+                                        datetime.fromtimestamp(last, tz=timezone.utc)))
+                    pending[product][i] = None
+
+                # write every window that is now contiguous with what is stored
+                while next_window[product] in pending[product]:
+                    rows = pending[product].pop(next_window[product])
+                    if rows is None:
+                        # leave the rest for the next run
+                        next_window[product] = len(windows[product])
+                        pending[product].clear()
+                        break
+                    first, last = windows[product][next_window[product]]
+                    written[product] += self._store_window(product, granularity, first, last, rows)
+                    next_window[product] += 1
+        return written
+
+
+    def _store_window(self, product: str, granularity: int, first: int, last: int, rows: List[List]) -> int:
+        expected = np.arange(first, last + granularity, granularity, dtype=np.int64)
+        times = np.array([int(row[0]) for row in rows], dtype=np.int64)
+        missing = np.setdiff1d(expected, times)
+        if len(missing) > 0:
+            # collapse consecutive missing candles into (start, end) ranges
+            breaks = np.flatnonzero(np.diff(missing) != granularity)
+            starts = np.concatenate(([missing[0]], missing[breaks + 1]))
+            ends = np.concatenate((missing[breaks], [missing[-1]]))
+            self.store.add_gaps(product, granularity, [(int(s) * NANOS, int(e) * NANOS) for s, e in zip(starts, ends)])
+        if len(rows) == 0:
+            return 0
+        # coinbase rows are [time, low, high, open, close, volume]
+        data = np.array([[float(x) for x in row[1:6]] for row in rows], dtype=np.float64)
+        values = dict(zip(['low', 'high', 'open', 'close', 'volume'], data.T))
+        self.store.append(product, granularity, times * NANOS, {k: values[k] for k in CandleSeries.columns})
+        return len(rows)
+
+
+
+def _utc(t: datetime) -> datetime:
+    return t.replace(tzinfo=timezone.utc) if t.tzinfo is None else t.astimezone(timezone.utc)
+
+
+
+if __name__ == '__main__':
+    logging.basicConfig(
+        level=logging.DEBUG,
+        format='%(asctime)s | %(levelname)s: [%(filename)s:%(funcName)s:%(lineno)d] %(message)s'
+    )
+
+    period: int = 300  # s
+    start: datetime = datetime(2021, 1, 1, 0, 0, 0)
+    end: datetime = datetime(2021, 6, 1, 0, 0, 0)
+
+    data_dir = Path(DEFAULT_STORE_ROOT)
+    data_dir.mkdir(parents=True, exist_ok=True)
+
+    downloader = HistoryDownloader(cbpro.PublicClient(), CandleStore(data_dir))
+    # products = ['BTC-USD', 'ETH-USD', 'LTC-USD', 'MATIC-USD', 'LINK-USD', 'DASH-USD', 'BCH-USD']
+    products = ['ATOM-USD', 'ALGO-USD', 'ZRX-USD', ]
+    res = downloader.download(products, start, end, period)
+    print("wrote {0} in {1} requests; failed windows: {2}".format(res, downloader.request_ct, downloader.failed))
@@ -0,0 +1,124 @@
+from typing import Dict, Tuple
+
+import numpy as np
+
+from cryptalgo.inputs.feed_agg import AggPeriod
+
+import logging
+
+logging.getLogger(__name__).addHandler(logging.NullHandler())
+logger = logging.getLogger(__name__)
+
+# Every metric below reduces along the last axis, so it takes one equity curve of shape (bars,) or a whole sweep's
+# curves stacked as (runs, bars) and returns a scalar or one value per run.
+
+MINUTES_PER_YEAR: float = 365.0 * 24 * 60
+
+RISK_METRICS: Tuple[str, ...] = ('max_drawdown', 'sharpe', 'sortino', 'exposure', 'turnover')
+
+
+
+def bars_per_year(agg_period: AggPeriod) -> float:
+    """
+    Crypto trades around the clock, so a year is 365 full days of bars.
+    """
+    return MINUTES_PER_YEAR / agg_period.value
+
+
+
+def forward_fill(values: np.ndarray) -> np.ndarray:
+    """
+    :return: values with every NaN replaced by the last non-NaN value before it along the last axis; leading NaNs
+        stay NaN
+    """
+    idx = np.where(np.isnan(values), 0, np.arange(values.shape[-1]))
+    np.maximum.accumulate(idx, axis=-1, out=idx)
+    return np.take_along_axis(values, idx, axis=-1)
+
+
+
+def equity_curve(bar_times: np.ndarray, closes: np.ndarray, trade_times: np.ndarray, signed_amounts: np.ndarray,
+                 cash_flows: np.ndarray, start_cash: float) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Marks a single instrument account to market at every bar from its trades, without replaying them. Each trade
+    lands on the last bar at or before its time and the bar is valued at its close after the trade. Bars without a
+    close (the empty periods of a rollup) are valued at the last close before them.
+    :param bar_times: ascending bar times, epoch ns
+    :param signed_amounts: trade amounts, positive for buys and negative for sells
+    :param cash_flows: cash each trade moved, fees included (negative for buys)
+    :return: (cash, position, equity) per bar
+    """
+    n = len(bar_times)
+    bars = np.searchsorted(bar_times, trade_times, side='right') - 1
+    if len(bars) > 0 and bars[0] < 0:
+        raise ValueError("trades before the first bar")
+    position = np.cumsum(np.bincount(bars, weights=signed_amounts, minlength=n))
+    cash = start_cash + np.cumsum(np.bincount(bars, weights=cash_flows, minlength=n))
+    marks = forward_fill(closes)
+    return cash, position, cash + np.where(position != 0, position * marks, 0.0)
+
+
+
+def returns(equity: np.ndarray) -> np.ndarray:
+    """
+    :return: simple bar to bar returns, one fewer than bars
+    """
+    with np.errstate(invalid='ignore', divide='ignore'):
+        return equity[..., 1:] / equity[..., :-1] - 1.0
+
+
+
+def max_drawdown(equity: np.ndarray) -> np.ndarray:
+    """
+    :return: largest fall from a running peak, as a fraction of the peak (0.25 = 25% below it)
+    """
+    peaks = np.maximum.accumulate(equity, axis=-1)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        return np.max(1.0 - equity / peaks, axis=-1)
+
+
+
+def sharpe_ratio(bar_returns: np.ndarray, periods_per_year: float) -> np.ndarray:
+    """
+    :return: annualised mean over standard deviation of the returns; NaN where they don't vary
+    """
+    std = np.std(bar_returns, axis=-1, ddof=1)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        return np.where(std > 0, np.mean(bar_returns, axis=-1) / std, np.nan) * np.sqrt(periods_per_year)
+
+
+
+def sortino_ratio(bar_returns: np.ndarray, periods_per_year: float) -> np.ndarray:
+    """
+    :return: annualised mean return over downside deviation (root mean square of the losses); NaN without losses
+    """
+    downside = np.sqrt(np.mean(np.minimum(bar_returns, 0.0) ** 2, axis=-1))
+    with np.errstate(invalid='ignore', divide='ignore'):
+        return np.where(downside > 0, np.mean(bar_returns, axis=-1) / downside, np.nan) * np.sqrt(periods_per_year)
+
+
+
+def exposure(position: np.ndarray) -> np.ndarray:
+    """
+    :return: fraction of bars spent holding a position
+    """
+    return np.mean(position != 0, axis=-1)
+
+
+
+def risk_metrics(equity: np.ndarray, position: np.ndarray, traded_notional: np.ndarray,
+                 periods_per_year: float) -> Dict[str, np.ndarray]:
+    """
+    :param traded_notional: total amount * price traded per run
+    :return: RISK_METRICS name -> value(s); turnover is traded notional over mean equity
+    """
+    bar_returns = returns(equity)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        turnover = traded_notional / np.mean(equity, axis=-1)
+    return {
+        'max_drawdown': max_drawdown(equity),
+        'sharpe': sharpe_ratio(bar_returns, periods_per_year),
+        'sortino': sortino_ratio(bar_returns, periods_per_year),
+        'exposure': exposure(position),
+        'turnover': turnover,
+    }
@@ -0,0 +1,189 @@
+import json
+import shutil
+import tempfile
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+from typing import Dict, List, Tuple, Type
+
+import numpy as np
+import pandas as pd
+
+from cryptalgo.backtest.backtest import BacktestHarness
+from cryptalgo.backtest.cache import BacktestCache
+from cryptalgo.brain.models import AlgoFishHLOCModel
+from cryptalgo.coredata.holdings import FeeModel
+from cryptalgo.coredata.rollup import RollupPyramid, data_hash
+from cryptalgo.inputs.feed_agg import AggPeriod
+
+import logging
+
+logging.getLogger(__name__).addHandler(logging.NullHandler())
+logger = logging.getLogger(__name__)
+
+
+
+class SharedCandles:
+    """
+    A candle DataFrame published once to memory-mapped .npy files. Worker processes map the same pages instead of
+    receiving a pickled copy of the frame with every task.
+    """
+
+    price_columns: List[str] = ['high', 'low', 'open', 'close', 'volume']
+
+
+    def __init__(self, directory: Path) -> None:
+        self.directory = Path(directory)
+
+
+    @classmethod
+    def publish(cls, data: pd.DataFrame, directory: Path = None):
+        if type(data.index) is not pd.DatetimeIndex:
+            raise ValueError("dataframe must have datetime index")
+        if directory is None:
+            directory = Path(tempfile.mkdtemp(prefix="cryptalgo-candles-"))
+        directory = Path(directory)
+        directory.mkdir(parents=True, exist_ok=True)
+
+        index = data.index
+        tz = str(index.tz) if index.tz is not None else None
+        if index.tz is not None:
+            index = index.tz_convert('UTC').tz_localize(None)
+        np.save(directory / "time.npy", index.values.astype('datetime64[ns]').view(np.int64))
+        np.save(directory / "prices.npy", np.ascontiguousarray(data[cls.price_columns].to_numpy(dtype=np.float64)))
+        np.save(directory / "duration_secs.npy", data['duration_secs'].to_numpy(dtype=np.int64))
+        with open(directory / "meta.json", "w") as f:
+            json.dump({"symbol": str(data['symbol'].iloc[0]), "tz": tz}, f)
+        return cls(directory)
+
+
+    def get_symbol(self) -> str:
+        with open(self.directory / "meta.json", "r") as f:
+            return json.load(f)['symbol']
+
+
+    def load(self) -> pd.DataFrame:
+        """
+        Maps the published arrays into a DataFrame laid out like cb_backtest.load_dataframe. The price columns are a
+        read-only view onto the mapped file.
+        """
+        with open(self.directory / "meta.json", "r") as f:
+            meta = json.load(f)
+        times = np.load(self.directory / "time.npy", mmap_mode='r')
+        prices = np.load(self.directory / "prices.npy", mmap_mode='r')
+        durations = np.load(self.directory / "duration_secs.npy", mmap_mode='r')
+
+        index = pd.DatetimeIndex(np.asarray(times).view('datetime64[ns]'), name='time')
+        if meta['tz'] is not None:
+            index = index.tz_localize('UTC').tz_convert(meta['tz'])
+        df = pd.DataFrame(prices, index=index, columns=self.price_columns, copy=False)
+        df.insert(0, 'symbol', meta['symbol'])
+        df['duration_secs'] = np.asarray(durations)
+        return df
+
+
+    def get_rollup_dir(self) -> Path:
+        return self.directory / "rollups"
+
+
+    def close(self) -> None:
+        shutil.rmtree(self.directory, ignore_errors=True)
+
+
+
+# candle data mapped once per worker process by _init_worker
+_worker_data: pd.DataFrame = None
+_worker_symbol: str = None
+_worker_seed_investment: float = None
+_worker_brokerage_model: FeeModel = None
+_worker_rollups: RollupPyramid = None
+_worker_cache: BacktestCache = None
+_worker_data_key: str = None
+
+
+
+def _init_worker(directory: str, seed_investment: float, brokerage_model: FeeModel, cache: BacktestCache = None,
+                 data_key: str = None) -> None:
+    global _worker_data, _worker_symbol, _worker_seed_investment, _worker_brokerage_model, _worker_rollups
+    global _worker_cache, _worker_data_key
+    _worker_cache = cache
+    _worker_data_key = data_key
+    shared = SharedCandles(Path(directory))
+    _worker_data = shared.load()
+    _worker_symbol = shared.get_symbol()
+    _worker_seed_investment = seed_investment
+    _worker_brokerage_model = brokerage_model
+    _worker_rollups = RollupPyramid(shared.get_rollup_dir())
+
+
+
+def _run_job(job: Tuple[Type[AlgoFishHLOCModel], Dict, AggPeriod]) -> Tuple:
+    model_cls, params, agg_period = job
+    if _worker_cache is not None:
+        return _worker_cache.run(model_cls, params, _worker_data, agg_period, _worker_seed_investment,
+                                 _worker_brokerage_model, symbol=_worker_symbol, data_key=_worker_data_key,
+                                 rollups=_worker_rollups)['report']
+    model = model_cls(_worker_symbol, **params)
+    bt = BacktestHarness(model, seed_investment=_worker_seed_investment, brokerage_model=_worker_brokerage_model,
+                         agg_period=agg_period, rollups=_worker_rollups)
+    bt.backtest_single_pass(_worker_data)
+    return bt.generate_report()
+
+
+
+class ParameterSweep:
+    """
+    Runs BacktestHarness.backtest_single_pass for many (model_cls, params, agg_period) jobs on a process pool. The
+    candles are published once through SharedCandles, together with every agg period level the jobs need, which is
+    rolled up once here and memory-mapped by the workers; results come back in job order.
+
+    With a BacktestCache, jobs already in it are answered up front and only the rest go to the pool, whose workers
+    store their results in the same cache; a sweep that is entirely cached never starts the pool.
+    """
+
+    def __init__(self, data: pd.DataFrame, max_workers: int = None, seed_investment: float = 1000.0,
+                 brokerage_model: FeeModel = None, chunksize: int = 1, cache: BacktestCache = None) -> None:
+        self.data = data
+        self.max_workers = max_workers
+        self.seed_investment = seed_investment
+        self.brokerage_model = brokerage_model
+        self.chunksize = chunksize
+        self.cache = cache
+
+
+    def run(self, jobs: List[Tuple[Type[AlgoFishHLOCModel], Dict, AggPeriod]]) -> List[Tuple]:
+        """
+        :param jobs: list of (model class, model kwargs other than symbol, agg period)
+        :return: list of BacktestHarness.generate_report() tuples, one per job and in the same order
+        """
+        reports: List[Tuple] = [None] * len(jobs)
+        data_key = None
+        if self.cache is not None:
+            data_key = data_hash(self.data)
+            for i, (model_cls, params, agg_period) in enumerate(jobs):
+                entry = self.cache.get(BacktestCache.make_key(data_key, model_cls, params, agg_period,
+                                                              self.seed_investment, self.brokerage_model))
+                if entry is not None:
+                    reports[i] = entry['report']
+        missing = [i for i, report in enumerate(reports) if report is None]
+        if len(missing) == 0:
+            logger.info("all {0} backtests served from the cache".format(len(jobs)))
+            return reports
+        for i, report in zip(missing, self._run_pool([jobs[i] for i in missing], data_key)):
+            reports[i] = report
+        return reports
+
+
+    def _run_pool(self, jobs: List[Tuple[Type[AlgoFishHLOCModel], Dict, AggPeriod]], data_key: str) -> List[Tuple]:
+        shared = SharedCandles.publish(self.data)
+        rollups = RollupPyramid(shared.get_rollup_dir())
+        # load the published copy, so the levels are keyed exactly as the workers will look them up
+        rollups.get_all(shared.load(), sorted(set([j[2] for j in jobs if j[2] != AggPeriod.FIVE_MINUTES]),
+                                              key=lambda p: p.value))
+        logger.info("running {0} backtests from {1}".format(len(jobs), shared.directory))
+        try:
+            with ProcessPoolExecutor(max_workers=self.max_workers, initializer=_init_worker,
+                                     initargs=(str(shared.directory), self.seed_investment,
+                                               self.brokerage_model, self.cache, data_key)) as executor:
+                return list(executor.map(_run_job, jobs, chunksize=self.chunksize))
+        finally:
+            shared.close()
@@ -0,0 +1,202 @@
+import math
+from typing import List
+
+import numpy as np
+import pandas as pd
+
+import logging
+
+logging.getLogger(__name__).addHandler(logging.NullHandler())
+logger = logging.getLogger(__name__)
+
+
+
+class RollingMean:
+    """
+    Streaming equivalent of pandas `rolling(window=window, min_periods=1).mean()`.
+
+    The last `window` values are kept in a fixed size ring buffer alongside a running (Kahan compensated) sum, so every
+    update is O(1) no matter how long the history is. The add/remove order and the compensation terms follow the pandas
+    rolling kernel so the streamed means are bit-for-bit identical to the batch calculation.
+    """
+
+    def __init__(self, window: int) -> None:
+        if window is None or window < 1:
+            raise ValueError("window must be a positive integer; window={0}".format(window))
+        self.window: int = window
+        self.buffer: List[float] = [math.nan] * window
+        self.pos: int = 0
+        self.count: int = 0
+        self.nobs: int = 0
+        self.neg_ct: int = 0
+        self.sum_x: float = 0.0
+        self.compensation_add: float = 0.0
+        self.compensation_remove: float = 0.0
+        self.num_consecutive_same_value: int = 0
+        self.prev_value: float = math.nan
+        self.value: float = math.nan
+
+
+    def update(self, value: float) -> float:
+        """
+        Pushes a new value into the window and returns the updated mean.
+        :param value: the newest observation (NaN is treated as missing, as pandas does)
+        :return: the mean over the last `window` observations
+        """
+        if self.count == 0 or self.window == 1:
+            self.sum_x = self.compensation_add = self.compensation_remove = 0.0
+            self.nobs = self.neg_ct = 0
+            self.num_consecutive_same_value = 0
+            self.prev_value = value
+        elif self.count >= self.window:
+            self._remove(self.buffer[self.pos])
+
+        self._add(value)
+        self.buffer[self.pos] = value
+        self.pos = (self.pos + 1) % self.window
+        self.count += 1
+        self.value = self._calc()
+        return self.value
+
+
+    def peek(self, value: float) -> float:
+        """
+        Returns the mean update(value) would produce without changing the window.
+        """
+        state = (self.pos, self.count, self.nobs, self.neg_ct, self.sum_x, self.compensation_add,
+                 self.compensation_remove, self.num_consecutive_same_value, self.prev_value, self.value)
+        slot = self.buffer[self.pos]
+        result = self.update(value)
+        (self.pos, self.count, self.nobs, self.neg_ct, self.sum_x, self.compensation_add,
+         self.compensation_remove, self.num_consecutive_same_value, self.prev_value, self.value) = state
+        self.buffer[self.pos] = slot
+        return result
+
+
+    def update_many(self, values: np.ndarray) -> np.ndarray:
+        """
+        Pushes a block of values by calling update on each. This is still a Python loop: a cumsum over the window
+        would round differently from pandas' compensated rolling sum, and the means must match it exactly.
+        :return: the mean after each value
+        """
+        out = np.empty(len(values), dtype=np.float64)
+        update = self.update
+        for i, value in enumerate(np.asarray(values, dtype=np.float64).tolist()):
+            out[i] = update(value)
+        return out
+
+
+    def _add(self, val: float) -> None:
+        if val == val:
+            self.nobs += 1
+            y = val - self.compensation_add
+            t = self.sum_x + y
+            self.compensation_add = t - self.sum_x - y
+            self.sum_x = t
+            if math.copysign(1.0, val) < 0:
+                self.neg_ct += 1
+            if val == self.prev_value:
+                self.num_consecutive_same_value += 1
+            else:
+                self.num_consecutive_same_value = 1
+            self.prev_value = val
+
+
+    def _remove(self, val: float) -> None:
+        if val == val:
+            self.nobs -= 1
+            y = - val - self.compensation_remove
+            t = self.sum_x + y
+            self.compensation_remove = t - self.sum_x - y
+            self.sum_x = t
+            if math.copysign(1.0, val) < 0:
+                self.neg_ct -= 1
+
+
+    def _calc(self) -> float:
+        if self.nobs <= 0:
+            return math.nan
+        result = self.sum_x / self.nobs
+        if self.num_consecutive_same_value >= self.nobs:
+            result = self.prev_value
+        elif self.neg_ct == 0 and result < 0:
+            result = 0.0
+        elif self.neg_ct == self.nobs and result > 0:
+            result = 0.0
+        return result
+
+
+
+class ExponentialMean:
+    """
+    Streaming equivalent of pandas `ewm(span=span, adjust=False).mean()`.
+
+    Each update applies the recursive form y[t] = (1 - alpha) * y[t-1] + alpha * x[t] in O(1). The weight bookkeeping
+    (including the decay applied across missing values) follows the pandas ewm kernel so results match it exactly.
+    """
+
+    def __init__(self, span: float) -> None:
+        if span is None or span < 1:
+            raise ValueError("span must satisfy span >= 1; span={0}".format(span))
+        self.span: float = span
+        com = (span - 1) / 2.0
+        self.alpha: float = 1.0 / (1.0 + com)
+        self.old_wt_factor: float = 1.0 - self.alpha
+        self.old_wt: float = 1.0
+        self.count: int = 0
+        self.value: float = math.nan
+
+
+    def update(self, value: float) -> float:
+        """
+        Folds a new value into the average and returns it.
+        :param value: the newest observation (NaN is treated as missing, as pandas does)
+        :return: the updated exponentially weighted mean
+        """
+        weighted = self.value
+        if self.count == 0:
+            weighted = value
+            self.old_wt = 1.0
+        elif weighted == weighted:
+            self.old_wt *= self.old_wt_factor
+            if value == value:
+                # avoid numerical errors on constant series
+                if weighted != value:
+                    weighted = self.old_wt * weighted + self.alpha * value
+                    weighted /= (self.old_wt + self.alpha)
+                self.old_wt = 1.0
+        elif value == value:
+            weighted = value
+        self.count += 1
+        self.value = weighted
+        return weighted
+
+
+    def peek(self, value: float) -> float:
+        """
+        Returns the mean update(value) would produce without changing the state.
+        """
+        state = (self.old_wt, self.count, self.value)
+        result = self.update(value)
+        self.old_wt, self.count, self.value = state
+        return result
+
+
+    def update_many(self, values: np.ndarray) -> np.ndarray:
+        """
+        Folds in a block of values with pandas' ewm kernel in one call, seeded with the current average. Equal to
+        calling update on each value: after any non-missing value old_wt is back at 1, so the recursion only carries
+        the average itself. Short blocks (where the pandas call costs more than it saves), blocks with missing values
+        and a state still decaying across missing values fall back to a Python loop calling update on each value.
+        :return: the average after each value
+        """
+        values = np.asarray(values, dtype=np.float64)
+        if len(values) < 32 or np.isnan(values).any() or \
+                (self.count > 0 and (self.old_wt != 1.0 or self.value != self.value)):
+            return np.array([self.update(v) for v in values.tolist()], dtype=np.float64)
+        seeded = values if self.count == 0 else np.concatenate(([self.value], values))
+        out = pd.Series(seeded).ewm(span=self.span, adjust=False).mean().to_numpy()[len(seeded) - len(values):]
+        self.old_wt = 1.0
+        self.count += len(values)
+        self.value = float(out[-1])
+        return out
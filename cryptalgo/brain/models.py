@@ -2,6 +2,7 @@ import abc
 import time
 from datetime import datetime
 from enum import Enum
+from typing import Tuple
 import matplotlib.pyplot as plt
 import mplfinance as mpf
 
@@ -10,7 +11,9 @@ import numpy as np
 
 import logging
 
-from cryptalgo.inputs.feed_agg import OHLC
+from cryptalgo.brain.indicators import RollingMean, ExponentialMean
+from cryptalgo.inputs.dispatch import OverflowPolicy, wrap_listener
+from cryptalgo.inputs.feed_agg import OHLC, OHLCBatch
 
 logging.getLogger(__name__).addHandler(logging.NullHandler())
 logger = logging.getLogger(__name__)
@@ -33,17 +36,45 @@ class SignalEvent:
 
 
 
+def next_positions(num_hlocs: int, last_signal: float, lookback: int, fast: np.ndarray,
+                   slow: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Vectorized form of the models' _next_signal over a block of bars.
+    :param num_hlocs: bars seen before the block
+    :param last_signal: signal of the bar before the block
+    :return: signal and position change for every bar of the block
+    """
+    counts = num_hlocs + np.arange(len(fast))
+    signals = np.where((counts >= lookback) & (fast > slow), 1.0, 0.0)
+    positions = signals - np.concatenate(([last_signal], signals[:-1]))
+    positions[counts == 0] = 0.0
+    return signals, positions
+
+
+
 class AlgoFishHLOCModel(metaclass=abc.ABCMeta):
 
+    # part of BacktestCache keys; bump when a change alters the signals a model produces
+    version: int = 1
+
+
     def __init__(self, symbol: str, ) -> None:
         self.hloc_data: pd.DataFrame = pd.DataFrame(columns=OHLC.get_fields()).drop(columns=['time'])
         self.listeners: [] = []
         self.symbol = symbol
 
 
-    def subscribe(self, listener):
-        if hasattr(listener, "on_signal") and callable(listener.on_signal):
+    def subscribe(self, listener, policy: OverflowPolicy = None, max_queue: int = 1000):
+        """
+        Listeners implement on_signal(signal: Signal), or on_signal_event(event: SignalEvent) to also get the symbol,
+        time and price of the bar that fired it.
+        :param policy: deliver signals to this listener from its own queue and thread (see QueuedListener)
+        :return: the subscribed listener, i.e. the QueuedListener when a policy is given
+        """
+        if callable(getattr(listener, "on_signal", None)) or callable(getattr(listener, "on_signal_event", None)):
+            listener = wrap_listener(listener, policy, max_queue)
             self.listeners.append(listener)
+            return listener
         else:
             raise TypeError()
 
@@ -54,11 +85,56 @@ class AlgoFishHLOCModel(metaclass=abc.ABCMeta):
         self.hloc_data = data
 
 
+    def fire_signal(self, signal: Signal, hloc) -> None:
+        if logger.isEnabledFor(logging.INFO):
+            logger.info('generated {0} signal for {1}'.format(signal.name, hloc))
+        event = None
+        for l in self.listeners:
+            if hasattr(l, "on_signal_event"):
+                if event is None:
+                    event = SignalEvent(hloc.time, hloc.symbol, signal, hloc.close)
+                l.on_signal_event(event)
+            else:
+                l.on_signal(signal)
+
+
     @abc.abstractmethod
     def on_hloc(self, hloc):
         raise NotImplementedError
 
 
+    def on_hloc_batch(self, batch: OHLCBatch):
+        """
+        Takes a block of bars at once (see OHLCSource.publish_batch). Models with streaming state override this with
+        vectorized updates; by default the bars go through on_hloc one at a time.
+        """
+        for hloc in batch:
+            self.on_hloc(hloc)
+
+
+    def select_symbol(self, batch: OHLCBatch) -> OHLCBatch:
+        """
+        :return: the rows of the batch for this model's symbol
+        """
+        mask = np.isin(batch.symbol_ids, [i for i, s in enumerate(batch.symbols) if s == self.symbol])
+        if mask.all():
+            return batch
+        logger.warning("on_hloc_batch rec'd {0} bars of other symbols. Accepts {1}".format(
+            int((~mask).sum()), self.symbol))
+        return batch[mask]
+
+
+    def fire_signals(self, positions: np.ndarray, batch: OHLCBatch) -> None:
+        """
+        Fires a SELL or BUY for every -1 / 1 in positions, with the matching bar of the batch.
+        """
+        for i in np.flatnonzero(positions != 0).tolist():
+            if positions[i] == -1:
+                self.fire_signal(Signal.SELL, batch[i])
+            elif positions[i] == 1:
+                self.fire_signal(Signal.BUY, batch[i])
+
+
     @abc.abstractmethod
     def get_historical_signal_events(self):
         raise NotImplementedError()
@@ -75,12 +151,20 @@ class AlgoFishHLOCModel(metaclass=abc.ABCMeta):
 
 class SMACModel(AlgoFishHLOCModel):
 
-    def __init__(self, symbol: str, short_lb: int = 50, long_lb: int = 120, max_hlocs: int = 2000) -> None:
+    def __init__(self, symbol: str, short_lb: int = 50, long_lb: int = 120, max_hlocs: int = 2000,
+                 streaming: bool = False) -> None:
         super().__init__(symbol)
         self.short_lb = short_lb
         self.long_lb = long_lb
         self.max_hlocs = max_hlocs
 
+        # streaming state: running means over ring buffers so on_hloc is O(1) per bar
+        self.streaming = streaming
+        self.short_mav = RollingMean(short_lb)
+        self.long_mav = RollingMean(long_lb)
+        self.num_hlocs = 0
+        self.last_signal = 0.0
+
 
     def get_signal_df(self, data_limit: int = -1, data_limit_on_tail: bool = True) -> pd.DataFrame:
         data_df = self.hloc_data
@@ -115,12 +199,47 @@ class SMACModel(AlgoFishHLOCModel):
         return buysells_df
 
 
+    def update_signal(self, close: float) -> float:
+        """
+        Advances the streaming moving averages by one bar. Mirrors the batch calculation in get_signal_df.
+        :param close: the close price of the newest bar
+        :return: the position change for the bar (1.0 = BUY, -1.0 = SELL, 0.0 = no change)
+        """
+        signal, position = self._next_signal(self.short_mav.update(close), self.long_mav.update(close))
+        self.last_signal = signal
+        self.num_hlocs += 1
+        return position
+
+
+    def peek_signal(self, close: float) -> float:
+        """
+        Returns the position change update_signal(close) would produce without advancing the model.
+        """
+        return self._next_signal(self.short_mav.peek(close), self.long_mav.peek(close))[1]
+
+
+    def _next_signal(self, short_mav: float, long_mav: float) -> Tuple[float, float]:
+        signal = 1.0 if self.num_hlocs >= self.short_lb and short_mav > long_mav else 0.0
+        position = signal - self.last_signal if self.num_hlocs > 0 else 0.0
+        return signal, position
+
+
     # @timeme
     def on_hloc(self, hloc):
         if hloc.symbol != self.symbol:
             logger.warning("on_hloc rec'd mismatched symbol. Accepts {0}, got {1}".format(self.symbol, hloc.symbol))
             return
 
+        if self.streaming:
+            # fires on every crossover of get_signal_df, including those before long_lb bars, so a replay trades
+            # the same positions as the historical signals
+            position = self.update_signal(hloc.close)
+            if position == -1:
+                self.fire_signal(Signal.SELL, hloc)
+            elif position == 1:
+                self.fire_signal(Signal.BUY, hloc)
+            return
+
         # append to data
         # logger.debug("on hloc {0}".format(hloc))
         self.hloc_data = self.hloc_data.append(hloc.to_pandas_series(dt_index=True))
@@ -130,13 +249,9 @@ class SMACModel(AlgoFishHLOCModel):
 
             # fire events
             if signal_df['positions'].iloc[-1] == -1:
-                logger.info('generated SELL signal for {0}'.format(hloc))
-                for l in self.listeners:
-                    l.on_signal(Signal.SELL)
+                self.fire_signal(Signal.SELL, hloc)
             elif signal_df['positions'].iloc[-1] == 1:
-                logger.info('generated BUY signal for {0}'.format(hloc))
-                for l in self.listeners:
-                    l.on_signal(Signal.BUY)
+                self.fire_signal(Signal.BUY, hloc)
 
         # replace data if too long
         if len(self.hloc_data) > self.max_hlocs:
@@ -146,6 +261,35 @@ class SMACModel(AlgoFishHLOCModel):
         #     signal_df.to_csv("./data/signal_model.csv")
 
 
+    def on_hloc_batch(self, batch: OHLCBatch):
+        if not self.streaming:
+            super().on_hloc_batch(batch)
+            return
+        batch = self.select_symbol(batch)
+        if len(batch) == 0:
+            return
+        closes = batch.close
+        signals, positions = next_positions(self.num_hlocs, self.last_signal, self.short_lb,
+                                            self.short_mav.update_many(closes), self.long_mav.update_many(closes))
+        self.last_signal = float(signals[-1])
+        self.num_hlocs += len(batch)
+        self.fire_signals(positions, batch)
+
+
+    def visualize(self, signal_df: pd.DataFrame = None):
+        logger.debug("visualizing...")
+        if signal_df is None:
+            signal_df = self.get_signal_df().copy()
+        signal_df['close'] = self.hloc_data['close']
+        apds = [
+            mpf.make_addplot(signal_df['short_mav'], type='line', color='g'),
+            mpf.make_addplot(signal_df['long_mav'], type='line', color='b'),
+            mpf.make_addplot(signal_df.apply(lambda x: x['close'] if x['positions'] == Signal.SELL.value else np.NaN, axis=1), type='scatter', markersize=200, marker='v'),
+            mpf.make_addplot(signal_df.apply(lambda x: x['close'] if x['positions'] == Signal.BUY.value else np.NaN, axis=1), type='scatter', markersize=200, marker='^'),
+        ]
+        mpf.plot(self.hloc_data, volume=True, addplot=apds, type='line')
+
+
 class MACDModel(AlgoFishHLOCModel):
 
     def __init__(self, symbol: str, low_ewm: int, high_ewm: int) -> None:
@@ -153,10 +297,68 @@ class MACDModel(AlgoFishHLOCModel):
         self.low_ewm = low_ewm
         self.high_ewm = high_ewm
         self.signal_df = None
+        self.signal_df_key = None
+
+        # streaming state: recursive EWMs so on_hloc is O(1) per bar and never builds a DataFrame
+        self.short_ewm = ExponentialMean(low_ewm)
+        self.long_ewm = ExponentialMean(high_ewm)
+        self.num_hlocs = 0
+        self.last_signal = 0.0
+
+
+    def load_data(self, data):
+        super().load_data(data)
+        self.signal_df = None
+        self.signal_df_key = None
+
+
+    def update_signal(self, close: float) -> float:
+        """
+        Advances the streaming EWMs by one bar. Mirrors the batch calculation in get_signal_df.
+        :param close: the close price of the newest bar
+        :return: the position change for the bar (1.0 = BUY, -1.0 = SELL, 0.0 = no change)
+        """
+        signal, position = self._next_signal(self.short_ewm.update(close), self.long_ewm.update(close))
+        self.last_signal = signal
+        self.num_hlocs += 1
+        return position
+
+
+    def peek_signal(self, close: float) -> float:
+        """
+        Returns the position change update_signal(close) would produce without advancing the model.
+        """
+        return self._next_signal(self.short_ewm.peek(close), self.long_ewm.peek(close))[1]
+
+
+    def _next_signal(self, short_ewm: float, long_ewm: float) -> Tuple[float, float]:
+        signal = 1.0 if self.num_hlocs >= self.low_ewm and short_ewm > long_ewm else 0.0
+        position = signal - self.last_signal if self.num_hlocs > 0 else 0.0
+        return signal, position
 
 
     def on_hloc(self, hloc):
-        raise NotImplementedError('TBD')
+        if hloc.symbol != self.symbol:
+            logger.warning("on_hloc rec'd mismatched symbol. Accepts {0}, got {1}".format(self.symbol, hloc.symbol))
+            return
+
+        position = self.update_signal(hloc.close)
+        if position == -1:
+            self.fire_signal(Signal.SELL, hloc)
+        elif position == 1:
+            self.fire_signal(Signal.BUY, hloc)
+
+
+    def on_hloc_batch(self, batch: OHLCBatch):
+        batch = self.select_symbol(batch)
+        if len(batch) == 0:
+            return
+        closes = batch.close
+        signals, positions = next_positions(self.num_hlocs, self.last_signal, self.low_ewm,
+                                            self.short_ewm.update_many(closes), self.long_ewm.update_many(closes))
+        self.last_signal = float(signals[-1])
+        self.num_hlocs += len(batch)
+        self.fire_signals(positions, batch)
 
 
     def get_historical_signal_events(self) -> pd.DataFrame:
@@ -169,7 +371,12 @@ class MACDModel(AlgoFishHLOCModel):
     def get_signal_df(self, data_limit: int = -1, data_limit_on_tail: bool = True) -> pd.DataFrame:
         logger.debug("get_signal_df starting...")
 
-        if self.signal_df is None:
+        # the cached result is only valid for the frame, rows and limits it was built from. The frame itself is part
+        # of the key, so it can't be collected and its id reused, and rows appended in place change the length and
+        # last time; overwriting values of existing rows in place needs load_data to be called again.
+        data = self.hloc_data
+        key = (data, len(data), data.index[-1] if len(data) > 0 else None, data_limit, data_limit_on_tail)
+        if self.signal_df is None or not self._same_key(key):
             data_df = self.hloc_data
 
             if data_limit > 0:
@@ -190,8 +397,14 @@ class MACDModel(AlgoFishHLOCModel):
             signal_df['positions'] = signal_df['signal'].diff()
             signal_df['price'] = data_df['close']
             self.signal_df = signal_df
+            self.signal_df_key = key
         return self.signal_df
 
+
+    def _same_key(self, key: Tuple) -> bool:
+        cached = self.signal_df_key
+        return cached is not None and cached[0] is key[0] and cached[1:] == key[1:]
+
     def visualize(self, signal_df: pd.DataFrame = None):
         logger.debug("visualizing...")
         if signal_df is None:
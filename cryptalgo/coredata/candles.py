@@ -0,0 +1,341 @@
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+from pathlib import Path
+from typing import Dict, List, Tuple, Union
+
+import numpy as np
+import pandas as pd
+
+import logging
+
+logging.getLogger(__name__).addHandler(logging.NullHandler())
+logger = logging.getLogger(__name__)
+
+TimeLike = Union[str, pd.Timestamp, np.datetime64, int, None]
+
+# where CSV histories are imported to unless a store is given explicitly
+DEFAULT_STORE_ROOT = Path('./data/store')
+
+
+
+def to_epoch_ns(t: TimeLike) -> Union[int, None]:
+    """
+    Converts a timestamp (naive values are taken as UTC) or an int of epoch nanoseconds to int epoch nanoseconds.
+    """
+    if t is None:
+        return None
+    if isinstance(t, (int, np.integer)):
+        return int(t)
+    ts = pd.Timestamp(t)
+    if ts.tzinfo is None:
+        ts = ts.tz_localize('UTC')
+    return int(ts.value)
+
+
+
+class CandleSeries:
+    """
+    A sorted, de-duplicated run of candles for one symbol and granularity. The columns are NumPy views (memory-mapped
+    when read from a CandleStore), so slicing never copies.
+    """
+
+    columns: List[str] = ['high', 'low', 'open', 'close', 'volume']
+
+
+    def __init__(self, symbol: str, granularity: int, times: np.ndarray, values: Dict[str, np.ndarray]) -> None:
+        self.symbol = symbol
+        self.granularity = granularity
+        self.times = times
+        self.values = values
+
+
+    def __len__(self) -> int:
+        return len(self.times)
+
+
+    def __getattr__(self, item):
+        values = self.__dict__.get('values')
+        if values is not None and item in values:
+            return values[item]
+        raise AttributeError(item)
+
+
+    def slice(self, start: TimeLike = None, end: TimeLike = None):
+        """
+        Selects start <= time <= end with a binary search on the time column.
+        """
+        lo = 0 if start is None else int(np.searchsorted(self.times, to_epoch_ns(start), side='left'))
+        hi = len(self.times) if end is None else int(np.searchsorted(self.times, to_epoch_ns(end), side='right'))
+        return CandleSeries(self.symbol, self.granularity, self.times[lo:hi],
+                            {k: v[lo:hi] for k, v in self.values.items()})
+
+
+    def to_dataframe(self) -> pd.DataFrame:
+        """
+        Builds a DataFrame laid out like the candle CSVs (symbol, high, low, open, close, volume, duration_secs) with
+        a UTC datetime index named 'time'. The index and price columns are views of the series' arrays, so a frame
+        over a store read is backed by the mapped files and read-only; copy() it to modify the prices.
+        """
+        times = pd.arrays.DatetimeArray(np.asarray(self.times).view('datetime64[ns]'),
+                                        dtype=pd.DatetimeTZDtype(tz='UTC'), copy=False)
+        index = pd.DatetimeIndex(times, name='time', copy=False)
+        # copy=False keeps one block per column instead of consolidating them into a new 2-D array
+        df = pd.DataFrame({k: np.asarray(self.values[k]) for k in self.columns}, index=index, copy=False)
+        df.insert(0, 'symbol', self.symbol)
+        df['duration_secs'] = self.granularity
+        return df
+
+
+
+class CandleStore:
+    """
+    Binary columnar candle storage keyed by symbol and granularity (seconds).
+
+    Every series lives in <root>/<symbol>/<granularity>/ as one raw little-endian file per column (int64 epoch
+    nanoseconds for time, float64 for prices and volume) plus a meta.json holding the committed row count, any
+    recorded gaps and the data directory the column files are in. Reads are np.memmap views so many processes share
+    the same pages. Appends only write new bytes; the row count in meta.json is updated last so a partial append is
+    ignored by readers. A rewrite never touches mapped files: the columns go to a new data directory, which is swapped
+    in by replacing meta.json, and the directory before it is kept for readers that are just opening it.
+    """
+
+    time_dtype = np.dtype('<i8')
+    value_dtype = np.dtype('<f8')
+
+
+    def __init__(self, root: Union[str, Path]) -> None:
+        self.root = Path(root)
+
+
+    def path_for(self, symbol: str, granularity: int) -> Path:
+        return Path(self.root, symbol, str(int(granularity)))
+
+
+    def has(self, symbol: str, granularity: int) -> bool:
+        return Path(self.path_for(symbol, granularity), "meta.json").is_file()
+
+
+    def get_meta(self, symbol: str, granularity: int) -> Dict:
+        path = Path(self.path_for(symbol, granularity), "meta.json")
+        if not path.is_file():
+            return {"symbol": symbol, "granularity": int(granularity), "count": 0, "gaps": []}
+        with open(path, "r") as f:
+            return json.load(f)
+
+
+    def _data_path(self, symbol: str, granularity: int, meta: Dict) -> Path:
+        # stores written before data directories keep their columns next to meta.json
+        return Path(self.path_for(symbol, granularity), meta.get('data', ''))
+
+
+    def _write_meta(self, symbol: str, granularity: int, meta: Dict) -> None:
+        path = self.path_for(symbol, granularity)
+        tmp = Path(path, "meta.json.tmp")
+        with open(tmp, "w") as f:
+            json.dump(meta, f)
+        os.replace(tmp, Path(path, "meta.json"))
+
+
+    def read(self, symbol: str, granularity: int, start: TimeLike = None, end: TimeLike = None) -> CandleSeries:
+        """
+        Maps the stored series (optionally limited to start <= time <= end) without copying.
+        """
+        meta = self.get_meta(symbol, granularity)
+        count = meta['count']
+        path = self._data_path(symbol, granularity, meta)
+        if count == 0:
+            times = np.empty(0, dtype=self.time_dtype)
+            values = {k: np.empty(0, dtype=self.value_dtype) for k in CandleSeries.columns}
+        else:
+            times = np.memmap(Path(path, "time.i8"), dtype=self.time_dtype, mode='r', shape=(count,))
+            values = {k: np.memmap(Path(path, "{0}.f8".format(k)), dtype=self.value_dtype, mode='r', shape=(count,))
+                      for k in CandleSeries.columns}
+        series = CandleSeries(symbol, int(granularity), times, values)
+        if start is not None or end is not None:
+            series = series.slice(start, end)
+        return series
+
+
+    def load_dataframe(self, symbol: str, granularity: int, start: TimeLike = None, end: TimeLike = None) -> pd.DataFrame:
+        """
+        read() as a DataFrame over the mapped columns (see CandleSeries.to_dataframe).
+        """
+        return self.read(symbol, granularity, start, end).to_dataframe()
+
+
+    def get_last_time(self, symbol: str, granularity: int) -> Union[int, None]:
+        series = self.read(symbol, granularity)
+        return int(series.times[-1]) if len(series) > 0 else None
+
+
+    def write(self, symbol: str, granularity: int, times: np.ndarray, values: Dict[str, np.ndarray],
+              meta: Dict = None) -> None:
+        """
+        Replaces the stored series. Rows are sorted by time and duplicate times keep the last row given. The columns
+        are written to a new data directory and swapped in with meta.json, so readers, including ones that have the
+        old columns mapped, see either the old or the new series, never a mix.
+        """
+        times, values = self._normalize(times, values)
+        path = self.path_for(symbol, granularity)
+        path.mkdir(parents=True, exist_ok=True)
+        previous = self.get_meta(symbol, granularity)
+        meta = dict(meta) if meta is not None else dict(previous)
+        tmp = Path(tempfile.mkdtemp(dir=path, prefix=".tmp-"))
+        try:
+            times.astype(self.time_dtype).tofile(Path(tmp, "time.i8"))
+            for k in CandleSeries.columns:
+                values[k].astype(self.value_dtype).tofile(Path(tmp, "{0}.f8".format(k)))
+            data = "data-" + tmp.name[len(".tmp-"):]
+            os.replace(tmp, Path(path, data))
+        except BaseException:
+            shutil.rmtree(tmp, ignore_errors=True)
+            raise
+        meta.update({"symbol": symbol, "granularity": int(granularity), "count": len(times), "data": data})
+        meta.setdefault("gaps", [])
+        self._write_meta(symbol, granularity, meta)
+        self._remove_data(path, keep=[data, previous.get('data', '')] if previous['count'] > 0 else [data])
+
+
+    def append(self, symbol: str, granularity: int, times: np.ndarray, values: Dict[str, np.ndarray]) -> int:
+        """
+        Adds rows to a series. Rows newer than the last stored candle are appended in place; anything overlapping
+        falls back to a merge and rewrite.
+        :return: number of rows in the series afterwards
+        """
+        times, values = self._normalize(times, values)
+        if len(times) == 0:
+            return self.get_meta(symbol, granularity)['count']
+        meta = self.get_meta(symbol, granularity)
+        last = self.get_last_time(symbol, granularity)
+        if last is None:
+            self.write(symbol, granularity, times, values, meta)
+            return len(times)
+        if times[0] <= last:
+            existing = self.read(symbol, granularity)
+            merged_times = np.concatenate((np.asarray(existing.times), times))
+            merged = {k: np.concatenate((np.asarray(existing.values[k]), values[k])) for k in CandleSeries.columns}
+            self.write(symbol, granularity, merged_times, merged, meta)
+            return self.get_meta(symbol, granularity)['count']
+
+        path = self._data_path(symbol, granularity, meta)
+        count = meta['count']
+        self._append_column(Path(path, "time.i8"), times.astype(self.time_dtype), count * self.time_dtype.itemsize)
+        for k in CandleSeries.columns:
+            self._append_column(Path(path, "{0}.f8".format(k)), values[k].astype(self.value_dtype),
+                                count * self.value_dtype.itemsize)
+        meta.update({"symbol": symbol, "granularity": int(granularity), "count": count + len(times)})
+        meta.setdefault("gaps", [])
+        self._write_meta(symbol, granularity, meta)
+        return meta['count']
+
+
+    def add_gaps(self, symbol: str, granularity: int, gaps: List[Tuple[int, int]]) -> None:
+        """
+        Records (start, end) epoch nanosecond ranges known to have no candles.
+        """
+        if len(gaps) == 0:
+            return
+        meta = self.get_meta(symbol, granularity)
+        self.path_for(symbol, granularity).mkdir(parents=True, exist_ok=True)
+        meta['gaps'] = sorted(set([tuple(g) for g in meta.get('gaps', [])] + [tuple(g) for g in gaps]))
+        self._write_meta(symbol, granularity, meta)
+
+
+    def import_csv(self, path: Union[str, Path]) -> Tuple[str, int]:
+        """
+        Imports a candle CSV written by history_downloader ("symbol","time","high","low","open","close","volume",
+        "duration_secs"), replacing any stored series for its symbol and granularity.
+        :return: (symbol, granularity) of the imported series
+        """
+        df = pd.read_csv(path, sep=",", quotechar='"', parse_dates=['time'])
+        if len(df) == 0:
+            raise ValueError("{0} has no candles".format(path))
+        symbol = str(df['symbol'].iloc[0])
+        granularity = int(df['duration_secs'].iloc[0])
+        times = pd.DatetimeIndex(df['time'])
+        if times.tz is None:
+            times = times.tz_localize('UTC')
+        stat = os.stat(path)
+        self.write(symbol, granularity, times.asi8, {k: df[k].to_numpy(dtype=np.float64) for k in CandleSeries.columns},
+                   meta={"gaps": [], "source": str(Path(path).resolve()), "source_mtime": stat.st_mtime,
+                         "source_size": stat.st_size})
+        logger.info("imported {0} candles for {1}/{2} from {3}".format(len(df), symbol, granularity, path))
+        return symbol, granularity
+
+
+    def load_csv(self, path: Union[str, Path]) -> pd.DataFrame:
+        """
+        Returns the candles of a history_downloader CSV as a DataFrame, importing it into the store the first time
+        (or when the file has changed) and reading the binary copy afterwards. Every CSV gets its own copy (see
+        for_source), so two files with the same symbol and granularity don't overwrite each other.
+
+        Unlike pd.read_csv(path, parse_dates=['time']).set_index('time'), the frame always has a UTC index (naive
+        CSV times are taken as UTC), is sorted by time and holds one row per time: of duplicated times only the last
+        row in the file is kept. Price and volume columns are float64.
+        """
+        store = self.for_source(path)
+        symbol, granularity = self._peek_csv_key(path)
+        meta = store.get_meta(symbol, granularity)
+        stat = os.stat(path)
+        if meta.get('source') != str(Path(path).resolve()) or meta.get('source_mtime') != stat.st_mtime or \
+                meta.get('source_size') != stat.st_size:
+            store.import_csv(path)
+        return store.load_dataframe(symbol, granularity)
+
+
+    def for_source(self, path: Union[str, Path]) -> 'CandleStore':
+        """
+        :return: the store under <root>/csv/<hash of the resolved path>/ that load_csv keeps the CSV's candles in
+        """
+        key = hashlib.sha1(str(Path(path).resolve()).encode('utf-8')).hexdigest()[:16]
+        return CandleStore(Path(self.root, "csv", key))
+
+
+    @classmethod
+    def _peek_csv_key(cls, path: Union[str, Path]) -> Tuple[str, int]:
+        df = pd.read_csv(path, sep=",", quotechar='"', nrows=1)
+        return str(df['symbol'].iloc[0]), int(df['duration_secs'].iloc[0])
+
+
+    @classmethod
+    def _remove_data(cls, path: Path, keep: List[str]) -> None:
+        """
+        Deletes the data directories of a series, and column files stored next to meta.json, other than `keep`.
+        """
+        for entry in os.scandir(path):
+            if entry.is_dir() and entry.name.startswith("data-") and entry.name not in keep:
+                shutil.rmtree(entry.path, ignore_errors=True)
+        if '' not in keep:
+            for name in ["time.i8"] + ["{0}.f8".format(k) for k in CandleSeries.columns]:
+                try:
+                    os.remove(Path(path, name))
+                except FileNotFoundError:
+                    pass
+
+
+    @classmethod
+    def _append_column(cls, path: Path, data: np.ndarray, committed_bytes: int) -> None:
+        with open(path, "ab") as f:
+            # drop anything past the committed row count left by an interrupted append
+            f.truncate(committed_bytes)
+            f.seek(committed_bytes)
+            data.tofile(f)
+
+
+    @classmethod
+    def _normalize(cls, times: np.ndarray, values: Dict[str, np.ndarray]) -> Tuple[np.ndarray, Dict[str, np.ndarray]]:
+        times = np.asarray(times, dtype=np.int64)
+        values = {k: np.asarray(values[k], dtype=np.float64) for k in CandleSeries.columns}
+        for k, v in values.items():
+            if len(v) != len(times):
+                raise ValueError("column {0} has {1} rows, expected {2}".format(k, len(v), len(times)))
+        order = np.argsort(times, kind='stable')
+        times = times[order]
+        # keep the last occurrence of each duplicated time
+        keep = np.ones(len(times), dtype=bool)
+        keep[:-1] = times[1:] != times[:-1]
+        order = order[keep]
+        return times[keep], {k: v[order] for k, v in values.items()}
@@ -1,12 +1,16 @@
 import abc
+import collections.abc
 import datetime
 import decimal
+import numbers
+import time
 from decimal import Decimal
-from typing import Dict, List
+from typing import Dict, Iterator, List, Tuple, Union
 
+import numpy as np
 import pandas as pd
 
-from cryptalgo.coredata.trades import TradeSide, TradeHistory, Trade
+from cryptalgo.coredata.trades import TradeSide, TradeLog, TradeBatch, to_ns
 from cryptalgo.utils.decorators.validation import requires_amount, requires_symbol_and_amount, \
     requires_symbol_amount_and_price
 
@@ -63,16 +67,165 @@ class Ledger:
 
 
 
+INT64_MAX = 2 ** 63 - 1
+
+
+
+def div_round(numerator: int, denominator: int) -> int:
+    """
+    Integer division rounding half to even, like Decimal's default rounding.
+    """
+    q, r = divmod(numerator, denominator)
+    twice = 2 * r
+    if twice > denominator or (twice == denominator and q % 2 == 1):
+        q += 1
+    return q
+
+
+
+class FixedPointBalances(collections.abc.Mapping):
+    """
+    Read-only symbol -> Decimal view of a FixedPointLedger's balances, so it can stand in for Ledger.holdings.
+    """
+
+    def __init__(self, ledger) -> None:
+        self.ledger = ledger
+
+
+    def __getitem__(self, symbol: str) -> Decimal:
+        return self.ledger.to_decimal(symbol, self.ledger.units[symbol])
+
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self.ledger.units)
+
+
+    def __len__(self) -> int:
+        return len(self.ledger.units)
+
+
+
+class FixedPointLedger(Ledger):
+    """
+    Ledger keeping every balance as an integer count of 10^-scale units, the scale set per currency / symbol
+    (default_scale = 8 decimals, i.e. satoshis for BTC). Amounts are rounded half to even to their symbol's scale once,
+    on the way in; after that adds and removes are exact integer arithmetic, balances never lose digits the way the
+    prec = 5 Decimal Ledger does, and no decimal context is involved. Balances must stay within int64.
+
+    holdings reads as symbol -> Decimal like Ledger's. History entries are only kept with keep_history.
+    """
+
+    def __init__(self, name: str, scales: Dict[str, int] = None, default_scale: int = 8,
+                 keep_history: bool = False) -> None:
+        super().__init__(name)
+        self.scales: Dict[str, int] = dict(scales) if scales is not None else {}
+        self.default_scale = default_scale
+        self.keep_history = keep_history
+        self.units: Dict[str, int] = {}
+        # (epoch ns, symbol, direction, amount units, balance units)
+        self.entries: List[Tuple[int, str, str, int, int]] = []
+        self.holdings = FixedPointBalances(self)
+
+
+    def get_scale(self, symbol: str) -> int:
+        return self.scales.get(symbol, self.default_scale)
+
+
+    def to_units(self, symbol: str, amount: Union[int, float, Decimal]) -> int:
+        """
+        :return: amount as a count of symbol's units, rounded half to even
+        """
+        scale = self.get_scale(symbol)
+        if isinstance(amount, float) and abs(amount) < 2 ** 52 / 10 ** scale:
+            # the float product is well within float precision here, so rounding it is exact enough and much cheaper
+            return int(round(amount * 10 ** scale))
+        if isinstance(amount, numbers.Integral):
+            return int(amount) * 10 ** scale
+        return int(Decimal(amount).scaleb(scale).to_integral_value(rounding=decimal.ROUND_HALF_EVEN))
+
+
+    def to_units_many(self, symbols: List[str], amounts: np.ndarray) -> List[int]:
+        """
+        to_units for a column of float amounts, symbols[i] being the symbol of amounts[i]; identical results, one
+        vectorized rounding when every amount is in to_units' float range.
+        """
+        scales = np.array([self.get_scale(s) for s in symbols], dtype=np.int64)
+        factors = np.power(10.0, scales)
+        if len(amounts) > 0 and (np.abs(amounts) < 2.0 ** 52 / factors).all():
+            return np.round(amounts * factors).astype(np.int64).tolist()
+        return [self.to_units(s, a) for s, a in zip(symbols, amounts.tolist())]
+
+
+    def to_decimal(self, symbol: str, units: int) -> Decimal:
+        return Decimal(units).scaleb(-self.get_scale(symbol))
+
+
+    def balance_history_as_series(self) -> pd.Series:
+        return pd.Series(index=pd.to_datetime([e[0] for e in self.entries], utc=True),
+                         data=[self.to_decimal(e[1], e[4]) for e in self.entries], dtype=object)
+
+
+    @requires_symbol_and_amount
+    def add(self, symbol: str, amount: float) -> None:
+        self.add_units(symbol, self.to_units(symbol, amount))
+
+
+    @requires_symbol_and_amount
+    def remove(self, symbol: str, amount: float) -> None:
+        self.remove_units(symbol, self.to_units(symbol, amount))
+
+
+    def add_units(self, symbol: str, units: int) -> None:
+        """
+        Unvalidated add of an amount already in symbol's units.
+        """
+        if units < 0:
+            raise ValueError("amount must be positive; amount={0}".format(self.to_decimal(symbol, units)))
+        balance = self.units.get(symbol, 0) + units
+        if balance > INT64_MAX:
+            raise ValueError("{0} balance exceeds the int64 range at scale {1}".format(symbol, self.get_scale(symbol)))
+        self.units[symbol] = balance
+        if self.keep_history:
+            self.entries.append((time.time_ns(), symbol, "add", units, balance))
+
+
+    def remove_units(self, symbol: str, units: int) -> None:
+        """
+        Unvalidated remove of an amount already in symbol's units.
+        """
+        balance = self.units.get(symbol)
+        if balance is None:
+            raise ValueError("can't remove {0} with no holdings".format(symbol))
+        if units > balance:
+            raise ValueError("can't remove {0} from {1} as holdings are {2}".format(
+                self.to_decimal(symbol, units), symbol, self.to_decimal(symbol, balance)))
+        if units < 0:
+            raise ValueError("amount must be positive; amount={0}".format(self.to_decimal(symbol, units)))
+        balance -= units
+        self.units[symbol] = balance
+        if self.keep_history:
+            self.entries.append((time.time_ns(), symbol, "remove", units, balance))
+
+
+
 class Account:
+    """
+    Cash and securities ledgers plus the trade history. With fixed_point the ledgers are FixedPointLedgers (see
+    `scales`), and buys and sells are settled in integer units without any Decimal arithmetic: the notional is
+    amount * price rounded half to even to the currency's scale.
+    """
 
     def __init__(self, start_cash_balance: float = 0.0, default_currency: str = 'USD',
-                 default_trade_fee_model: FeeModel = None) -> None:
-        self.cash_ledger: Ledger = Ledger(name='cash')
+                 default_trade_fee_model: FeeModel = None, fixed_point: bool = False,
+                 scales: Dict[str, int] = None) -> None:
+        self.fixed_point = fixed_point
+        self.cash_ledger: Ledger = FixedPointLedger('cash', scales) if fixed_point else Ledger(name='cash')
         self.default_currency: str = default_currency
         self.cash_ledger.add(self.default_currency, start_cash_balance)
-        self.securities_ledger: Ledger = Ledger(name='securities')
+        self.securities_ledger: Ledger = FixedPointLedger('securities', scales) if fixed_point else \
+            Ledger(name='securities')
         self.default_trade_fee_model: FeeModel = default_trade_fee_model
-        self.trade_history: TradeHistory = TradeHistory()
+        self.trade_history: TradeLog = TradeLog()
         self.initial_cash_balance: Decimal = Decimal(start_cash_balance)
 
 
@@ -97,7 +250,7 @@ class Account:
 
 
     def num_trades(self) -> int:
-        return len(self.trade_history.trades)
+        return len(self.trade_history)
 
 
     @requires_amount
@@ -125,9 +278,13 @@ class Account:
 
 
     @requires_symbol_amount_and_price
-    def buy_shares(self, symbol: str, amount: float, price: float, fee: float = None, currency: str = None):
+    def buy_shares(self, symbol: str, amount: float, price: float, fee: float = None, currency: str = None,
+                   time: datetime.datetime = None):
         if currency is None:
             currency = self.default_currency
+        if self.fixed_point:
+            self._settle_fixed_point(symbol, amount, price, fee, currency, TradeSide.BUY, time)
+            return
         with decimal.localcontext() as ctx:
             ctx.prec = 5
             trade_fee = Decimal()
@@ -137,13 +294,17 @@ class Account:
                 trade_fee = self.default_trade_fee_model.calculate_fee(symbol, amount, price, TradeSide.BUY)
             self.cash_ledger.remove(currency, (Decimal(amount) * Decimal(price)) + trade_fee)
             self.securities_ledger.add(symbol, amount)
-            self.trade_history.add_trade(Trade(symbol, amount, price, TradeSide.BUY, trade_fee))
+            self.record_trade(symbol, amount, price, TradeSide.BUY, trade_fee, time)
 
 
     @requires_symbol_amount_and_price
-    def sell_shares(self, symbol: str, amount: float, price: float, fee: float = None, currency: str = None):
+    def sell_shares(self, symbol: str, amount: float, price: float, fee: float = None, currency: str = None,
+                    time: datetime.datetime = None):
         if currency is None:
             currency = self.default_currency
+        if self.fixed_point:
+            self._settle_fixed_point(symbol, amount, price, fee, currency, TradeSide.SELL, time)
+            return
         with decimal.localcontext() as ctx:
             ctx.prec = 5
             trade_fee = Decimal()
@@ -153,4 +314,175 @@ class Account:
                 trade_fee = self.default_trade_fee_model.calculate_fee(symbol, amount, price, TradeSide.SELL)
             self.securities_ledger.remove(symbol, amount)
             self.cash_ledger.add(currency, (Decimal(amount) * Decimal(price)) - trade_fee)
-            self.trade_history.add_trade(Trade(symbol, amount, price, TradeSide.SELL, trade_fee))
+            self.record_trade(symbol, amount, price, TradeSide.SELL, trade_fee, time)
+
+
+    def apply_trades(self, batch: TradeBatch, currency: str = None) -> None:
+        """
+        Applies a batch of trades in order, leaving cash, holdings and ledger history as buy_shares / sell_shares row
+        by row would. The arguments are checked once, vectorized, and the ledgers are then updated in one pass over
+        local copies of their balances. All or nothing: the first invalid row, whether a bad argument or a trade the
+        balances can't cover, raises a ValueError naming it and the account is left unchanged.
+        :param batch: a NaN fee means the default_trade_fee_model's fee, or none without one
+        """
+        if currency is None:
+            currency = self.default_currency
+        batch.validate()
+        n = len(batch)
+        symbols = [batch.symbols[i] for i in batch.symbol_ids.tolist()]
+        amounts = batch.amount.tolist()
+        prices = batch.price.tolist()
+        sides = batch.sides.tolist()
+        fees = [None if f != f else f for f in batch.fee.tolist()]
+        if self.default_trade_fee_model is not None:
+            for i in np.flatnonzero(np.isnan(batch.fee)).tolist():
+                fees[i] = self.default_trade_fee_model.calculate_fee(symbols[i], amounts[i], prices[i],
+                                                                     TradeSide(sides[i]))
+        if n == 0:
+            return
+        if self.fixed_point:
+            charged = self._apply_fixed_point(batch, currency, symbols, sides, fees)
+        else:
+            charged = self._apply_decimal(currency, symbols, amounts, prices, sides, fees)
+        self.trade_history.extend(batch, np.array(charged, dtype=np.float64))
+
+
+    def _apply_decimal(self, currency: str, symbols: List[str], amounts: List[float], prices: List[float],
+                       sides: List[int], fees: List) -> List[float]:
+        cash = dict(self.cash_ledger.holdings)
+        securities = dict(self.securities_ledger.holdings)
+        cash_history = []
+        securities_history = []
+        charged = []
+        buy = TradeSide.BUY.value
+        with decimal.localcontext() as ctx:
+            ctx.prec = 5
+            for i, symbol in enumerate(symbols):
+                amount = amounts[i]
+                trade_fee = Decimal(fees[i]) if fees[i] is not None else Decimal()
+                cost = Decimal(amount) * Decimal(prices[i])
+                if sides[i] == buy:
+                    total = cost + trade_fee
+                    balance = cash.get(currency)
+                    if total < 0:
+                        raise ValueError("trade {0}: amount must be passed and be positive; amount={1}".format(
+                            i, total))
+                    if balance is None:
+                        raise ValueError("trade {0}: can't remove {1} with no holdings".format(i, currency))
+                    if total > balance:
+                        raise ValueError("trade {0}: can't remove {1} from {2} as holdings are {3}".format(
+                            i, total, currency, balance))
+                    cash[currency] = balance - total
+                    cash_history.append(Ledger.History(currency, total, "remove", cash[currency]))
+                    securities[symbol] = securities.get(symbol, Decimal()) + Decimal(amount)
+                    securities_history.append(Ledger.History(symbol, Decimal(amount), "add", securities[symbol]))
+                else:
+                    balance = securities.get(symbol)
+                    if balance is None:
+                        raise ValueError("trade {0}: can't remove {1} with no holdings".format(i, symbol))
+                    if amount > balance:
+                        raise ValueError("trade {0}: can't remove {1} from {2} as holdings are {3}".format(
+                            i, amount, symbol, balance))
+                    proceeds = cost - trade_fee
+                    if proceeds < 0:
+                        raise ValueError("trade {0}: amount must be passed and be positive; amount={1}".format(
+                            i, proceeds))
+                    securities[symbol] = balance - Decimal(amount)
+                    securities_history.append(Ledger.History(symbol, Decimal(amount), "remove", securities[symbol]))
+                    cash[currency] = cash.get(currency, Decimal()) + proceeds
+                    cash_history.append(Ledger.History(currency, proceeds, "add", cash[currency]))
+                charged.append(float(trade_fee))
+        self.cash_ledger.holdings.update(cash)
+        self.cash_ledger.history.extend(cash_history)
+        self.securities_ledger.holdings.update(securities)
+        self.securities_ledger.history.extend(securities_history)
+        return charged
+
+
+    def _apply_fixed_point(self, batch: TradeBatch, currency: str, symbols: List[str], sides: List[int],
+                           fees: List) -> List[float]:
+        cash_ledger: FixedPointLedger = self.cash_ledger
+        securities_ledger: FixedPointLedger = self.securities_ledger
+        n = len(symbols)
+        amount_units = securities_ledger.to_units_many(symbols, batch.amount)
+        price_units = cash_ledger.to_units_many([currency] * n, batch.price)
+        fee_units = cash_ledger.to_units_many([currency] * n, np.nan_to_num(batch.fee, nan=0.0))
+        for i in np.flatnonzero(np.isnan(batch.fee)).tolist():
+            fee_units[i] = cash_ledger.to_units(currency, fees[i]) if fees[i] is not None else 0
+        cash = dict(cash_ledger.units)
+        securities = dict(securities_ledger.units)
+        cash_entries = []
+        securities_entries = []
+        now = time.time_ns()
+        buy = TradeSide.BUY.value
+        for i, symbol in enumerate(symbols):
+            units = amount_units[i]
+            fee = fee_units[i]
+            notional = div_round(units * price_units[i], 10 ** securities_ledger.get_scale(symbol))
+            if sides[i] == buy:
+                total = notional + fee
+                balance = cash.get(currency)
+                if balance is None:
+                    raise ValueError("trade {0}: can't remove {1} with no holdings".format(i, currency))
+                if total > balance:
+                    raise ValueError("trade {0}: can't remove {1} from {2} as holdings are {3}".format(
+                        i, cash_ledger.to_decimal(currency, total), currency,
+                        cash_ledger.to_decimal(currency, balance)))
+                holding = securities.get(symbol, 0) + units
+                if holding > INT64_MAX:
+                    raise ValueError("trade {0}: {1} balance exceeds the int64 range".format(i, symbol))
+                cash[currency] = balance - total
+                securities[symbol] = holding
+                cash_entries.append((now, currency, "remove", total, balance - total))
+                securities_entries.append((now, symbol, "add", units, holding))
+            else:
+                if fee > notional:
+                    raise ValueError("trade {0}: fee exceeds the proceeds of selling {1}".format(i, symbol))
+                balance = securities.get(symbol)
+                if balance is None:
+                    raise ValueError("trade {0}: can't remove {1} with no holdings".format(i, symbol))
+                if units > balance:
+                    raise ValueError("trade {0}: can't remove {1} from {2} as holdings are {3}".format(
+                        i, securities_ledger.to_decimal(symbol, units), symbol,
+                        securities_ledger.to_decimal(symbol, balance)))
+                holding = cash.get(currency, 0) + notional - fee
+                if holding > INT64_MAX:
+                    raise ValueError("trade {0}: {1} balance exceeds the int64 range".format(i, currency))
+                securities[symbol] = balance - units
+                cash[currency] = holding
+                securities_entries.append((now, symbol, "remove", units, balance - units))
+                cash_entries.append((now, currency, "add", notional - fee, holding))
+        cash_ledger.units.update(cash)
+        securities_ledger.units.update(securities)
+        if cash_ledger.keep_history:
+            cash_ledger.entries.extend(cash_entries)
+        if securities_ledger.keep_history:
+            securities_ledger.entries.extend(securities_entries)
+        scale = 10 ** cash_ledger.get_scale(currency)
+        return [f / scale for f in fee_units]
+
+
+    def record_trade(self, symbol: str, amount: float, price: float, side: TradeSide, fee: Decimal,
+                     time: datetime.datetime = None) -> None:
+        self.trade_history.append(symbol, float(amount), float(price), side, float(fee),
+                                  to_ns(time) if time is not None else None)
+
+
+    def _settle_fixed_point(self, symbol: str, amount: float, price: float, fee: float, currency: str,
+                            side: TradeSide, time: datetime.datetime = None) -> None:
+        cash: FixedPointLedger = self.cash_ledger
+        securities: FixedPointLedger = self.securities_ledger
+        if fee is None and self.default_trade_fee_model is not None:
+            fee = self.default_trade_fee_model.calculate_fee(symbol, amount, price, side)
+        amount_units = securities.to_units(symbol, amount)
+        fee_units = cash.to_units(currency, fee) if fee is not None else 0
+        notional = div_round(amount_units * cash.to_units(currency, price), 10 ** securities.get_scale(symbol))
+        if side == TradeSide.BUY:
+            cash.remove_units(currency, notional + fee_units)
+            securities.add_units(symbol, amount_units)
+        else:
+            if fee_units > notional:
+                raise ValueError("fee {0} exceeds the proceeds of selling {1} {2}".format(fee, amount, symbol))
+            securities.remove_units(symbol, amount_units)
+            cash.add_units(currency, notional - fee_units)
+        self.record_trade(symbol, amount, price, side, cash.to_decimal(currency, fee_units), time)
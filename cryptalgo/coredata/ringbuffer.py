@@ -0,0 +1,146 @@
+from typing import Any, Dict, Iterator
+
+import numpy as np
+
+import logging
+
+logging.getLogger(__name__).addHandler(logging.NullHandler())
+logger = logging.getLogger(__name__)
+
+
+
+class RingBuffer:
+    """
+    Fixed capacity store of the most recent rows, one preallocated NumPy column per field.
+
+    Every row is written twice, at its slot and at slot + capacity, so the newest n rows always sit contiguously at
+    [head + capacity - n, head + capacity) of each column. `view` therefore hands out time ordered slices without
+    copying, across wraparound too, and appends stay O(1); the price is twice the memory.
+
+    Indexing and iteration give one object per row (ticks, bars), oldest first, like the deques this replaces. If
+    `item_field` names an object column holding the appended objects themselves, those are returned; other rows (or
+    all of them, without an item_field) are rebuilt from their columns on access by build_item.
+    """
+
+    item_field: str = None
+
+
+    def __init__(self, capacity: int, fields: Dict[str, Any]) -> None:
+        """
+        :param fields: column name -> NumPy dtype, in the order append takes the values
+        """
+        if capacity is None or capacity < 1:
+            raise ValueError("capacity must be a positive integer; capacity={0}".format(capacity))
+        self.capacity = capacity
+        self.fields = {k: np.dtype(v) for k, v in fields.items()}
+        self.columns: Dict[str, np.ndarray] = {k: np.empty(2 * capacity, dtype=v) for k, v in self.fields.items()}
+        self.ordered_columns = list(self.columns.values())
+        self.head = 0
+        self.count = 0
+        self.total = 0
+
+
+    def __len__(self) -> int:
+        return self.count
+
+
+    def append(self, *values) -> None:
+        """
+        Adds one row, values in field order, overwriting the oldest row once full.
+        """
+        i = self.head
+        j = i + self.capacity
+        for column, value in zip(self.ordered_columns, values):
+            column[i] = value
+            column[j] = value
+        self.head = i + 1 if i + 1 < self.capacity else 0
+        if self.count < self.capacity:
+            self.count += 1
+        self.total += 1
+
+
+    def extend(self, columns: Dict[str, np.ndarray]) -> None:
+        """
+        Adds rows column-wise. Fields missing from `columns` are filled with None for object columns, NaN for floats
+        and 0 otherwise.
+        """
+        n = len(next(iter(columns.values()))) if len(columns) > 0 else 0
+        if n == 0:
+            return
+        # only the newest `capacity` rows survive anyway
+        skip = max(0, n - self.capacity)
+        n -= skip
+        start = self.head
+        first = min(n, self.capacity - start)
+        rest = n - first
+        for k, column in self.columns.items():
+            src = columns.get(k)
+            if src is None:
+                src = np.full(n, self._fill_value(column.dtype), dtype=column.dtype)
+            else:
+                src = np.asarray(src)[skip:]
+            for offset in [0, self.capacity]:
+                column[offset + start:offset + start + first] = src[:first]
+                if rest > 0:
+                    column[offset:offset + rest] = src[first:]
+        self.head = (start + n) % self.capacity
+        self.count = min(self.capacity, self.count + n)
+        self.total += n + skip
+
+
+    def view(self, field: str, n: int = None) -> np.ndarray:
+        """
+        :return: the newest n (default all held) values of a column, oldest first, as a read-only view
+        """
+        n = self.count if n is None else max(0, min(n, self.count))
+        end = self.head + self.capacity
+        values = self.columns[field][end - n:end]
+        values.flags.writeable = False
+        return values
+
+
+    def last(self, n: int = None) -> Dict[str, np.ndarray]:
+        """
+        :return: field -> view of the newest n rows
+        """
+        return {k: self.view(k, n) for k in self.columns}
+
+
+    def clear(self) -> None:
+        self.head = 0
+        self.count = 0
+        for column in self.columns.values():
+            if column.dtype == object:
+                # drop the references
+                column.fill(None)
+
+
+    def __getitem__(self, i: int):
+        if i < 0:
+            i += self.count
+        if i < 0 or i >= self.count:
+            raise IndexError("ring buffer index out of range")
+        pos = self.head + self.capacity - self.count + i
+        item = self.columns[self.item_field][pos] if self.item_field is not None else None
+        return item if item is not None else self.build_item(pos)
+
+
+    def __iter__(self) -> Iterator:
+        for i in range(self.count):
+            yield self[i]
+
+
+    def build_item(self, pos: int):
+        """
+        Rebuilds the item for the row at column position `pos` from its other columns.
+        """
+        raise TypeError("{0} keeps no items".format(type(self).__name__))
+
+
+    @staticmethod
+    def _fill_value(dtype: np.dtype):
+        if dtype == object:
+            return None
+        if dtype.kind == 'f':
+            return np.nan
+        return 0
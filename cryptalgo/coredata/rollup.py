@@ -0,0 +1,308 @@
+import collections
+import hashlib
+import json
+import os
+import threading
+import weakref
+from pathlib import Path
+from typing import Dict, List, Tuple, Union
+
+import numpy as np
+import pandas as pd
+
+from cryptalgo.inputs.dispatch import OverflowPolicy, wrap_listener
+from cryptalgo.inputs.feed_agg import AggPeriod, OHLC, OHLCSource
+
+import logging
+
+logging.getLogger(__name__).addHandler(logging.NullHandler())
+logger = logging.getLogger(__name__)
+
+NANOS = 1000000000
+PRICE_COLUMNS: List[str] = ['high', 'low', 'open', 'close', 'volume']
+
+
+
+def data_hash(data: pd.DataFrame) -> str:
+    """
+    Content hash of a candle DataFrame (symbol, time index and price columns), used as the rollup cache key.
+    """
+    h = hashlib.sha1()
+    h.update(str(data['symbol'].iloc[0] if len(data) > 0 else "").encode('utf-8'))
+    h.update(str(data.index.tz).encode('utf-8'))
+    h.update(np.ascontiguousarray(data.index.asi8).tobytes())
+    for k in PRICE_COLUMNS:
+        h.update(np.ascontiguousarray(data[k].to_numpy(dtype=np.float64)).tobytes())
+    return h.hexdigest()
+
+
+
+def _kahan_sum(values: np.ndarray, starts: np.ndarray, ends: np.ndarray) -> np.ndarray:
+    """
+    Per-bucket compensated sums, vectorized across buckets, in the same order and with the same compensation as
+    pandas' groupby sum so results are bit-identical to resample().sum(). NaNs are skipped.
+    """
+    total = np.zeros(len(starts), dtype=np.float64)
+    compensation = np.zeros(len(starts), dtype=np.float64)
+    lengths = ends - starts
+    for j in range(int(lengths.max()) if len(lengths) > 0 else 0):
+        active = np.flatnonzero(lengths > j)
+        val = values[starts[active] + j]
+        ok = ~np.isnan(val)
+        active, val = active[ok], val[ok]
+        y = val - compensation[active]
+        t = total[active] + y
+        compensation[active] = (t - total[active]) - y
+        total[active] = t
+    return total
+
+
+
+def rollup_ohlc(data: pd.DataFrame, agg_period: AggPeriod) -> pd.DataFrame:
+    """
+    Aggregates candles into agg_period bars with integer bucket reductions. Produces exactly what
+    data.resample(freq).agg(first symbol, max high, min low, first open, last close, sum volume) does, including
+    empty rows (NaN prices, 0 volume, no symbol) for periods without candles.
+    """
+    period_ns = agg_period.value * 60 * NANOS
+    index = data.index
+    wall = index.tz_localize(None) if index.tz is not None else index
+    t = wall.asi8
+    if len(t) == 0:
+        raise ValueError("no candles to roll up")
+    bucket = t // period_ns
+    first = bucket[0]
+    num_buckets = int(bucket[-1] - first + 1)
+
+    starts = np.flatnonzero(np.diff(bucket)) + 1
+    starts = np.concatenate(([0], starts))
+    ends = np.concatenate((starts[1:], [len(t)]))
+    present = bucket[starts] - first
+
+    out = {k: np.full(num_buckets, np.nan) for k in PRICE_COLUMNS}
+    out['high'][present] = np.fmax.reduceat(data['high'].to_numpy(dtype=np.float64), starts)
+    out['low'][present] = np.fmin.reduceat(data['low'].to_numpy(dtype=np.float64), starts)
+    out['open'][present] = data['open'].to_numpy(dtype=np.float64)[starts]
+    out['close'][present] = data['close'].to_numpy(dtype=np.float64)[ends - 1]
+    out['volume'][:] = 0.0
+    out['volume'][present] = _kahan_sum(data['volume'].to_numpy(dtype=np.float64), starts, ends)
+
+    symbols = np.full(num_buckets, None, dtype=object)
+    symbols[present] = data['symbol'].to_numpy()[starts]
+    return _to_frame((first + np.arange(num_buckets)) * period_ns, symbols, out, index.tz, agg_period)
+
+
+
+def _to_frame(times: np.ndarray, symbols: np.ndarray, values: Dict[str, np.ndarray], tz,
+              agg_period: AggPeriod) -> pd.DataFrame:
+    index = pd.DatetimeIndex(np.asarray(times).view('datetime64[ns]'), name='time',
+                             freq=pd.Timedelta(minutes=agg_period.value))
+    if tz is not None:
+        index = index.tz_localize(tz)
+    columns = {'symbol': symbols}
+    columns.update({k: values[k] for k in PRICE_COLUMNS})
+    columns['duration_secs'] = np.full(len(index), agg_period.value * 60, dtype=np.int64)
+    for v in columns.values():
+        # levels are shared by every caller of RollupPyramid.get
+        v.flags.writeable = False
+    return pd.DataFrame(columns, index=index, copy=False)
+
+
+
+class RollupPyramid:
+    """
+    Every higher AggPeriod level of a base candle series, computed once with rollup_ohlc and cached by the base
+    series' content hash. The most recent `max_entries` levels are kept in memory; with a `cache_dir` each level is
+    also saved as .npy files (<cache_dir>/<hash>/<period secs>/) and later loaded memory-mapped, so other processes
+    and later runs skip the aggregation entirely.
+
+    get() hands every caller its own shallow copy of the cached level: columns it adds or replaces stay in that copy,
+    and every column array is read-only, so writing into one in place raises ValueError instead of changing the cache.
+
+    Keys of frames already seen are remembered by the frame's identity, length and last time, so a frame is only
+    hashed the first time; pass key=data_hash(data) after changing a frame's values in place.
+    """
+
+    def __init__(self, cache_dir: Union[str, Path] = None, max_entries: int = 16) -> None:
+        self.cache_dir = Path(cache_dir) if cache_dir is not None else None
+        self.max_entries = max_entries
+        self.cache: collections.OrderedDict = collections.OrderedDict()
+        self.lock = threading.Lock()
+        # id(data) -> (weak reference to data, (length, last time), data_hash(data))
+        self.keys: Dict[int, Tuple] = {}
+        self.hits = 0
+        self.misses = 0
+
+
+    def key_for(self, data: pd.DataFrame) -> str:
+        """
+        :return: data_hash(data), remembered for as long as the same frame object keeps its length and last time
+        """
+        version = (len(data), data.index[-1] if len(data) > 0 else None)
+        with self.lock:
+            memo = self.keys.get(id(data))
+        if memo is not None and memo[0]() is data and memo[1] == version:
+            return memo[2]
+        key = data_hash(data)
+        ref = weakref.ref(data, lambda _, i=id(data): self.keys.pop(i, None))
+        with self.lock:
+            self.keys[id(data)] = (ref, version, key)
+        return key
+
+
+    def get(self, data: pd.DataFrame, agg_period: AggPeriod, key: str = None) -> pd.DataFrame:
+        """
+        :param key: data_hash(data), if the caller already has it
+        :return: a shallow copy of the cached level, sharing its read-only columns
+        """
+        key = key if key is not None else self.key_for(data)
+        with self.lock:
+            level = self.cache.get((key, agg_period))
+            if level is not None:
+                self.cache.move_to_end((key, agg_period))
+                self.hits += 1
+                return level.copy(deep=False)
+        level = self._load(key, agg_period)
+        if level is None:
+            self.misses += 1
+            level = rollup_ohlc(data, agg_period)
+            self._save(key, agg_period, level)
+        with self.lock:
+            self.cache[(key, agg_period)] = level
+            while len(self.cache) > self.max_entries:
+                self.cache.popitem(last=False)
+        return level.copy(deep=False)
+
+
+    def get_all(self, data: pd.DataFrame, agg_periods: List[AggPeriod] = None) -> Dict[AggPeriod, pd.DataFrame]:
+        """
+        :return: agg period -> rolled up candles for every period above the base granularity (or just agg_periods)
+        """
+        base_secs = int(data['duration_secs'].iloc[0])
+        if agg_periods is None:
+            agg_periods = [p for p in AggPeriod if p.value * 60 > base_secs]
+        key = self.key_for(data)
+        return {p: self.get(data, p, key) for p in agg_periods}
+
+
+    def clear(self) -> None:
+        with self.lock:
+            self.cache.clear()
+            self.keys.clear()
+
+
+    def _path_for(self, key: str, agg_period: AggPeriod) -> Path:
+        return Path(self.cache_dir, key, str(agg_period.value * 60))
+
+
+    def _load(self, key: str, agg_period: AggPeriod) -> Union[pd.DataFrame, None]:
+        if self.cache_dir is None:
+            return None
+        path = self._path_for(key, agg_period)
+        if not Path(path, "meta.json").is_file():
+            return None
+        with open(Path(path, "meta.json"), "r") as f:
+            meta = json.load(f)
+        times = np.load(Path(path, "time.npy"), mmap_mode='r')
+        # plain ndarray views of the mapping, so the columns look like computed ones
+        prices = np.load(Path(path, "prices.npy"), mmap_mode='r').view(np.ndarray)
+        symbols = np.where(np.isnan(prices[:, PRICE_COLUMNS.index('open')]), None, meta['symbol']).astype(object)
+        logger.debug("loaded {0} rollup from {1}".format(agg_period, path))
+        return _to_frame(times, symbols, {k: prices[:, i] for i, k in enumerate(PRICE_COLUMNS)}, meta['tz'],
+                         agg_period)
+
+
+    def _save(self, key: str, agg_period: AggPeriod, level: pd.DataFrame) -> None:
+        if self.cache_dir is None:
+            return
+        path = self._path_for(key, agg_period)
+        path.mkdir(parents=True, exist_ok=True)
+        index = level.index.tz_localize(None) if level.index.tz is not None else level.index
+        np.save(Path(path, "time.npy"), index.asi8)
+        # column by column: selecting several columns at once would consolidate the cached frame's read-only blocks
+        np.save(Path(path, "prices.npy"), np.column_stack([level[k].to_numpy(dtype=np.float64) for k in PRICE_COLUMNS]))
+        symbols = level['symbol'].dropna()
+        tmp = Path(path, "meta.json.tmp")
+        with open(tmp, "w") as f:
+            json.dump({"symbol": str(symbols.iloc[0]) if len(symbols) > 0 else None,
+                       "tz": str(level.index.tz) if level.index.tz is not None else None}, f)
+        # meta.json goes last, so a partially written level is never read
+        os.replace(tmp, Path(path, "meta.json"))
+
+
+
+class LiveRollup(OHLCSource):
+    """
+    Rolls closed base bars (e.g. FIVE_MINUTES from a TickOHLCAggregator or CBProPeriodicHLOCSource) up into every
+    period in `agg_periods` as they arrive. A higher bar is emitted as soon as the base bar ending on its boundary
+    arrives, or otherwise when the first base bar of a later period shows up. Bars are kept per symbol.
+    """
+
+    def __init__(self, agg_periods: List[AggPeriod], source: OHLCSource = None, symbol: str = None,
+                 max_queue_len: int = 1000) -> None:
+        super().__init__(symbol, max_queue_len)
+        self.agg_periods = list(agg_periods)
+        # (symbol, agg period) -> [bucket, high, low, open, close, volume]
+        self.partial: Dict[Tuple[str, AggPeriod], List] = {}
+        self.filtered_listeners: List[Tuple] = []
+        if source is not None:
+            source.subscribe(self)
+
+
+    def start(self):
+        # driven by the base source
+        pass
+
+
+    def stop(self):
+        pass
+
+
+    def subscribe(self, listener, agg_period: AggPeriod = None, policy: OverflowPolicy = None, max_queue: int = 1000):
+        if agg_period is None:
+            return super().subscribe(listener, policy, max_queue)
+        if not (hasattr(listener, "on_hloc") and callable(listener.on_hloc)):
+            raise TypeError
+        listener = wrap_listener(listener, policy, max_queue)
+        self.filtered_listeners.append((listener, agg_period))
+        return listener
+
+
+    def on_hloc(self, hloc: OHLC):
+        if self.symbol is not None and hloc.symbol != self.symbol:
+            return
+        t = int(pd.Timestamp(hloc.time).value)
+        base_ns = int(hloc.duration_sec) * NANOS
+        for agg_period in self.agg_periods:
+            period_ns = agg_period.value * 60 * NANOS
+            bucket = t // period_ns
+            key = (hloc.symbol, agg_period)
+            bar = self.partial.get(key)
+            if bar is not None and bucket != bar[0]:
+                if bucket < bar[0]:
+                    logger.warning("out of order {0} bar at {1} ignored".format(hloc.symbol, hloc.time))
+                    continue
+                self._emit(hloc.symbol, agg_period, self.partial.pop(key))
+                bar = None
+            if bar is None:
+                bar = [bucket, hloc.high, hloc.low, hloc.open, hloc.close, hloc.volume]
+                self.partial[key] = bar
+            else:
+                bar[1] = max(bar[1], hloc.high)
+                bar[2] = min(bar[2], hloc.low)
+                bar[4] = hloc.close
+                bar[5] += hloc.volume
+            if t + base_ns >= (bucket + 1) * period_ns:
+                self._emit(hloc.symbol, agg_period, self.partial.pop(key))
+
+
+    def _emit(self, symbol: str, agg_period: AggPeriod, bar: List) -> None:
+        period_ns = agg_period.value * 60 * NANOS
+        hloc = OHLC(symbol, pd.Timestamp(bar[0] * period_ns, tz='UTC').to_pydatetime(), bar[1], bar[2], bar[3],
+                    bar[4], bar[5], agg_period.value * 60)
+        self.hlocs.append(hloc)
+        for listener in self.listeners:
+            listener.on_hloc(hloc)
+        for listener, period in self.filtered_listeners:
+            if period == agg_period:
+                listener.on_hloc(hloc)
@@ -1,5 +1,12 @@
+import time
+from datetime import datetime, timedelta
 from enum import Enum
+from typing import Dict, List, Tuple, Union
 
+import numpy as np
+import pandas as pd
+
+from cryptalgo.inputs.feed import datetime_to_ns, ns_to_datetime
 from cryptalgo.utils.decorators.simplifiers import initializer
 
 
@@ -12,7 +19,8 @@ class TradeSide(Enum):
 
 class Trade:
 
-    def __init__(self, symbol: str, amount: float, price: float, side: TradeSide, fee: float) -> None:
+    def __init__(self, symbol: str, amount: float, price: float, side: TradeSide, fee: float,
+                 time: datetime = None) -> None:
         if symbol is None or amount is None or price is None or side is None or fee is None:
             raise ValueError("must pass all parameters")
         self.symbol = symbol
@@ -20,16 +28,382 @@ class Trade:
         self.price = price
         self.side = side
         self.fee = fee
+        self.time = time
+
+
+
+def to_ns(t: Union[datetime, pd.Timestamp, int]) -> int:
+    """
+    Epoch nanoseconds for a datetime, Timestamp or already epoch nanosecond int; naive times are taken as UTC.
+    """
+    if isinstance(t, pd.Timestamp):
+        return t.value if t.tzinfo is None else t.tz_convert('UTC').tz_localize(None).value
+    if isinstance(t, datetime):
+        return datetime_to_ns(t)
+    return int(t)
+
+
+
+class TradeBatch:
+    """
+    A block of trades to apply at once (Account.apply_trades), stored column-wise like TickBatch: dictionary encoded
+    symbols, sides as TradeSide values, amount / price / fee as the rows of one float64 array and optional epoch
+    nanosecond times. A NaN fee means the account's fee model decides.
+    """
+
+    value_fields: List[str] = ['amount', 'price', 'fee']
+
+
+    def __init__(self, symbols: List[str], symbol_ids: np.ndarray, sides: np.ndarray, values: np.ndarray,
+                 time_ns: np.ndarray = None) -> None:
+        """
+        :param symbols: symbol dictionary that symbol_ids index into
+        :param values: shape (3, n), rows in value_fields order
+        """
+        self.symbols: List[str] = list(symbols)
+        self.symbol_ids = np.asarray(symbol_ids, dtype=np.int32)
+        self.sides = np.asarray(sides, dtype=np.int8)
+        self.values = np.asarray(values, dtype=np.float64).reshape(len(self.value_fields), -1)
+        self.time_ns = np.asarray(time_ns, dtype=np.int64) if time_ns is not None else None
+
+
+    @property
+    def amount(self) -> np.ndarray:
+        return self.values[0]
+
+
+    @property
+    def price(self) -> np.ndarray:
+        return self.values[1]
+
+
+    @property
+    def fee(self) -> np.ndarray:
+        return self.values[2]
+
+
+    def __len__(self) -> int:
+        return len(self.symbol_ids)
+
+
+    def validate(self) -> None:
+        """
+        The checks buy_shares / sell_shares make on their arguments, vectorized over the whole batch.
+        :raises ValueError: for the first row failing any of them, naming the row
+        """
+        n = len(self)
+        for name, column in [('sides', self.sides), ('values', self.values[0])] + \
+                ([('time_ns', self.time_ns)] if self.time_ns is not None else []):
+            if len(column) != n:
+                raise ValueError("{0} has {1} rows, expected {2}".format(name, len(column), n))
+        valid_symbols = np.array([s is not None and s != '' for s in self.symbols] + [False])
+        ids = self.symbol_ids
+        checks = [
+            (valid_symbols[np.where((ids >= 0) & (ids < len(self.symbols)), ids, len(self.symbols))],
+             "symbol must be passed and be non-empty"),
+            ((self.sides == TradeSide.BUY.value) | (self.sides == TradeSide.SELL.value), "side must be 1 or -1"),
+            # NaN fails these comparisons too
+            (self.amount >= 0.0, "amount must be passed and be positive"),
+            (self.price >= 0.0, "price must be passed and be positive"),
+        ]
+        bad = [(int(np.argmin(ok)), message) for ok, message in checks if not ok.all()]
+        if len(bad) > 0:
+            row, message = min(bad, key=lambda b: b[0])
+            raise ValueError("trade {0}: {1}".format(row, message))
+
+
+    @classmethod
+    def from_trades(cls, trades: List[Trade]):
+        symbols: Dict[str, int] = {}
+        symbol_ids = np.array([symbols.setdefault(t.symbol, len(symbols)) for t in trades], dtype=np.int32)
+        values = np.array([[t.amount, t.price, t.fee] for t in trades],
+                          dtype=np.float64).reshape(-1, 3)
+        times = None
+        if len(trades) > 0 and all(t.time is not None for t in trades):
+            times = np.array([to_ns(t.time) for t in trades], dtype=np.int64)
+        return TradeBatch(list(symbols), symbol_ids, np.array([t.side.value for t in trades], dtype=np.int8),
+                          values.T.copy(), times)
+
+
+
+class TradeLog:
+    """
+    Every trade of an account stored column-wise in growable NumPy arrays: epoch nanosecond times, dictionary encoded
+    symbols, sides (TradeSide values) and amount / price / fee as the rows of one float64 array. Capacity doubles as
+    it fills, so appends are amortised O(1).
+
+    Queries take an optional symbol and [start, end) time range and are answered from indexes built on first use
+    after new trades: a stable symbol sort and, while trades arrive in time order (the usual case), binary search on
+    the time column. Aggregates (count, fees, turnover, realized PnL, per_window) are vectorized over the selected
+    rows.
+    """
+
+    value_fields: List[str] = ['amount', 'price', 'fee']
+
+
+    def __init__(self, capacity: int = 1024) -> None:
+        self.symbols: List[str] = []
+        self.symbol_lookup: Dict[str, int] = {}
+        self.count = 0
+        self.time_ordered = True
+        self._time_ns = np.empty(capacity, dtype=np.int64)
+        self._symbol_ids = np.empty(capacity, dtype=np.int32)
+        self._sides = np.empty(capacity, dtype=np.int8)
+        self._values = np.empty((len(self.value_fields), capacity), dtype=np.float64)
+        # (trade count when built, stable sort of rows by symbol, per symbol id start offsets into it)
+        self._symbol_index: Tuple[int, np.ndarray, np.ndarray] = None
+        # (trade count when built, realized PnL per row)
+        self._realized: Tuple[int, np.ndarray] = None
+
+
+    def __len__(self) -> int:
+        return self.count
+
+
+    @property
+    def time_ns(self) -> np.ndarray:
+        return self._time_ns[:self.count]
+
+
+    @property
+    def symbol_ids(self) -> np.ndarray:
+        return self._symbol_ids[:self.count]
+
+
+    @property
+    def sides(self) -> np.ndarray:
+        return self._sides[:self.count]
 
 
+    @property
+    def values(self) -> np.ndarray:
+        return self._values[:, :self.count]
 
-class TradeHistory:
 
-    def __init__(self) -> None:
-        self.trades = []
+    @property
+    def amount(self) -> np.ndarray:
+        return self._values[0, :self.count]
 
 
-    def add_trade(self, trade: Trade):
+    @property
+    def price(self) -> np.ndarray:
+        return self._values[1, :self.count]
+
+
+    @property
+    def fee(self) -> np.ndarray:
+        return self._values[2, :self.count]
+
+
+    @property
+    def trades(self) -> List[Trade]:
+        """
+        The log as Trade objects, built on every call.
+        """
+        return [self[i] for i in range(self.count)]
+
+
+    def get_symbol_id(self, symbol: str) -> int:
+        symbol_id = self.symbol_lookup.get(symbol)
+        if symbol_id is None:
+            symbol_id = len(self.symbols)
+            self.symbols.append(symbol)
+            self.symbol_lookup[symbol] = symbol_id
+        return symbol_id
+
+
+    def append(self, symbol: str, amount: float, price: float, side: TradeSide, fee: float,
+               time_ns: int = None) -> None:
+        """
+        :param time_ns: epoch nanoseconds of the trade, default now
+        """
+        if symbol is None or amount is None or price is None or side is None or fee is None:
+            raise ValueError("must pass all parameters")
+        n = self.count
+        if n == len(self._time_ns):
+            self._grow(2 * n)
+        if time_ns is None:
+            time_ns = time.time_ns()
+        if n > 0 and time_ns < self._time_ns[n - 1]:
+            self.time_ordered = False
+        self._time_ns[n] = time_ns
+        self._symbol_ids[n] = self.get_symbol_id(symbol)
+        self._sides[n] = side.value
+        self._values[0, n] = amount
+        self._values[1, n] = price
+        self._values[2, n] = fee
+        self.count = n + 1
+
+
+    def add_trade(self, trade: Trade) -> None:
         if trade is None:
             raise ValueError('Trade must be passed')
-        self.trades.append(trade)
+        self.append(trade.symbol, trade.amount, trade.price, trade.side, trade.fee,
+                    to_ns(trade.time) if trade.time is not None else None)
+
+
+    def extend(self, batch: TradeBatch, fees: np.ndarray = None) -> None:
+        """
+        Appends a whole batch, stamped now if it has no times.
+        :param fees: the fees actually charged, default the batch's own fee column
+        """
+        n = len(batch)
+        if n == 0:
+            return
+        start = self.count
+        if start + n > len(self._time_ns):
+            self._grow(max(2 * start, start + n))
+        times = batch.time_ns if batch.time_ns is not None else np.full(n, time.time_ns(), dtype=np.int64)
+        if (start > 0 and times[0] < self._time_ns[start - 1]) or (n > 1 and (np.diff(times) < 0).any()):
+            self.time_ordered = False
+        ids = np.array([self.get_symbol_id(s) for s in batch.symbols], dtype=np.int32)
+        end = start + n
+        self._time_ns[start:end] = times
+        self._symbol_ids[start:end] = ids[batch.symbol_ids]
+        self._sides[start:end] = batch.sides
+        self._values[0, start:end] = batch.amount
+        self._values[1, start:end] = batch.price
+        self._values[2, start:end] = fees if fees is not None else batch.fee
+        self.count = end
+
+
+    def __getitem__(self, i: int) -> Trade:
+        if i < 0:
+            i += self.count
+        if i < 0 or i >= self.count:
+            raise IndexError("trade log index out of range")
+        amount, price, fee = self._values[:, i].tolist()
+        return Trade(self.symbols[self._symbol_ids[i]], amount, price, TradeSide(int(self._sides[i])), fee,
+                     ns_to_datetime(self._time_ns[i]))
+
+
+    def _grow(self, capacity: int) -> None:
+        capacity = max(capacity, 16)
+        n = self.count
+        for name in ['_time_ns', '_symbol_ids', '_sides']:
+            old = getattr(self, name)
+            new = np.empty(capacity, dtype=old.dtype)
+            new[:n] = old[:n]
+            setattr(self, name, new)
+        values = np.empty((len(self.value_fields), capacity), dtype=np.float64)
+        values[:, :n] = self._values[:, :n]
+        self._values = values
+
+
+    def _get_symbol_index(self) -> Tuple[np.ndarray, np.ndarray]:
+        if self._symbol_index is None or self._symbol_index[0] != self.count:
+            order = np.argsort(self.symbol_ids, kind='stable')
+            starts = np.searchsorted(self.symbol_ids[order], np.arange(len(self.symbols) + 1))
+            self._symbol_index = (self.count, order, starts)
+        return self._symbol_index[1], self._symbol_index[2]
+
+
+    def select(self, symbol: str = None, start: Union[datetime, int] = None,
+               end: Union[datetime, int] = None) -> np.ndarray:
+        """
+        :return: row numbers, in log order, of the trades in `symbol` (default all) within [start, end)
+        """
+        if symbol is not None:
+            symbol_id = self.symbol_lookup.get(symbol)
+            if symbol_id is None:
+                return np.zeros(0, dtype=np.intp)
+            order, starts = self._get_symbol_index()
+            rows = order[starts[symbol_id]:starts[symbol_id + 1]]
+        else:
+            rows = np.arange(self.count)
+        if start is None and end is None:
+            return rows
+        times = self.time_ns[rows]
+        lo = to_ns(start) if start is not None else None
+        hi = to_ns(end) if end is not None else None
+        if self.time_ordered:
+            first = np.searchsorted(times, lo, side='left') if lo is not None else 0
+            last = np.searchsorted(times, hi, side='left') if hi is not None else len(rows)
+            return rows[first:last]
+        mask = np.ones(len(rows), dtype=bool)
+        if lo is not None:
+            mask &= times >= lo
+        if hi is not None:
+            mask &= times < hi
+        return rows[mask]
+
+
+    def num_trades(self, symbol: str = None, start: Union[datetime, int] = None,
+                   end: Union[datetime, int] = None) -> int:
+        return len(self.select(symbol, start, end))
+
+
+    def fees(self, symbol: str = None, start: Union[datetime, int] = None, end: Union[datetime, int] = None) -> float:
+        return float(self.fee[self.select(symbol, start, end)].sum())
+
+
+    def turnover(self, symbol: str = None, start: Union[datetime, int] = None,
+                 end: Union[datetime, int] = None) -> float:
+        """
+        :return: traded notional, sum of amount * price
+        """
+        rows = self.select(symbol, start, end)
+        return float(np.dot(self.amount[rows], self.price[rows]))
+
+
+    def realized_pnl(self, symbol: str = None, start: Union[datetime, int] = None,
+                     end: Union[datetime, int] = None) -> float:
+        """
+        :return: net cash of the round trips closed in the range; see realized_pnl_by_trade
+        """
+        return float(self.realized_pnl_by_trade()[self.select(symbol, start, end)].sum())
+
+
+    def realized_pnl_by_trade(self) -> np.ndarray:
+        """
+        PnL realized by each trade. A symbol's position is the running sum of signed amounts; a trade that takes it
+        back to flat realizes the net cash flow (proceeds less costs and all fees) since the previous flat point, and
+        every other trade realizes 0. Positions still open contribute nothing.
+        """
+        if self._realized is not None and self._realized[0] == self.count:
+            return self._realized[1]
+        realized = np.zeros(self.count)
+        order, starts = self._get_symbol_index()
+        signed = self.sides * self.amount
+        cash = -signed * self.price - self.fee
+        for symbol_id in range(len(self.symbols)):
+            rows = order[starts[symbol_id]:starts[symbol_id + 1]]
+            if not self.time_ordered:
+                rows = rows[np.argsort(self.time_ns[rows], kind='stable')]
+            position = np.cumsum(signed[rows])
+            flow = np.cumsum(cash[rows])
+            # float noise of a full close is far below the closing trade's own size
+            flat = np.abs(position) <= 1e-9 * self.amount[rows]
+            realized[rows[flat]] = np.diff(flow[flat], prepend=0.0)
+        self._realized = (self.count, realized)
+        return realized
+
+
+    def per_window(self, window: Union[str, timedelta], symbol: str = None) -> pd.DataFrame:
+        """
+        :param window: bucket length, anything pd.Timedelta takes ('1H', '1D', timedelta(minutes=5), ...)
+        :return: num_trades, turnover, fees and realized_pnl per non-empty window, indexed by UTC window start
+        """
+        rows = self.select(symbol)
+        width = pd.Timedelta(window).value
+        buckets, inverse = np.unique(self.time_ns[rows] // width, return_inverse=True)
+        size = len(buckets)
+        df = pd.DataFrame({
+            'num_trades': np.bincount(inverse, minlength=size),
+            'turnover': np.bincount(inverse, weights=self.amount[rows] * self.price[rows], minlength=size),
+            'fees': np.bincount(inverse, weights=self.fee[rows], minlength=size),
+            'realized_pnl': np.bincount(inverse, weights=self.realized_pnl_by_trade()[rows], minlength=size),
+        }, index=pd.DatetimeIndex((buckets * width).view('datetime64[ns]'), name='time').tz_localize('UTC'))
+        return df
+
+
+    def to_dataframe(self) -> pd.DataFrame:
+        """
+        :return: one row per trade (UTC 'time' index, symbol, side, amount, price, fee); the amount, price and fee
+            columns are views of the log
+        """
+        index = pd.DatetimeIndex(self.time_ns.view('datetime64[ns]'), name='time').tz_localize('UTC')
+        df = pd.DataFrame(self.values.T, index=index, columns=self.value_fields, copy=False)
+        df.insert(0, 'symbol', pd.Categorical.from_codes(self.symbol_ids, categories=self.symbols))
+        df.insert(1, 'side', self.sides)
+        return df
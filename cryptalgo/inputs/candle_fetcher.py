@@ -0,0 +1,95 @@
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from typing import List, Tuple, Union
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from cryptalgo.utils.ratelimit import TokenBucket
+
+import logging
+
+logging.getLogger(__name__).addHandler(logging.NullHandler())
+logger = logging.getLogger(__name__)
+
+# (product, start, end, granularity secs)
+CandleRequest = Tuple[str, datetime, datetime, int]
+
+
+
+class CandleFetcher:
+    """
+    One pooled HTTP session for every CBProPeriodicHLOCSource. fetch_all() sends a batch of candle requests
+    concurrently from a thread pool, under a shared token bucket rate limit, with a timeout and retries per request.
+    """
+
+    def __init__(self, api_url: str = "https://api.pro.coinbase.com", requests_per_sec: float = 10.0,
+                 max_workers: int = 16, timeout_sec: float = 5.0, retries: int = 2, retry_delay_sec: float = 0.25) -> None:
+        self.api_url = api_url.rstrip('/')
+        self.bucket = TokenBucket(requests_per_sec, capacity=requests_per_sec)
+        self.timeout_sec = timeout_sec
+        self.retries = retries
+        self.retry_delay_sec = retry_delay_sec
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=max_workers, pool_maxsize=max_workers)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="CandleFetcher")
+        self.lock = threading.Lock()
+        self.request_ct = 0
+        self.error_ct = 0
+
+
+    def get_product_historic_rates(self, product: str, start: Union[datetime, str], end: Union[datetime, str],
+                                   granularity: int) -> List[List]:
+        """
+        Same call as cbpro.PublicClient's, retried on errors.
+        :return: rows of [time, low, high, open, close, volume], newest first
+        """
+        params = {
+            "start": start.isoformat() if isinstance(start, datetime) else start,
+            "end": end.isoformat() if isinstance(end, datetime) else end,
+            "granularity": int(granularity),
+        }
+        url = "{0}/products/{1}/candles".format(self.api_url, product)
+        for attempt in range(self.retries + 1):
+            self.bucket.acquire()
+            with self.lock:
+                self.request_ct += 1
+            try:
+                r = self.session.get(url, params=params, timeout=self.timeout_sec)
+                r.raise_for_status()
+                res = r.json()
+                if not isinstance(res, list):
+                    raise ValueError("unexpected response: {0}".format(res))
+                return res
+            except (requests.RequestException, ValueError) as e:
+                with self.lock:
+                    self.error_ct += 1
+                logger.warning("{0} {1} attempt {2} failed: {3}".format(product, params['start'], attempt + 1, e))
+                if attempt < self.retries:
+                    time.sleep(self.retry_delay_sec * (attempt + 1))
+        raise IOError("giving up on {0} {1}-{2}".format(product, params['start'], params['end']))
+
+
+    def fetch_all(self, batch: List[CandleRequest]) -> List[Union[List[List], Exception]]:
+        """
+        Runs every request concurrently.
+        :return: the rows, or the exception that ended the request's retries, for each request in order
+        """
+        futures = [self.executor.submit(self.get_product_historic_rates, *req) for req in batch]
+        results = []
+        for future in futures:
+            try:
+                results.append(future.result())
+            except Exception as e:
+                results.append(e)
+        return results
+
+
+    def close(self) -> None:
+        self.executor.shutdown(wait=True)
+        self.session.close()
+
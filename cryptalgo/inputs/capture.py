@@ -0,0 +1,279 @@
+import queue
+import threading
+import time
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Dict, List, Union
+
+from cryptalgo.inputs.feed import Tick
+from cryptalgo.inputs.ticklog import TickLogWriter
+
+import logging
+
+logging.getLogger(__name__).addHandler(logging.NullHandler())
+logger = logging.getLogger(__name__)
+
+
+
+class CaptureFile:
+    """
+    An open per-symbol capture file and the bookkeeping needed to decide when to rotate it.
+    """
+
+    def __init__(self, path: Path, hour: int) -> None:
+        self.path = path
+        self.hour = hour
+        self.handle = open(path, "w")
+        self.handle.write(Tick.to_csv_header())
+        self.bytes_written = 0
+
+
+    def write(self, ticks: List[Tick]) -> None:
+        data = "".join([t.to_csv_row() for t in ticks])
+        self.handle.write(data)
+        self.bytes_written += len(data)
+
+
+    def flush(self) -> None:
+        self.handle.flush()
+
+
+    def close(self) -> None:
+        self.handle.close()
+
+
+
+class TickLogCaptureFile:
+    """
+    CaptureFile counterpart that writes the binary tick log format.
+    """
+
+    def __init__(self, path: Path, hour: int) -> None:
+        self.path = path
+        self.hour = hour
+        self.writer = TickLogWriter(path)
+
+
+    @property
+    def bytes_written(self) -> int:
+        return self.writer.bytes_written
+
+
+    def write(self, ticks: List[Tick]) -> None:
+        self.writer.write_many(ticks)
+
+
+    def flush(self) -> None:
+        self.writer.flush()
+
+
+    def close(self) -> None:
+        self.writer.close()
+
+
+
+class TickCaptureWriter:
+    """
+    Persists ticks to per-symbol files from a background thread.
+
+    submit() only puts the tick on a bounded in-memory queue and never blocks; when the queue is full the tick is
+    dropped and counted. The writer thread batches queued ticks, flushes every `batch_size` ticks or
+    `flush_interval_sec`, and rotates a symbol's file once it reaches `rotate_bytes` or (with `rotate_hourly`) when the
+    tick hour changes. stop() drains everything still queued before returning.
+
+    A batch that fails to write is logged, its ticks are counted in failed_ct and the writer carries on with the next
+    one; stop() reports the failure.
+    """
+
+    file_suffix: str = "csv"
+
+
+    def __init__(self, directory: Union[str, Path], max_queue: int = 100000, batch_size: int = 1000,
+                 flush_interval_sec: float = 1.0, rotate_bytes: int = 256 * 1024 * 1024,
+                 rotate_hourly: bool = True) -> None:
+        self.directory = Path(directory)
+        if not self.directory.is_dir():
+            logger.warning("{0} must be a writeable directory".format(directory))
+            raise IsADirectoryError
+        self.queue: queue.Queue = queue.Queue(maxsize=max_queue)
+        self.batch_size = batch_size
+        self.flush_interval_sec = flush_interval_sec
+        self.rotate_bytes = rotate_bytes
+        self.rotate_hourly = rotate_hourly
+        self.files: Dict[str, CaptureFile] = {}
+        self.thread: threading.Thread = None
+        self.running = False
+
+        # submit() runs on the producers' threads, _write on the writer's
+        self.lock = threading.Lock()
+        self.submitted_ct = 0
+        self.dropped_ct = 0
+        self.flushed_ct = 0
+        self.failed_ct = 0
+        self.files_opened = 0
+        self.last_error: Exception = None
+
+
+    def start(self) -> None:
+        if self.thread is not None and self.thread.is_alive():
+            return
+        self.running = True
+        self.thread = threading.Thread(target=self._run, name="TickCaptureWriter", daemon=True)
+        self.thread.start()
+
+
+    def stop(self, timeout: float = None) -> bool:
+        """
+        Stops the writer after everything queued so far has been written.
+        :return: False if the writer was still draining when the timeout passed (it keeps going, and stop can be
+            called again) or if anything failed to write (see failed_ct and last_error)
+        """
+        if self.thread is None:
+            return self.last_error is None
+        self.running = False
+        self.thread.join(timeout)
+        if self.thread.is_alive():
+            logger.warning("capture writer still draining after {0}s: {1}".format(timeout, self.get_stats()))
+            return False
+        self.thread = None
+        stats = self.get_stats()
+        if self.last_error is not None:
+            logger.error("capture stopped after write errors, last: {0!r}: {1}".format(self.last_error, stats))
+            return False
+        logger.info("capture stopped: {0}".format(stats))
+        return True
+
+
+    def submit(self, tick: Tick) -> bool:
+        """
+        Queues a tick for writing without blocking.
+        :return: False if the queue was full and the tick was dropped
+        """
+        try:
+            self.queue.put_nowait(tick)
+        except queue.Full:
+            with self.lock:
+                self.dropped_ct += 1
+            return False
+        with self.lock:
+            self.submitted_ct += 1
+        return True
+
+
+    def get_stats(self) -> Dict[str, int]:
+        with self.lock:
+            return {
+                "submitted": self.submitted_ct,
+                "dropped": self.dropped_ct,
+                "flushed": self.flushed_ct,
+                "failed": self.failed_ct,
+                "queued": self.queue.qsize(),
+                "files_opened": self.files_opened,
+            }
+
+
+    def _run(self) -> None:
+        batch: List[Tick] = []
+        last_flush = time.monotonic()
+        while True:
+            try:
+                batch.append(self.queue.get(timeout=self.flush_interval_sec / 4))
+                # take whatever else is already waiting without blocking
+                while len(batch) < self.batch_size:
+                    batch.append(self.queue.get_nowait())
+            except queue.Empty:
+                pass
+
+            now = time.monotonic()
+            if len(batch) >= self.batch_size or (len(batch) > 0 and now - last_flush >= self.flush_interval_sec):
+                self._write_safely(batch)
+                batch = []
+                last_flush = now
+
+            if not self.running and self.queue.empty():
+                break
+
+        if len(batch) > 0:
+            self._write_safely(batch)
+        for f in self.files.values():
+            try:
+                f.close()
+            except Exception as e:
+                with self.lock:
+                    self.last_error = e
+                logger.exception("failed to close capture file {0}".format(f.path))
+        self.files = {}
+
+
+    def _write_safely(self, batch: List[Tick]) -> None:
+        try:
+            self._write(batch)
+        except Exception as e:
+            with self.lock:
+                self.failed_ct += len(batch)
+                self.last_error = e
+            logger.exception("failed to write {0} captured ticks".format(len(batch)))
+
+
+    def _write(self, batch: List[Tick]) -> None:
+        by_symbol: Dict[str, List[Tick]] = {}
+        for tick in batch:
+            by_symbol.setdefault(tick.symbol, []).append(tick)
+        for symbol, ticks in by_symbol.items():
+            start = 0
+            for i in range(len(ticks) + 1):
+                # split the batch wherever the file has to rotate
+                if i == len(ticks) or self._needs_rotation(symbol, ticks[i]):
+                    if i > start:
+                        self.files[symbol].write(ticks[start:i])
+                    if i < len(ticks):
+                        self._rotate(symbol, ticks[i])
+                    start = i
+            self.files[symbol].flush()
+        with self.lock:
+            self.flushed_ct += len(batch)
+
+
+    def _needs_rotation(self, symbol: str, tick: Tick) -> bool:
+        f = self.files.get(symbol)
+        if f is None:
+            return True
+        if self.rotate_bytes is not None and f.bytes_written >= self.rotate_bytes:
+            return True
+        return self.rotate_hourly and self._hour_of(tick) != f.hour
+
+
+    def _rotate(self, symbol: str, tick: Tick) -> None:
+        f = self.files.pop(symbol, None)
+        if f is not None:
+            f.close()
+        stamp = datetime.now(timezone.utc).strftime("%Y%m%d-%H%M%S-%f")
+        path = Path(self.directory, "{0}-{1}.{2}".format(symbol, stamp, self.file_suffix))
+        self.files[symbol] = self._open_file(path, self._hour_of(tick))
+        with self.lock:
+            self.files_opened += 1
+
+
+    def _open_file(self, path: Path, hour: int) -> CaptureFile:
+        return CaptureFile(path, hour)
+
+
+    @classmethod
+    def _hour_of(cls, tick: Tick) -> int:
+        t = tick.time
+        if isinstance(t, datetime):
+            return int(t.timestamp()) // 3600
+        return 0
+
+
+
+class TickLogCaptureWriter(TickCaptureWriter):
+    """
+    TickCaptureWriter that captures to binary tick logs (see ticklog.TickLogReader) instead of CSV.
+    """
+
+    file_suffix: str = "ticks"
+
+
+    def _open_file(self, path: Path, hour: int) -> TickLogCaptureFile:
+        return TickLogCaptureFile(path, hour)
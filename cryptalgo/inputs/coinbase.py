@@ -1,8 +1,6 @@
-import json
-from datetime import datetime
-from pathlib import Path
-
 import cbpro
+from cryptalgo.inputs.capture import TickCaptureWriter, TickLogCaptureWriter
+from cryptalgo.inputs.decode import TickerDecoder
 from cryptalgo.inputs.feed import Tick, Feed
 import logging
 
@@ -19,6 +17,7 @@ class CbproWebsocketClient(cbpro.WebsocketClient):
                  message_type: str = "subscribe",
                  channels: [] = ["ticker"]) -> None:
         self.listeners = []
+        self.decoder = TickerDecoder()
         super().__init__(url, products, message_type, None, False, False, "", "", "", channels)
 
 
@@ -27,20 +26,13 @@ class CbproWebsocketClient(cbpro.WebsocketClient):
 
 
     def on_message(self, msg):
-        if 'type' in msg:
-            if msg['type'] == 'ticker':
-                tick = Tick(
-                    time=datetime.strptime(msg['time'], '%Y-%m-%dT%H:%M:%S.%f%z'),
-                    symbol=msg['product_id'],
-                    price=msg['price'],
-                    size=msg['last_size'],
-                    side=msg['side'],
-                    best_ask=msg['best_ask'],
-                    best_bid=msg['best_bid']
-                )
-                logger.debug("tick: {0}".format(tick))
-                for listener in self.listeners:
-                    listener.on_tick(tick)
+        tick = self.decoder.decode(msg)
+        if tick is None:
+            return
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug("tick: {0}".format(tick))
+        for listener in self.listeners:
+            listener.on_tick(tick)
 
 
     def on_close(self):
@@ -58,35 +50,32 @@ class CbproWebsocketClient(cbpro.WebsocketClient):
 
 class CoinbaseFeed(Feed):
 
-    def __init__(self, products: [], max_buffer: int = 1000, file_cache_path: str = None):
+    def __init__(self, products: [], max_buffer: int = 1000, file_cache_path: str = None, binary_capture: bool = False,
+                 **capture_args):
         super().__init__(max_buffer)
         self.source = CbproWebsocketClient(products)
         self.source.subscribe(self)
         if file_cache_path is not None:
-            self.fcache: Path = Path(file_cache_path)
-            if not self.fcache.is_dir():
-                logger.warning("{0} must be a writeable directory".format(file_cache_path))
-                raise IsADirectoryError
-            self.fcache_files = {}
+            # ticks are written by a background thread so capture never blocks tick dispatch
+            capture_cls = TickLogCaptureWriter if binary_capture else TickCaptureWriter
+            self.capture: TickCaptureWriter = capture_cls(file_cache_path, **capture_args)
         else:
-            self.fcache: Path = None
+            self.capture: TickCaptureWriter = None
 
 
     def start(self):
+        if self.capture is not None:
+            self.capture.start()
         self.source.start()
 
 
     def stop(self):
-        self.source.stop()
+        self.source.close()
+        if self.capture is not None:
+            self.capture.stop()
 
 
     def after_tick(self, tick: Tick):
         super().after_tick(tick)
-        if self.fcache is not None:
-            if tick.symbol not in self.fcache_files:
-                self.fcache_files[tick.symbol] = Path(self.fcache, "{0}-{1}.csv".format(tick.symbol, datetime.now()))
-                with open(self.fcache_files[tick.symbol], "w") as f:
-                    f.write(tick.to_csv_header())
-            with open(self.fcache_files[tick.symbol], "a") as f:
-                f.write(tick.to_csv_row())
-
+        if self.capture is not None:
+            self.capture.submit(tick)
@@ -0,0 +1,115 @@
+import json
+import time
+from datetime import datetime
+from pathlib import Path
+from typing import Dict, List, Union
+
+from cryptalgo.inputs.feed import Tick, parse_iso_ns
+
+import logging
+
+logging.getLogger(__name__).addHandler(logging.NullHandler())
+logger = logging.getLogger(__name__)
+
+
+
+class TickerDecoder:
+    """
+    Turns Coinbase websocket messages into Ticks. Anything but a trade ticker message is rejected before any other work,
+    and the time is parsed straight to epoch nanoseconds (Tick.time_ns); the datetime is only built if someone asks
+    for Tick.time.
+    """
+
+    def __init__(self) -> None:
+        self.decoded_ct = 0
+        self.skipped_ct = 0
+        self.error_ct = 0
+
+
+    def decode(self, msg: Dict) -> Union[Tick, None]:
+        """
+        :return: the Tick, or None for non-ticker or malformed messages
+        """
+        # the snapshot ticker sent right after subscribing has no trade (and no time) in it
+        if msg.get('type') != 'ticker' or 'time' not in msg:
+            self.skipped_ct += 1
+            return None
+        try:
+            tick = Tick(
+                None,
+                msg['product_id'],
+                msg['price'],
+                msg['last_size'],
+                msg['side'],
+                msg['best_bid'],
+                msg['best_ask'],
+                time_ns=parse_iso_ns(msg['time']),
+            )
+        except (KeyError, ValueError, TypeError) as e:
+            self.error_ct += 1
+            logger.warning("bad ticker message {0}: {1}".format(msg, e))
+            return None
+        self.decoded_ct += 1
+        return tick
+
+
+
+def load_corpus(path: Union[str, Path]) -> List[Dict]:
+    """
+    Reads recorded websocket messages, one JSON object per line.
+    """
+    with open(path, "r") as f:
+        return [json.loads(line) for line in f if len(line.strip()) > 0]
+
+
+
+def _decode_legacy(msg: Dict) -> Union[Tick, None]:
+    # the decode path CbproWebsocketClient.on_message used before TickerDecoder, for comparison; the KeyError guard
+    # is only there for the initial ticker snapshots, which carry no trade
+    if 'type' in msg and 'time' in msg:
+        if msg['type'] == 'ticker':
+            tick = Tick(
+                time=datetime.strptime(msg['time'], '%Y-%m-%dT%H:%M:%S.%f%z'),
+                symbol=msg['product_id'],
+                price=msg['price'],
+                size=msg['last_size'],
+                side=msg['side'],
+                best_ask=msg['best_ask'],
+                best_bid=msg['best_bid']
+            )
+            logger.debug("tick: {0}".format(tick))
+            return tick
+    return None
+
+
+
+def benchmark(messages: List[Dict], repeat: int = 5) -> Dict[str, float]:
+    """
+    :return: messages/sec through the legacy and the TickerDecoder paths (best of `repeat`) and their ratio
+    """
+    decoder = TickerDecoder()
+    results = {}
+    for name, decode in [("legacy", _decode_legacy), ("decoder", decoder.decode)]:
+        best = None
+        for _ in range(repeat):
+            started = time.perf_counter()
+            for msg in messages:
+                decode(msg)
+            elapsed = time.perf_counter() - started
+            best = elapsed if best is None else min(best, elapsed)
+        results[name] = len(messages) / best
+    results['speedup'] = results['decoder'] / results['legacy']
+    return results
+
+
+
+if __name__ == '__main__':
+    logging.basicConfig(
+        level=logging.INFO,
+        format='%(asctime)s | %(levelname)s: [%(filename)s:%(funcName)s:%(lineno)d] %(message)s'
+    )
+
+    corpus = load_corpus(Path("./test/data/cbpro_messages.jsonl"))
+    res = benchmark(corpus * 20)
+    print("legacy: {0:.0f} msgs/sec | decoder: {1:.0f} msgs/sec | {2:.1f}x".format(
+        res['legacy'], res['decoder'], res['speedup']))
@@ -0,0 +1,168 @@
+import collections
+import threading
+from enum import Enum
+from typing import Dict
+
+import logging
+
+logging.getLogger(__name__).addHandler(logging.NullHandler())
+logger = logging.getLogger(__name__)
+
+
+
+class OverflowPolicy(Enum):
+    BLOCK = "block"  # the producer waits for room
+    DROP_OLDEST = "drop_oldest"  # the oldest queued event is discarded
+    CONFLATE = "conflate"  # only the latest event per (callback, symbol) is kept
+
+
+
+class QueuedListener:
+    """
+    Decouples a listener from the thread producing its events. Any on_* callback of the wrapped listener (on_tick,
+    on_hloc, on_signal, ...) called on the QueuedListener is put on a bounded queue and delivered, in order, from the
+    QueuedListener's own thread, so a slow listener no longer holds up the producer or the other listeners. What
+    happens when the queue is full is set by `policy`.
+    """
+
+    def __init__(self, listener, max_queue: int = 1000, policy: OverflowPolicy = OverflowPolicy.BLOCK) -> None:
+        if max_queue < 1:
+            raise ValueError("max_queue must be at least 1")
+        self.listener = listener
+        self.max_queue = max_queue
+        self.policy = policy
+        # CONFLATE keeps (callback, symbol) -> event in arrival order of the key, the others a FIFO of events
+        self.events = collections.OrderedDict() if policy == OverflowPolicy.CONFLATE else collections.deque()
+        self.cond = threading.Condition()
+        self.running = True
+        self.busy = False
+        self.enqueued_ct = 0
+        self.delivered_ct = 0
+        self.dropped_ct = 0
+        self.conflated_ct = 0
+        self.error_ct = 0
+        self.max_depth = 0
+        self.thread = threading.Thread(target=self._run, name="QueuedListener", daemon=True)
+        self.thread.start()
+
+
+    def __getattr__(self, item):
+        if item.startswith("on_"):
+            listener = self.__dict__.get('listener')
+            if listener is not None and callable(getattr(listener, item, None)):
+                return lambda *args: self.put(item, args)
+        raise AttributeError(item)
+
+
+    def put(self, callback: str, args: tuple) -> bool:
+        """
+        Queues a call to the listener's `callback`.
+        :return: False if an event was dropped to make room
+        :raises RuntimeError: the queue is closed, or was closed while a BLOCK producer waited for room
+        """
+        dropped = False
+        with self.cond:
+            if not self.running:
+                raise RuntimeError("listener queue is closed")
+            if self.policy == OverflowPolicy.CONFLATE:
+                key = (callback, getattr(args[0], "symbol", None) if len(args) > 0 else None)
+                if key in self.events:
+                    # replaced in place, keeping the key's position in the queue
+                    self.events[key] = args
+                    self.conflated_ct += 1
+                    return True
+                if len(self.events) >= self.max_queue:
+                    self.events.popitem(last=False)
+                    self.dropped_ct += 1
+                    dropped = True
+                self.events[key] = args
+            else:
+                if len(self.events) >= self.max_queue:
+                    if self.policy == OverflowPolicy.BLOCK:
+                        while len(self.events) >= self.max_queue and self.running:
+                            self.cond.wait()
+                        if not self.running:
+                            raise RuntimeError("listener queue closed while waiting for room")
+                    else:
+                        self.events.popleft()
+                        self.dropped_ct += 1
+                        dropped = True
+                self.events.append((callback, args))
+            self.enqueued_ct += 1
+            self.max_depth = max(self.max_depth, len(self.events))
+            self.cond.notify_all()
+        return not dropped
+
+
+    def get_depth(self) -> int:
+        with self.cond:
+            return len(self.events)
+
+
+    def get_stats(self) -> Dict[str, int]:
+        with self.cond:
+            return {
+                "depth": len(self.events),
+                "max_depth": self.max_depth,
+                "enqueued": self.enqueued_ct,
+                "delivered": self.delivered_ct,
+                "dropped": self.dropped_ct,
+                "conflated": self.conflated_ct,
+                "errors": self.error_ct,
+            }
+
+
+    def join(self, timeout: float = None) -> bool:
+        """
+        Waits until everything queued so far has been delivered.
+        :return: False if the timeout passed first
+        """
+        with self.cond:
+            return self.cond.wait_for(lambda: len(self.events) == 0 and not self.busy, timeout)
+
+
+    def close(self, drain: bool = True) -> None:
+        if drain:
+            self.join()
+        with self.cond:
+            self.running = False
+            self.cond.notify_all()
+        self.thread.join()
+
+
+    def _run(self) -> None:
+        while True:
+            with self.cond:
+                while len(self.events) == 0 and self.running:
+                    self.cond.wait()
+                if len(self.events) == 0:
+                    return
+                if self.policy == OverflowPolicy.CONFLATE:
+                    (callback, _), args = self.events.popitem(last=False)
+                else:
+                    callback, args = self.events.popleft()
+                self.busy = True
+                # room for a blocked producer
+                self.cond.notify_all()
+            failed = False
+            try:
+                getattr(self.listener, callback)(*args)
+            except Exception:
+                failed = True
+                logger.exception("{0}.{1} failed".format(type(self.listener).__name__, callback))
+            with self.cond:
+                if failed:
+                    self.error_ct += 1
+                self.busy = False
+                self.delivered_ct += 1
+                self.cond.notify_all()
+
+
+
+def wrap_listener(listener, policy: OverflowPolicy = None, max_queue: int = 1000):
+    """
+    :return: the listener itself for synchronous dispatch (policy None), otherwise a QueuedListener around it
+    """
+    if policy is None:
+        return listener
+    return QueuedListener(listener, max_queue, policy)
@@ -1,25 +1,113 @@
 import abc
 import collections
-from datetime import datetime
-from typing import Deque
+import threading
+import time
+from datetime import datetime, timezone, timedelta
+from typing import Deque, Dict, Iterator, List, Tuple, Union
 
 import logging
 
 import jsonpickle
+import numpy as np
+import pandas as pd
+
+from cryptalgo.coredata.ringbuffer import RingBuffer
+from cryptalgo.inputs.dispatch import OverflowPolicy, wrap_listener
 
 logging.getLogger(__name__).addHandler(logging.NullHandler())
 logger = logging.getLogger(__name__)
 
+EPOCH = datetime(1970, 1, 1, tzinfo=timezone.utc)
+ONE_MICRO = timedelta(microseconds=1)
+NANOS = 1000000000
+
+# stored in int64 time columns for a tick without a time; the value NumPy and pandas read as NaT
+NAT_NS: int = np.iinfo(np.int64).min
+
+SIDES: Dict[str, int] = {'buy': 1, 'sell': -1}
+SIDE_NAMES: Dict[int, str] = {1: 'buy', -1: 'sell', 0: 'UNK'}
+
+
+
+def datetime_to_ns(t: datetime) -> int:
+    """
+    Epoch nanoseconds for a datetime; naive datetimes are taken as UTC.
+    """
+    if t.tzinfo is None:
+        t = t.replace(tzinfo=timezone.utc)
+    return ((t - EPOCH) // ONE_MICRO) * 1000
+
+
+
+def ns_to_datetime(ns: int) -> datetime:
+    return EPOCH + timedelta(microseconds=int(ns) // 1000)
+
+
+
+# "YYYY-MM-DDTHH:MM" -> epoch seconds; consecutive ticks almost always share the minute
+_minute_secs: Dict[str, int] = {}
+
+
+
+def parse_iso_ns(s: str) -> int:
+    """
+    Parses a Coinbase timestamp ("2021-06-01T12:34:56.123456Z", any number of fraction digits, or none) to int epoch
+    nanoseconds by slicing fixed positions. Anything else goes through datetime.fromisoformat.
+    """
+    minute = _minute_secs.get(s[:16])
+    if minute is None:
+        if len(s) < 20 or s[4] != '-' or s[7] != '-' or s[10] != 'T' or s[13] != ':' or s[16] != ':':
+            return _parse_iso_ns_slow(s)
+        try:
+            minute = int(datetime(int(s[0:4]), int(s[5:7]), int(s[8:10]), int(s[11:13]), int(s[14:16]),
+                                  tzinfo=timezone.utc).timestamp())
+        except ValueError:
+            return _parse_iso_ns_slow(s)
+        if len(_minute_secs) > 4096:
+            _minute_secs.clear()
+        _minute_secs[s[:16]] = minute
+    if len(s) == 27 and s[19] == '.' and s[26] == 'Z':
+        # microseconds, the usual case
+        return (minute + int(s[17:19])) * NANOS + int(s[20:26]) * 1000
+    if s[-1] != 'Z':
+        return _parse_iso_ns_slow(s)
+    if len(s) == 20:
+        return (minute + int(s[17:19])) * NANOS
+    if s[19] != '.':
+        return _parse_iso_ns_slow(s)
+    return (minute + int(s[17:19])) * NANOS + int(s[20:-1][:9].ljust(9, '0'))
+
+
+
+def _parse_iso_ns_slow(s: str) -> int:
+    s = s[:-1] + "+00:00" if s.endswith('Z') else s
+    frac = ""
+    if '.' in s:
+        # fromisoformat only takes 3 or 6 fraction digits before python 3.11
+        head, rest = s.split('.', 1)
+        digits = len(rest) - len(rest.lstrip('0123456789'))
+        frac, tz = rest[:digits], rest[digits:]
+        s = head + tz
+    return datetime_to_ns(datetime.fromisoformat(s)) + (int(frac[:9].ljust(9, '0')) if frac else 0)
+
+
 
 class Tick:
     """
-    A single trading signal or event
+    A single trading signal or event.
+
+    The time can be given as a datetime, as int epoch nanoseconds (time_ns) or both; whichever is missing is derived
+    on first access, so decoders that only have nanoseconds never pay for building a datetime nobody reads. An ISO
+    8601 string (as read back by from_csv_row) is kept as is in `time`; time_ns parses it.
     """
 
+    __slots__ = ('_time', '_time_ns', 'symbol', 'price', 'size', 'side', 'best_bid', 'best_ask')
+
 
-    def __init__(self, time: datetime, symbol: str, price: float, size: float, side: str = "UNK",
-                 best_bid: float = -1.0, best_ask: float = -1.0) -> None:
-        self.time: datetime = time
+    def __init__(self, time: Union[datetime, None], symbol: str, price: float, size: float, side: str = "UNK",
+                 best_bid: float = -1.0, best_ask: float = -1.0, time_ns: int = None) -> None:
+        self._time: datetime = time
+        self._time_ns: int = time_ns
         self.symbol: str = symbol
         self.price: float = float(price)
         self.size: float = float(size)
@@ -28,12 +116,52 @@ class Tick:
         self.best_ask: float = float(best_ask)
 
 
+    @property
+    def time(self) -> datetime:
+        if self._time is None and self._time_ns is not None:
+            self._time = ns_to_datetime(self._time_ns)
+        return self._time
+
+
+    @time.setter
+    def time(self, value: datetime) -> None:
+        self._time = value
+        self._time_ns = None
+
+
+    @property
+    def time_ns(self) -> Union[int, None]:
+        """
+        :return: epoch nanoseconds, or None for a tick without a time
+        """
+        if self._time_ns is None and self._time is not None:
+            t = self._time
+            if isinstance(t, pd.Timestamp):
+                # naive timestamps are taken as UTC, like datetime_to_ns
+                self._time_ns = t.value
+            elif isinstance(t, datetime):
+                self._time_ns = datetime_to_ns(t)
+            elif isinstance(t, str):
+                self._time_ns = parse_iso_ns(t)
+            else:
+                raise TypeError("unsupported tick time {0!r}".format(t))
+        return self._time_ns
+
+
     def __str__(self) -> str:
         return "{0}: {1} {2} ({3} units)".format(self.time, self.symbol, self.price, self.size)
 
 
     def to_json(self) -> str:
-        return jsonpickle.encode(self, unpicklable=False)
+        return jsonpickle.encode({
+            "time": self.time,
+            "symbol": self.symbol,
+            "price": self.price,
+            "size": self.size,
+            "side": self.side,
+            "best_bid": self.best_bid,
+            "best_ask": self.best_ask,
+        }, unpicklable=False)
 
 
     def to_csv_row(self) -> str:
@@ -67,10 +195,146 @@ class Tick:
 
 
 
+class TickBatch:
+    """
+    A block of ticks stored column-wise: epoch nanosecond times, price/size/best_bid/best_ask as the rows of one
+    float64 array, sides as int8 (SIDES) and dictionary encoded symbols. 43 bytes per tick, and to_dataframe hands the
+    price columns to pandas without copying them.
+    """
+
+    value_fields: List[str] = ['price', 'size', 'best_bid', 'best_ask']
+
+
+    def __init__(self, symbols: List[str], symbol_ids: np.ndarray, time_ns: np.ndarray, values: np.ndarray,
+                 sides: np.ndarray) -> None:
+        """
+        :param symbols: symbol dictionary that symbol_ids index into
+        :param values: shape (4, n), rows in value_fields order
+        """
+        self.symbols: List[str] = list(symbols)
+        self.symbol_ids = np.asarray(symbol_ids, dtype=np.uint16)
+        self.time_ns = np.asarray(time_ns, dtype=np.int64)
+        self.values = np.asarray(values, dtype=np.float64)
+        self.sides = np.asarray(sides, dtype=np.int8)
+
+
+    @property
+    def price(self) -> np.ndarray:
+        return self.values[0]
+
+
+    @property
+    def size(self) -> np.ndarray:
+        return self.values[1]
+
+
+    @property
+    def best_bid(self) -> np.ndarray:
+        return self.values[2]
+
+
+    @property
+    def best_ask(self) -> np.ndarray:
+        return self.values[3]
+
+
+    def __len__(self) -> int:
+        return len(self.time_ns)
+
+
+    def __getitem__(self, key) -> Union[Tick, 'TickBatch']:
+        """
+        An int gives that tick as a Tick, a slice gives a TickBatch of views.
+        """
+        if isinstance(key, slice):
+            return TickBatch(self.symbols, self.symbol_ids[key], self.time_ns[key], self.values[:, key],
+                             self.sides[key])
+        v = self.values[:, key].tolist()
+        side = SIDE_NAMES.get(int(self.sides[key]), 'UNK')
+        time_ns = int(self.time_ns[key])
+        return Tick(None, self.symbols[self.symbol_ids[key]], v[0], v[1], side, v[2], v[3], time_ns=time_ns)
+
+
+    def __iter__(self):
+        return iter(self.to_ticks())
+
+
+    def to_ticks(self) -> List[Tick]:
+        symbols = self.symbols
+        return [
+            Tick(None, symbols[k], p, s, SIDE_NAMES.get(side, 'UNK'), bid, ask, time_ns=t)
+            for k, t, p, s, bid, ask, side in zip(
+                self.symbol_ids.tolist(), self.time_ns.tolist(), *self.values.tolist(), self.sides.tolist())
+        ]
+
+
+    def to_dataframe(self) -> pd.DataFrame:
+        """
+        :return: ticks with a UTC 'time' index, symbol (categorical), price, size, side (int8), best_bid and best_ask;
+            the float columns are views of this batch
+        """
+        index = pd.DatetimeIndex(self.time_ns.view('datetime64[ns]'), name='time').tz_localize('UTC')
+        df = pd.DataFrame(self.values.T, index=index, columns=self.value_fields, copy=False)
+        df.insert(0, 'symbol', pd.Categorical.from_codes(self.symbol_ids.astype(np.int32), categories=self.symbols))
+        df['side'] = self.sides
+        return df
+
+
+    @classmethod
+    def from_ticks(cls, ticks: List[Tick]):
+        symbols: Dict[str, int] = {}
+        symbol_ids = np.array([symbols.setdefault(t.symbol, len(symbols)) for t in ticks], dtype=np.uint16)
+        values = np.array([[t.price, t.size, t.best_bid, t.best_ask] for t in ticks], dtype=np.float64).reshape(-1, 4)
+        return TickBatch(
+            list(symbols),
+            symbol_ids,
+            np.array([NAT_NS if t.time_ns is None else t.time_ns for t in ticks], dtype=np.int64),
+            values.T.copy(),
+            np.array([SIDES.get(t.side, 0) for t in ticks], dtype=np.int8),
+        )
+
+
+
+class TickBuffer(RingBuffer):
+    """
+    The newest ticks of a feed as NumPy columns (time as epoch nanoseconds or NAT_NS, side as SIDES). Indexing and
+    iteration rebuild Tick objects from the columns.
+    """
+
+    tick_fields: Dict[str, str] = {
+        'symbol': 'O',
+        'time': 'i8',
+        'price': 'f8',
+        'size': 'f8',
+        'best_bid': 'f8',
+        'best_ask': 'f8',
+        'side': 'i1',
+    }
+
+
+    def __init__(self, capacity: int) -> None:
+        super().__init__(capacity, TickBuffer.tick_fields)
+
+
+    def append(self, tick: Tick) -> None:
+        t = tick.time_ns
+        super().append(tick.symbol, NAT_NS if t is None else t, tick.price, tick.size, tick.best_bid, tick.best_ask,
+                       SIDES.get(tick.side, 0))
+
+
+    def build_item(self, pos: int) -> Tick:
+        c = self.columns
+        t = int(c['time'][pos])
+        return Tick(None, c['symbol'][pos], float(c['price'][pos]), float(c['size'][pos]),
+                    SIDE_NAMES.get(int(c['side'][pos]), 'UNK'), float(c['best_bid'][pos]), float(c['best_ask'][pos]),
+                    time_ns=None if t == NAT_NS else t)
+
+
+
 class Feed(metaclass=abc.ABCMeta):
 
     def __init__(self, max_buffer: int = 1000) -> None:
-        self.tick_buffer = collections.deque(iterable=[], maxlen=max_buffer)
+        self.tick_buffer = TickBuffer(max_buffer)
         self.listeners = []
         super().__init__()
 
@@ -87,10 +351,11 @@ class Feed(metaclass=abc.ABCMeta):
 
     def on_tick(self, msg: Tick):
         if isinstance(msg, Tick):
-            logger.debug("tick received: {0}".format(msg))
+            if logger.isEnabledFor(logging.DEBUG):
+                logger.debug("tick received: {0}".format(msg))
             if self.accept_tick(msg):
                 self.before_tick(msg)
-                self.tick_buffer.appendleft(msg)
+                self.tick_buffer.append(msg)
                 for listener in self.listeners:
                     listener.on_tick(msg)
                 self.after_tick(msg)
@@ -110,27 +375,134 @@ class Feed(metaclass=abc.ABCMeta):
         pass
 
 
-    def get_ticks(self) -> Deque:
-        return self.tick_buffer
+    def get_ticks(self) -> Deque[Tick]:
+        """
+        :return: the buffered ticks, newest first, rebuilt from the buffer (get_tick_columns gives the columns as
+            they are)
+        """
+        return collections.deque(reversed(list(self.tick_buffer)), maxlen=self.tick_buffer.capacity)
+
 
+    def get_tick_columns(self, n: int = None) -> Dict[str, np.ndarray]:
+        """
+        :return: field -> read-only view of the newest n (default all) buffered ticks, oldest first; see TickBuffer
+        """
+        return self.tick_buffer.last(n)
 
-    def subscribe(self, listener):
+
+    def subscribe(self, listener, policy: OverflowPolicy = None, max_queue: int = 1000):
+        """
+        :param policy: deliver ticks to this listener from its own queue and thread (see QueuedListener) instead of
+            calling it on the feed's thread
+        :return: the subscribed listener, i.e. the QueuedListener when a policy is given
+        """
         if hasattr(listener, "on_tick") and callable(listener.on_tick):
+            listener = wrap_listener(listener, policy, max_queue)
             self.listeners.append(listener)
+            return listener
         else:
             raise TypeError
 
 
 
 class FileFeed(Feed):
+    """
+    Replays a tick capture (CSV written through Tick.to_csv_row, or a binary tick log) through on_tick from a
+    background thread.
 
-    def __init__(self, fpath: str, max_buffer: int = 1000) -> None:
+    speed None or 0 replays as fast as possible, 1 in real time and N at N times real time, pacing on the recorded
+    tick timestamps. The file is read `chunk_size` ticks at a time, so memory use does not grow with the file.
+    """
+
+    def __init__(self, fpath: str, max_buffer: int = 1000, speed: float = None, chunk_size: int = 100000) -> None:
         super().__init__(max_buffer)
+        self.fpath = fpath
+        self.speed = speed
+        self.chunk_size = chunk_size
+        self.end = True
+        self.thread: threading.Thread = None
+        self.done = threading.Event()
+        self.tick_ct = 0
+        self.elapsed_sec = 0.0
 
 
     def start(self):
-        pass
+        self.end = False
+        self.done.clear()
+        self.tick_ct = 0
+        self.thread = threading.Thread(target=self._replay, name="FileFeed", daemon=True)
+        self.thread.start()
 
 
     def stop(self):
-        pass
+        self.end = True
+        if self.thread is not None:
+            self.thread.join()
+            self.thread = None
+
+
+    def wait(self, timeout: float = None) -> bool:
+        """
+        Blocks until the whole file has been replayed (or the feed is stopped).
+        :return: False if the timeout passed first
+        """
+        return self.done.wait(timeout)
+
+
+    def get_ticks_per_sec(self) -> float:
+        return self.tick_ct / self.elapsed_sec if self.elapsed_sec > 0 else 0.0
+
+
+    def _replay(self):
+        started = time.monotonic()
+        first_ns = None
+        try:
+            for times_ns, ticks in self._read_chunks():
+                if first_ns is None and len(times_ns) > 0:
+                    first_ns = int(times_ns[0])
+                for i, tick in enumerate(ticks):
+                    if self.end:
+                        return
+                    if self.speed:
+                        # sleep until the tick's recorded offset from the first tick, scaled by speed, has passed
+                        wait = (int(times_ns[i]) - first_ns) / 1e9 / self.speed - (time.monotonic() - started)
+                        if wait > 0:
+                            time.sleep(wait)
+                    self.on_tick(tick)
+                    self.tick_ct += 1
+        finally:
+            self.elapsed_sec = time.monotonic() - started
+            logger.info("replayed {0} ticks from {1} in {2:.2f}s ({3:.0f} ticks/sec)".format(
+                self.tick_ct, self.fpath, self.elapsed_sec, self.get_ticks_per_sec()))
+            self.done.set()
+
+
+    def _read_chunks(self) -> Iterator[Tuple[np.ndarray, List[Tick]]]:
+        """
+        :return: (epoch nanosecond times, ticks) for each chunk of the file
+        """
+        from cryptalgo.inputs.ticklog import TickLogHeader, TickLogReader
+
+        with open(self.fpath, "rb") as f:
+            binary = f.read(len(TickLogHeader.magic)) == TickLogHeader.magic
+        if binary:
+            reader = TickLogReader(self.fpath)
+            for records in reader.chunks(self.chunk_size):
+                yield np.asarray(records['time']), reader.to_ticks(records)
+            return
+
+        for chunk in pd.read_csv(self.fpath, sep=",", quotechar='"', chunksize=self.chunk_size,
+                                 float_precision='round_trip'):
+            times_ns = pd.to_datetime(chunk['time'], utc=True).values.view(np.int64)
+            ticks = [
+                Tick(None, *row[1:], time_ns=row[0]) for row in zip(
+                    times_ns.tolist(),
+                    chunk['symbol'].tolist(),
+                    chunk['price'].tolist(),
+                    chunk['size'].tolist(),
+                    chunk['side'].tolist(),
+                    chunk['best_bid'].tolist(),
+                    chunk['best_ask'].tolist(),
+                )
+            ]
+            yield times_ns, ticks
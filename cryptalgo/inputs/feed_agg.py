@@ -1,18 +1,24 @@
 import abc
 import collections
-import csv
+import heapq
+import json
+import math
 import time
+from array import array
 from threading import Thread
 from enum import Enum
 from datetime import datetime, timedelta, timezone
 import threading as th
-from typing import List, Union, Dict
+from typing import List, Union, Dict, Tuple
+import numpy as np
 import pandas as pd
 
 import cbpro
-import jsonpickle
 
-from cryptalgo.inputs.feed import Feed
+from cryptalgo.coredata.ringbuffer import RingBuffer
+from cryptalgo.inputs.candle_fetcher import CandleFetcher
+from cryptalgo.inputs.dispatch import OverflowPolicy, wrap_listener
+from cryptalgo.inputs.feed import Feed, datetime_to_ns, ns_to_datetime
 
 import logging
 
@@ -20,6 +26,14 @@ logging.getLogger(__name__).addHandler(logging.NullHandler())
 logger = logging.getLogger(__name__)
 
 
+def _json_default(o):
+    # NumPy scalars coming from DataFrame rows
+    if hasattr(o, 'item'):
+        return o.item()
+    return str(o)
+
+
+
 class AggPeriod(Enum):
     ONE_MINUTE = 1
     FIVE_MINUTES = 5
@@ -34,6 +48,8 @@ class OHLC:
     Represents the high, low, open and close for a given period.
     """
 
+    __slots__ = ('symbol', 'time', 'high', 'low', 'open', 'close', 'volume', 'duration_sec')
+
     fields: List[str] = ['symbol', 'time', 'high', 'low', 'open', 'close', 'volume', 'duration_secs']
     csv_header: str = None
 
@@ -51,7 +67,16 @@ class OHLC:
 
 
     def __str__(self) -> str:
-        return jsonpickle.encode(self, unpicklable=False)
+        return json.dumps({
+            "symbol": self.symbol,
+            "time": self.time.isoformat() if isinstance(self.time, datetime) else self.time,
+            "high": self.high,
+            "low": self.low,
+            "open": self.open,
+            "close": self.close,
+            "volume": self.volume,
+            "duration_sec": self.duration_sec,
+        }, default=_json_default)
 
 
     def to_dict(self) -> Dict:
@@ -86,12 +111,11 @@ class OHLC:
 
 
     def to_pandas_series(self, dt_index=True):
-        d = self.to_dict()
+        l = self.to_list()
         if dt_index:
-            d.pop('time')
-            return pd.Series(name=self.time, data=d, )
+            return pd.Series(l[:1] + l[2:], index=OHLC.fields[:1] + OHLC.fields[2:], name=self.time, dtype=object)
         else:
-            return pd.Series(data=d, )
+            return pd.Series(l, index=OHLC.fields, dtype=object)
 
 
     @classmethod
@@ -142,11 +166,190 @@ class OHLC:
 
 
 
+class OHLCBatch:
+    """
+    A block of bars stored column-wise: epoch nanosecond times, the high/low/open/close/volume columns as the rows of
+    one float64 array and dictionary encoded symbols. About 60 bytes per bar, and to_dataframe hands the price
+    columns to pandas without copying them.
+    """
+
+    price_fields: List[str] = ['high', 'low', 'open', 'close', 'volume']
+
+
+    def __init__(self, symbols: List[str], symbol_ids: np.ndarray, time_ns: np.ndarray, prices: np.ndarray,
+                 duration_secs: np.ndarray) -> None:
+        """
+        :param symbols: symbol dictionary that symbol_ids index into; -1 is a bar without a symbol (an empty period)
+        :param prices: shape (5, n), rows in price_fields order
+        """
+        self.symbols: List[str] = list(symbols)
+        self.symbol_ids = np.asarray(symbol_ids, dtype=np.int16)
+        self.time_ns = np.asarray(time_ns, dtype=np.int64)
+        self.prices = np.asarray(prices, dtype=np.float64)
+        self.duration_secs = np.asarray(duration_secs, dtype=np.int64)
+
+
+    @property
+    def high(self) -> np.ndarray:
+        return self.prices[0]
+
+
+    @property
+    def low(self) -> np.ndarray:
+        return self.prices[1]
+
+
+    @property
+    def open(self) -> np.ndarray:
+        return self.prices[2]
+
+
+    @property
+    def close(self) -> np.ndarray:
+        return self.prices[3]
+
+
+    @property
+    def volume(self) -> np.ndarray:
+        return self.prices[4]
+
+
+    def __len__(self) -> int:
+        return len(self.time_ns)
+
+
+    def __getitem__(self, key) -> Union[OHLC, 'OHLCBatch']:
+        """
+        An int gives that bar as an OHLC, a slice an OHLCBatch of views and a boolean mask or index array an
+        OHLCBatch of those rows.
+        """
+        if isinstance(key, (slice, np.ndarray)):
+            return OHLCBatch(self.symbols, self.symbol_ids[key], self.time_ns[key], self.prices[:, key],
+                             self.duration_secs[key])
+        p = self.prices[:, key].tolist()
+        symbol = (self.symbols + [None])[self.symbol_ids[key]]
+        duration = int(self.duration_secs[key])
+        return OHLC(symbol, ns_to_datetime(self.time_ns[key]), p[0], p[1], p[2], p[3], p[4], duration)
+
+
+    def __iter__(self):
+        return iter(self.to_ohlcs())
+
+
+    def to_ohlcs(self) -> List[OHLC]:
+        # symbol id -1 picks the trailing None
+        symbols = self.symbols + [None]
+        return [
+            OHLC(symbols[k], ns_to_datetime(t), h, l, o, c, v, d) for k, t, h, l, o, c, v, d in zip(
+                self.symbol_ids.tolist(), self.time_ns.tolist(), *self.prices.tolist(), self.duration_secs.tolist())
+        ]
+
+
+    def to_dataframe(self) -> pd.DataFrame:
+        """
+        :return: candles in the layout used everywhere else (UTC 'time' index, symbol, prices, duration_secs); the
+            price columns are views of this batch
+        """
+        index = pd.DatetimeIndex(self.time_ns.view('datetime64[ns]'), name='time').tz_localize('UTC')
+        df = pd.DataFrame(self.prices.T, index=index, columns=self.price_fields, copy=False)
+        df.insert(0, 'symbol', pd.Categorical.from_codes(self.symbol_ids.astype(np.int32), categories=self.symbols))
+        df['duration_secs'] = self.duration_secs
+        return df
+
+
+    @classmethod
+    def from_ohlcs(cls, hlocs: List[OHLC]):
+        symbols: Dict[str, int] = {}
+        symbol_ids = np.array([symbols.setdefault(h.symbol, len(symbols)) for h in hlocs], dtype=np.int16)
+        prices = np.array([[h.high, h.low, h.open, h.close, h.volume] for h in hlocs], dtype=np.float64).reshape(-1, 5)
+        return OHLCBatch(
+            list(symbols),
+            symbol_ids,
+            np.array([datetime_to_ns(h.time) for h in hlocs], dtype=np.int64),
+            prices.T.copy(),
+            np.array([h.duration_sec for h in hlocs], dtype=np.int64),
+        )
+
+
+    @classmethod
+    def from_dataframe(cls, data: pd.DataFrame):
+        """
+        From a candle DataFrame (time index, symbol, prices, duration_secs); a naive index is taken as UTC.
+        """
+        codes, uniques = pd.factorize(data['symbol'])
+        return OHLCBatch(
+            [str(s) for s in uniques],
+            codes,
+            data.index.asi8,
+            np.ascontiguousarray(data[OHLCBatch.price_fields].to_numpy(dtype=np.float64).T),
+            data['duration_secs'].to_numpy(dtype=np.int64),
+        )
+
+
+
+class OHLCBuffer(RingBuffer):
+    """
+    The newest bars of a source, as the OHLC objects plus NumPy columns (time as epoch nanoseconds), so e.g.
+    view('close', 50) is the last 50 closes without a copy.
+    """
+
+    item_field = 'hloc'
+    hloc_fields: Dict[str, str] = {
+        'hloc': 'O',
+        'symbol': 'O',
+        'time': 'i8',
+        'high': 'f8',
+        'low': 'f8',
+        'open': 'f8',
+        'close': 'f8',
+        'volume': 'f8',
+        'duration_secs': 'i8',
+    }
+
+
+    def __init__(self, capacity: int) -> None:
+        super().__init__(capacity, OHLCBuffer.hloc_fields)
+
+
+    def append(self, hloc: OHLC) -> None:
+        super().append(hloc, hloc.symbol, datetime_to_ns(hloc.time), hloc.high, hloc.low, hloc.open, hloc.close,
+                       hloc.volume, hloc.duration_sec)
+
+
+    def extend_batch(self, batch: OHLCBatch) -> None:
+        """
+        Adds a batch column-wise; OHLC objects for these rows are only built if someone indexes or iterates them.
+        """
+        columns = {k: getattr(batch, k) for k in OHLCBatch.price_fields}
+        columns['symbol'] = np.array(batch.symbols + [None], dtype=object)[batch.symbol_ids]
+        columns['time'] = batch.time_ns
+        columns['duration_secs'] = batch.duration_secs
+        self.extend(columns)
+
+
+    def build_item(self, pos: int) -> OHLC:
+        c = self.columns
+        return OHLC(c['symbol'][pos], ns_to_datetime(c['time'][pos]), float(c['high'][pos]), float(c['low'][pos]),
+                    float(c['open'][pos]), float(c['close'][pos]), float(c['volume'][pos]),
+                    int(c['duration_secs'][pos]))
+
+
+    def to_dataframe(self, n: int = None) -> pd.DataFrame:
+        """
+        :return: the newest n bars laid out like the candle files (UTC 'time' index)
+        """
+        index = pd.DatetimeIndex(self.view('time', n).view('datetime64[ns]'), name='time').tz_localize('UTC')
+        df = pd.DataFrame({k: self.view(k, n) for k in ['symbol'] + OHLCBatch.price_fields}, index=index)
+        df['duration_secs'] = self.view('duration_secs', n)
+        return df
+
+
+
 class OHLCSource(metaclass=abc.ABCMeta):
 
     def __init__(self, symbol: str, max_queue_len: int = 1000) -> None:
         self.symbol = symbol
-        self.hlocs = collections.deque(maxlen=max_queue_len)
+        self.hlocs = OHLCBuffer(max_queue_len)
         self.listeners = []
         super().__init__()
 
@@ -161,39 +364,86 @@ class OHLCSource(metaclass=abc.ABCMeta):
         raise NotImplementedError
 
 
-    def subscribe(self, listener):
+    def subscribe(self, listener, policy: OverflowPolicy = None, max_queue: int = 1000):
+        """
+        :param policy: deliver hlocs to this listener from its own queue and thread (see QueuedListener) instead of
+            calling it on the source's thread
+        :return: the subscribed listener, i.e. the QueuedListener when a policy is given
+        """
         if hasattr(listener, "on_hloc") and callable(listener.on_hloc):
+            listener = wrap_listener(listener, policy, max_queue)
             self.listeners.append(listener)
+            return listener
         else:
             raise TypeError
 
 
+    def publish_batch(self, batch: OHLCBatch) -> None:
+        """
+        Hands a block of bars to every listener: listeners with an on_hloc_batch(batch) method get the whole batch,
+        the others get on_hloc bar by bar.
+        """
+        self.hlocs.extend_batch(batch)
+        hlocs = None
+        for listener in self.listeners:
+            on_hloc_batch = getattr(listener, "on_hloc_batch", None)
+            if on_hloc_batch is not None and callable(on_hloc_batch):
+                on_hloc_batch(batch)
+            else:
+                if hlocs is None:
+                    hlocs = batch.to_ohlcs()
+                for hloc in hlocs:
+                    listener.on_hloc(hloc)
+
+
 
 class FileOHLC(OHLCSource):
+    """
+    Replays a candle CSV (OHLC.get_csv_header layout) to the listeners from a background thread, with every bar
+    relabelled as `symbol`. The file is read `chunk_size` bars at a time and each chunk is published as one
+    OHLCBatch (see publish_batch); with a msg_delay_sec every bar is published on its own, that many seconds apart.
+    """
 
-    def __init__(self, fpath: str, symbol: str, msg_delay_sec: float = 0.0) -> None:
+    def __init__(self, fpath: str, symbol: str, msg_delay_sec: float = 0.0, chunk_size: int = 10000) -> None:
         super().__init__(symbol)
         self.fpath = fpath
         self.msg_delay_sec = msg_delay_sec
+        self.chunk_size = chunk_size
         self.end = True
         self.thread = None
         self.event_ct = 0
 
 
+    def read_batches(self):
+        """
+        :return: an OHLCBatch per chunk of the file
+        """
+        for chunk in pd.read_csv(self.fpath, sep=",", quotechar='"', chunksize=self.chunk_size,
+                                 float_precision='round_trip'):
+            yield OHLCBatch(
+                [self.symbol],
+                np.zeros(len(chunk), dtype=np.int16),
+                pd.to_datetime(chunk['time'], utc=True).values.view(np.int64),
+                np.ascontiguousarray(chunk[OHLCBatch.price_fields].to_numpy(dtype=np.float64).T),
+                chunk['duration_secs'].to_numpy(dtype=np.int64),
+            )
+
+
     def start(self):
         def _go():
-            with open(self.fpath, "r") as file:
-                csv_reader = csv.DictReader(file, dialect="excel")
-                for row in csv_reader:
-                    row['duration_sec'] = 300
-                    row['symbol'] = self.symbol
-                    hloc = OHLC.from_dict(row)
-                    for listener in self.listeners:
-                        listener.on_hloc(hloc)
-                    self.event_ct += 1
-                    time.sleep(self.msg_delay_sec)
-                    if self.end:
-                        break
+            for batch in self.read_batches():
+                if self.msg_delay_sec:
+                    for i in range(len(batch)):
+                        self.publish_batch(batch[i:i + 1])
+                        self.event_ct += 1
+                        time.sleep(self.msg_delay_sec)
+                        if self.end:
+                            return
+                else:
+                    self.publish_batch(batch)
+                    self.event_ct += len(batch)
+                if self.end:
+                    return
 
 
         self.end = False
@@ -206,8 +456,8 @@ class FileOHLC(OHLCSource):
         self.thread.join()
 
 
-    def subscribe(self, listener):
-        return super().subscribe(listener)
+    def subscribe(self, listener, policy: OverflowPolicy = None, max_queue: int = 1000):
+        return super().subscribe(listener, policy, max_queue)
 
 
 
@@ -226,11 +476,358 @@ class TickerOHLCSource(OHLCSource):
 
 
 
+class TickOHLCAggregator(TickerOHLCSource):
+    """
+    Builds OHLCV bars from ticks for any number of symbols and every period in `agg_periods` at once.
+
+    Bar state lives in flat typed arrays indexed by (symbol, period, slot). Bars close on tick time: a bar is emitted
+    once a tick at or past its end plus `grace_sec` has been seen for any symbol, so ticks arriving late or out of
+    order within the grace window still land in their bar, and anything older is dropped and counted in late_ct.
+    Periods without ticks produce no bar. advance_to() closes bars when the market is quiet, flush() closes everything
+    still open.
+    """
+
+    empty_bucket: int = -1
+
+
+    def __init__(self, symbols: List[str] = None, ticker_feed: Feed = None, agg_periods: List[AggPeriod] = None,
+                 grace_sec: float = 0.0, max_queue_len: int = 1000) -> None:
+        symbols = list(symbols) if symbols is not None else []
+        super().__init__(",".join(symbols), ticker_feed, max_queue_len)
+        self.agg_periods: List[AggPeriod] = list(agg_periods) if agg_periods is not None else [AggPeriod.ONE_MINUTE]
+        self.period_ns: List[int] = [p.value * 60 * 1000000000 for p in self.agg_periods]
+        self.grace_ns = int(grace_sec * 1000000000)
+        # enough slots per (symbol, period) to hold every bar that can still be open inside the grace window
+        self.depth = self.grace_ns // min(self.period_ns) + 2
+        self.symbols: List[str] = []
+        self.symbol_ids: Dict[str, int] = {}
+        self.bucket = array('q')
+        self.open_time = array('q')
+        self.close_time = array('q')
+        self.open = array('d')
+        self.high = array('d')
+        self.low = array('d')
+        self.close = array('d')
+        self.volume = array('d')
+        self.last_closed: List[int] = [None] * len(self.agg_periods)
+        self.watermark: int = None
+        self.filtered_listeners: List[Tuple] = []
+        self.lock = th.Lock()
+        self.tick_ct = 0
+        self.late_ct = 0
+        self.bar_ct = 0
+        for symbol in symbols:
+            self._add_symbol(symbol)
+
+
+    def start(self):
+        # driven by the ticker feed
+        pass
+
+
+    def stop(self):
+        pass
+
+
+    def subscribe(self, listener, agg_period: AggPeriod = None, symbol: str = None, policy: OverflowPolicy = None,
+                  max_queue: int = 1000):
+        """
+        :param agg_period: only deliver bars of this period
+        :param symbol: only deliver bars of this symbol
+        """
+        if agg_period is None and symbol is None:
+            return super().subscribe(listener, policy, max_queue)
+        if not (hasattr(listener, "on_hloc") and callable(listener.on_hloc)):
+            raise TypeError
+        if agg_period is not None and agg_period not in self.agg_periods:
+            raise ValueError("{0} is not aggregated; agg_periods={1}".format(agg_period, self.agg_periods))
+        listener = wrap_listener(listener, policy, max_queue)
+        self.filtered_listeners.append((listener, agg_period, symbol))
+        return listener
+
+
+    def on_tick(self, tick):
+        t = tick.time_ns
+        if t is None:
+            logger.warning("tick without a time ignored: {0}".format(tick))
+            return
+        with self.lock:
+            self.tick_ct += 1
+            k = self.symbol_ids.get(tick.symbol)
+            if k is None:
+                k = self._add_symbol(tick.symbol)
+            # close what the new tick time allows first, so its slot is free
+            ready = self._advance(t)
+            self._add_tick(k, t, tick.price, tick.size)
+        self._emit(ready)
+
+
+    def advance_to(self, t: datetime) -> None:
+        """
+        Moves tick time forward without a tick, closing every bar that ended at least grace_sec before t.
+        """
+        with self.lock:
+            ready = self._advance(datetime_to_ns(t))
+        self._emit(ready)
+
+
+    def flush(self) -> None:
+        """
+        Closes and emits every open bar, e.g. at the end of a replay.
+        """
+        with self.lock:
+            ready = []
+            for j in range(len(self.agg_periods)):
+                ready.extend(self._close_bars(j, None))
+        self._emit(ready)
+
+
+    def get_stats(self) -> Dict[str, int]:
+        return {"ticks": self.tick_ct, "late": self.late_ct, "bars": self.bar_ct, "symbols": len(self.symbols)}
+
+
+    def _add_symbol(self, symbol: str) -> int:
+        k = len(self.symbols)
+        self.symbols.append(symbol)
+        self.symbol_ids[symbol] = k
+        n = len(self.agg_periods) * self.depth
+        self.bucket.extend([self.empty_bucket] * n)
+        for a in [self.open_time, self.close_time]:
+            a.extend([0] * n)
+        for a in [self.open, self.high, self.low, self.close, self.volume]:
+            a.extend([0.0] * n)
+        return k
+
+
+    def _add_tick(self, k: int, t: int, price: float, size: float) -> None:
+        late = False
+        base = k * len(self.agg_periods)
+        for j, d in enumerate(self.period_ns):
+            b = t // d
+            last = self.last_closed[j]
+            if last is not None and b <= last:
+                late = True
+                continue
+            i = (base + j) * self.depth + b % self.depth
+            if self.bucket[i] != b:
+                self.bucket[i] = b
+                self.open_time[i] = t
+                self.close_time[i] = t
+                self.open[i] = price
+                self.high[i] = price
+                self.low[i] = price
+                self.close[i] = price
+                self.volume[i] = size
+                continue
+            if price > self.high[i]:
+                self.high[i] = price
+            if price < self.low[i]:
+                self.low[i] = price
+            if t < self.open_time[i]:
+                self.open_time[i] = t
+                self.open[i] = price
+            if t >= self.close_time[i]:
+                self.close_time[i] = t
+                self.close[i] = price
+            self.volume[i] += size
+        if late:
+            self.late_ct += 1
+            logger.debug("late tick at {0} dropped".format(t))
+
+
+    def _advance(self, t: int) -> List[OHLC]:
+        if self.watermark is not None and t <= self.watermark:
+            return []
+        self.watermark = t
+        ready = []
+        for j, d in enumerate(self.period_ns):
+            # last bucket whose end + grace has passed
+            closable = (t - self.grace_ns) // d - 1
+            if self.last_closed[j] is None or closable > self.last_closed[j]:
+                ready.extend(self._close_bars(j, closable))
+        return ready
+
+
+    def _close_bars(self, j: int, closable: Union[int, None]) -> List[OHLC]:
+        """
+        Takes every open bar of period j with bucket <= closable (all of them when closable is None).
+        """
+        P = len(self.agg_periods)
+        bars = []
+        for k in range(len(self.symbols)):
+            start = (k * P + j) * self.depth
+            for i in range(start, start + self.depth):
+                b = self.bucket[i]
+                if b != self.empty_bucket and (closable is None or b <= closable):
+                    bars.append((b, k, i))
+        bars.sort()
+        d = self.period_ns[j]
+        hlocs = []
+        for b, k, i in bars:
+            hlocs.append(OHLC(self.symbols[k], ns_to_datetime(b * d), self.high[i], self.low[i], self.open[i],
+                              self.close[i], self.volume[i], d // 1000000000))
+            self.bucket[i] = self.empty_bucket
+        if closable is None:
+            closable = bars[-1][0] if len(bars) > 0 else self.last_closed[j]
+        if closable is not None and (self.last_closed[j] is None or closable > self.last_closed[j]):
+            self.last_closed[j] = closable
+        return hlocs
+
+
+    def _emit(self, hlocs: List[OHLC]) -> None:
+        for hloc in hlocs:
+            self.bar_ct += 1
+            self.hlocs.append(hloc)
+            for listener in self.listeners:
+                listener.on_hloc(hloc)
+            for listener, agg_period, symbol in self.filtered_listeners:
+                if (agg_period is None or agg_period.value * 60 == hloc.duration_sec) and \
+                        (symbol is None or symbol == hloc.symbol):
+                    listener.on_hloc(hloc)
+
+
+
+class PeriodScheduler:
+    """
+    Fires every registered PeriodicOHLCSource from a single thread.
+
+    Each period length has one entry in a heap ordered by fire time, so all sources sharing a period fire together
+    `delay_sec` after each boundary; sources of the same class are handed over together through their
+    on_period_end_batch. Fire times are always taken from the absolute epoch grid rather than by adding a
+    delay to the previous firing, so they do not drift; boundaries missed entirely (e.g. after a long stall) are
+    skipped and counted. Every firing records how late it started and how long its sources took.
+    """
+
+    def __init__(self, delay_sec: float = 1.0, max_history: int = 1000, clock=time.time) -> None:
+        self.delay_sec = delay_sec
+        self.clock = clock
+        # period secs -> sources
+        self.sources: Dict[int, List] = {}
+        # (fire at epoch secs, period secs)
+        self.heap: List[Tuple[float, int]] = []
+        self.cond = th.Condition()
+        self.thread: Thread = None
+        self.running = False
+        self.firings = collections.deque(maxlen=max_history)
+        self.missed_ct = 0
+
+
+    def register(self, source) -> None:
+        period = source.agg_period.value * 60
+        with self.cond:
+            if period not in self.sources:
+                self.sources[period] = []
+                heapq.heappush(self.heap, (self.get_next_fire(period, self.clock()), period))
+            if source not in self.sources[period]:
+                self.sources[period].append(source)
+            self.cond.notify()
+
+
+    def unregister(self, source) -> None:
+        period = source.agg_period.value * 60
+        with self.cond:
+            sources = self.sources.get(period, [])
+            if source in sources:
+                sources.remove(source)
+            if len(sources) == 0 and period in self.sources:
+                # the heap entry is dropped when it comes up
+                del self.sources[period]
+
+
+    def get_next_fire(self, period: int, now: float) -> float:
+        """
+        :return: the first fire time (boundary + delay_sec) after now
+        """
+        return (math.floor((now - self.delay_sec) / period) + 1) * period + self.delay_sec
+
+
+    def start(self) -> None:
+        if self.thread is not None:
+            return
+        self.running = True
+        self.thread = Thread(target=self._run, name="PeriodScheduler", daemon=True)
+        self.thread.start()
+
+
+    def stop(self) -> None:
+        with self.cond:
+            self.running = False
+            self.cond.notify()
+        if self.thread is not None:
+            self.thread.join()
+            self.thread = None
+
+
+    def fire_due(self) -> int:
+        """
+        Fires every source whose period boundary has passed.
+        :return: number of sources fired
+        """
+        due = []
+        with self.cond:
+            now = self.clock()
+            while len(self.heap) > 0 and self.heap[0][0] <= now:
+                fire_at, period = heapq.heappop(self.heap)
+                if period not in self.sources:
+                    continue
+                next_fire = self.get_next_fire(period, now)
+                self.missed_ct += int(round((next_fire - fire_at) / period)) - 1
+                heapq.heappush(self.heap, (next_fire, period))
+                # after a stall only the most recent boundary is fired
+                due.append((next_fire - period, period, list(self.sources[period])))
+
+        fired = 0
+        for fire_at, period, sources in due:
+            started = self.clock()
+            boundary = datetime.utcfromtimestamp(fire_at - self.delay_sec)
+            by_class: Dict[type, List] = {}
+            for source in sources:
+                by_class.setdefault(type(source), []).append(source)
+            for source_cls, group in by_class.items():
+                try:
+                    source_cls.on_period_end_batch(group, boundary)
+                except Exception:
+                    logger.exception("{0} sources failed at {1}".format(source_cls.__name__, boundary))
+            fired += len(sources)
+            self.firings.append({
+                "period_secs": period,
+                "boundary": boundary,
+                "sources": len(sources),
+                "lateness_sec": started - fire_at,
+                "duration_sec": self.clock() - started,
+            })
+        return fired
+
+
+    def get_stats(self) -> Dict[str, float]:
+        lateness = [f['lateness_sec'] for f in self.firings]
+        return {
+            "firings": len(lateness),
+            "missed": self.missed_ct,
+            "mean_lateness_sec": sum(lateness) / len(lateness) if len(lateness) > 0 else 0.0,
+            "max_lateness_sec": max(lateness) if len(lateness) > 0 else 0.0,
+            "max_duration_sec": max([f['duration_sec'] for f in self.firings]) if len(self.firings) > 0 else 0.0,
+        }
+
+
+    def _run(self) -> None:
+        while True:
+            with self.cond:
+                while self.running and (len(self.heap) == 0 or self.heap[0][0] > self.clock()):
+                    self.cond.wait(self.heap[0][0] - self.clock() if len(self.heap) > 0 else None)
+                if not self.running:
+                    return
+            self.fire_due()
+
+
+
 class PeriodicOHLCSource(OHLCSource):
 
-    def __init__(self, symbol: str, agg_period: AggPeriod, num_periods: int = 100) -> None:
+    def __init__(self, symbol: str, agg_period: AggPeriod, num_periods: int = 100,
+                 scheduler: PeriodScheduler = None) -> None:
         super().__init__(symbol, num_periods)
         self.agg_period: AggPeriod = agg_period
+        self.scheduler: PeriodScheduler = scheduler
         self.timer: th.Timer = None
         self.period_start: datetime = None
         self.period_end: datetime = None
@@ -238,39 +835,71 @@ class PeriodicOHLCSource(OHLCSource):
 
     def start(self):
         """
-        Sets a timer to call on_period_end within 1s of the time in period_end (calculated using the agg_period)
+        Sets a timer to call on_period_end within 1s of the time in period_end (calculated using the agg_period), or
+        registers with the scheduler if one was given.
         :return: None
         """
-        logger.debug("starting timer")
         t = datetime.utcnow()
-        period_mins = self.agg_period.value
-        self.period_start = t - timedelta(minutes=t.minute % period_mins, seconds=t.second, microseconds=t.microsecond)
-        self.period_end = t + timedelta(minutes=period_mins) - timedelta(minutes=t.minute % period_mins,
-                                                                         seconds=t.second, microseconds=t.microsecond)
+        period = timedelta(minutes=self.agg_period.value)
+        self.period_start = datetime.min + ((t - datetime.min) // period) * period
+        self.period_end = self.period_start + period
         logger.debug("period start: {0} | end={1}".format(self.period_start, self.period_end))
-        self.timer = th.Timer((self.period_end - datetime.utcnow()).seconds + 1, self.on_period_end)
-        self.timer.start()
+        if self.scheduler is not None:
+            self.scheduler.register(self)
+        else:
+            logger.debug("starting timer")
+            self._set_timer()
 
 
     def stop(self):
-        logger.debug("stopping timer")
+        if self.scheduler is not None:
+            self.scheduler.unregister(self)
         if self.timer is not None:
+            logger.debug("stopping timer")
             self.timer.cancel()
             self.timer = None
-            self.period_start = None
-            self.period_end = None
+        self.period_start = None
+        self.period_end = None
 
 
-    def on_period_end(self):
-        logger.debug("starting...")
+    def on_period_end(self, period_end: datetime = None):
+        """
+        Emits the hloc for the period that just ended.
+        :param period_end: the boundary that was reached, when called by a scheduler
+        """
+        if period_end is not None:
+            self.period_end = period_end
+            self.period_start = period_end - timedelta(minutes=self.agg_period.value)
         hloc = self.generate_hloc()
         logger.debug("hloc={0}".format(hloc))
-        for l in self.listeners:
-            l.on_hloc(hloc)
+        if hloc is not None:
+            for l in self.listeners:
+                l.on_hloc(hloc)
         self.period_start = self.period_end
         self.period_end = self.period_start + timedelta(minutes=self.agg_period.value)
-        self.timer = th.Timer((self.period_end - datetime.utcnow()).seconds + 1, self.on_period_end)
-        logger.debug("setting new timer period_end={0}".format(self.period_end))
+        if self.scheduler is None and self.timer is not None:
+            logger.debug("setting new timer period_end={0}".format(self.period_end))
+            self._set_timer()
+
+
+    @classmethod
+    def on_period_end_batch(cls, sources: List, period_end: datetime) -> None:
+        """
+        Called by a PeriodScheduler with every source of this class due at the same boundary; subclasses can override
+        it to do their work for all of them at once.
+        """
+        for source in sources:
+            try:
+                source.on_period_end(period_end)
+            except Exception:
+                logger.exception("{0} failed at {1}".format(source.symbol, period_end))
+
+
+    def _set_timer(self):
+        # total_seconds rather than .seconds, which drops the fraction and wraps to a day when the boundary has passed
+        delay = max(0.0, (self.period_end - datetime.utcnow()).total_seconds()) + 1
+        self.timer = th.Timer(delay, self.on_period_end)
+        self.timer.daemon = True
         self.timer.start()
 
 
@@ -281,24 +910,60 @@ class PeriodicOHLCSource(OHLCSource):
 
 
 class CBProPeriodicHLOCSource(PeriodicOHLCSource):
+    """
+    Polls Coinbase for each closed period's candle. Sources given a shared CandleFetcher and fired together by a
+    PeriodScheduler fetch all their candles in one concurrent batch; otherwise each source makes its own request.
+    """
 
-    def __init__(self, symbol: str, agg_period: AggPeriod, num_periods: int = 100) -> None:
-        super().__init__(symbol, agg_period, num_periods)
-        self.cbpro_client = cbpro.PublicClient()
+    def __init__(self, symbol: str, agg_period: AggPeriod, num_periods: int = 100,
+                 scheduler: PeriodScheduler = None, fetcher: CandleFetcher = None) -> None:
+        super().__init__(symbol, agg_period, num_periods, scheduler)
+        self.fetcher: CandleFetcher = fetcher
+        self.cbpro_client = cbpro.PublicClient() if fetcher is None else fetcher
+        # rows fetched by on_period_end_batch for the period about to be generated
+        self.prefetched: List[List] = None
+
+
+    @classmethod
+    def on_period_end_batch(cls, sources: List, period_end: datetime) -> None:
+        by_fetcher: Dict[int, List] = {}
+        for source in sources:
+            by_fetcher.setdefault(id(source.fetcher), []).append(source)
+        for group in by_fetcher.values():
+            fetcher = group[0].fetcher
+            if fetcher is None:
+                super().on_period_end_batch(group, period_end)
+                continue
+            period = timedelta(minutes=group[0].agg_period.value)
+            start = (period_end - period).replace(tzinfo=timezone.utc)
+            results = fetcher.fetch_all([(s.symbol, start, start, s.agg_period.value * 60) for s in group])
+            for source, res in zip(group, results):
+                if isinstance(res, Exception):
+                    logger.error("{0}: no candle for {1}: {2}".format(source.symbol, start, res))
+                    res = []
+                source.prefetched = res
+            super().on_period_end_batch(group, period_end)
 
 
     def generate_hloc(self):
-        res = self.cbpro_client.get_product_historic_rates(
-            self.symbol,
-            self.period_start,
-            self.period_start,  # for a single period, start = end
-            self.agg_period.value * 60,  # s
-        )
+        period_start = self.period_start.replace(tzinfo=timezone.utc)
+        if self.prefetched is not None:
+            res, self.prefetched = self.prefetched, None
+        else:
+            res = self.cbpro_client.get_product_historic_rates(
+                self.symbol,
+                period_start.isoformat(),
+                period_start.isoformat(),  # for a single period, start = end
+                self.agg_period.value * 60,  # s
+            )
+        if not isinstance(res, list) or len(res) == 0:
+            logger.warning("{0}: no candle returned for {1}: {2}".format(self.symbol, period_start, res))
+            return None
         frame_start = datetime.fromtimestamp(res[0][0], tz=timezone.utc)
 
-        if (frame_start - self.period_start).seconds != 0:
+        if frame_start != period_start:
             logger.warning("Coinbase return data start time {0} different from requested {1}".format(frame_start,
-                                                                                                      self.period_start))
+                                                                                                      period_start))
         row = res[0]
         rowx = [self.symbol, row[0], row[2], row[1], row[3], row[4], row[5], self.agg_period.value * 60]
         return OHLC.from_csv(rowx)
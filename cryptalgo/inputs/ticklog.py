@@ -0,0 +1,248 @@
+import os
+import struct
+from pathlib import Path
+from typing import Iterator, List, Union, Dict
+
+import numpy as np
+import pandas as pd
+
+from cryptalgo.inputs.feed import SIDES, SIDE_NAMES, Tick, TickBatch
+
+import logging
+
+logging.getLogger(__name__).addHandler(logging.NullHandler())
+logger = logging.getLogger(__name__)
+
+# fixed width, unpadded tick record
+TICK_DTYPE = np.dtype([
+    ('time', '<i8'),  # epoch nanoseconds
+    ('price', '<f8'),
+    ('size', '<f8'),
+    ('best_bid', '<f8'),
+    ('best_ask', '<f8'),
+    ('side', 'i1'),  # 1 = buy, -1 = sell, 0 = unknown
+    ('symbol', '<u2'),  # index into the header's symbol dictionary
+])
+
+
+
+class TickLogHeader:
+    """
+    The fixed size block at the start of a tick log: magic, version, record size and the symbol dictionary
+    (16 byte, NUL padded names). Being fixed size, it can be rewritten in place when a new symbol shows up.
+    """
+
+    magic: bytes = b'CATICKS\0'
+    version: int = 1
+    size: int = 4096
+    symbol_width: int = 16
+    layout = struct.Struct('<8sIII')
+    max_symbols: int = (size - layout.size) // symbol_width
+
+
+    def __init__(self, symbols: List[str] = None) -> None:
+        self.symbols: List[str] = list(symbols) if symbols is not None else []
+
+
+    def to_bytes(self) -> bytes:
+        data = self.layout.pack(self.magic, self.version, TICK_DTYPE.itemsize, len(self.symbols))
+        data += b''.join([s.encode('utf-8')[:self.symbol_width].ljust(self.symbol_width, b'\0') for s in self.symbols])
+        return data.ljust(self.size, b'\0')
+
+
+    @classmethod
+    def from_bytes(cls, data: bytes):
+        magic, version, record_size, num_symbols = cls.layout.unpack_from(data)
+        if magic != cls.magic:
+            raise ValueError("not a tick log")
+        if version != cls.version or record_size != TICK_DTYPE.itemsize:
+            raise ValueError("unsupported tick log version {0} / record size {1}".format(version, record_size))
+        symbols = []
+        for i in range(num_symbols):
+            start = cls.layout.size + i * cls.symbol_width
+            symbols.append(data[start:start + cls.symbol_width].rstrip(b'\0').decode('utf-8'))
+        return TickLogHeader(symbols)
+
+
+
+class TickLogWriter:
+    """
+    Appends ticks to a binary tick log, buffering `buffer_size` records between writes. Opening an existing log
+    continues it.
+    """
+
+    def __init__(self, path: Union[str, Path], buffer_size: int = 4096) -> None:
+        self.path = Path(path)
+        if self.path.is_file() and self.path.stat().st_size >= TickLogHeader.size:
+            with open(self.path, "rb") as f:
+                self.header = TickLogHeader.from_bytes(f.read(TickLogHeader.size))
+            self.handle = open(self.path, "r+b")
+            # drop a torn trailing record
+            records = (self.path.stat().st_size - TickLogHeader.size) // TICK_DTYPE.itemsize
+            self.handle.truncate(TickLogHeader.size + records * TICK_DTYPE.itemsize)
+            self.handle.seek(0, os.SEEK_END)
+        else:
+            self.header = TickLogHeader()
+            self.handle = open(self.path, "w+b")
+            self.handle.write(self.header.to_bytes())
+        self.symbol_ids: Dict[str, int] = {s: i for i, s in enumerate(self.header.symbols)}
+        self.buffer = np.zeros(buffer_size, dtype=TICK_DTYPE)
+        self.buffered = 0
+        self.bytes_written = 0
+
+
+    def get_symbol_id(self, symbol: str) -> int:
+        symbol_id = self.symbol_ids.get(symbol)
+        if symbol_id is None:
+            if len(self.header.symbols) >= TickLogHeader.max_symbols:
+                raise ValueError("tick log symbol dictionary is full")
+            symbol_id = len(self.header.symbols)
+            self.header.symbols.append(symbol)
+            self.symbol_ids[symbol] = symbol_id
+            pos = self.handle.tell()
+            self.handle.seek(0)
+            self.handle.write(self.header.to_bytes())
+            self.handle.seek(pos)
+        return symbol_id
+
+
+    def write(self, tick: Tick) -> None:
+        """
+        :raises ValueError: the tick has no time; records always carry one
+        """
+        time_ns = tick.time_ns
+        if time_ns is None:
+            raise ValueError("cannot log a {0} tick without a time".format(tick.symbol))
+        if self.buffered == len(self.buffer):
+            self.flush()
+        self.buffer[self.buffered] = (
+            time_ns,
+            tick.price,
+            tick.size,
+            tick.best_bid,
+            tick.best_ask,
+            SIDES.get(tick.side, 0),
+            self.get_symbol_id(tick.symbol),
+        )
+        self.buffered += 1
+
+
+    def write_many(self, ticks: List[Tick]) -> None:
+        for tick in ticks:
+            self.write(tick)
+
+
+    def write_records(self, records: np.ndarray) -> None:
+        """
+        Appends a TICK_DTYPE array whose symbol ids already refer to this log's dictionary.
+        """
+        self.flush()
+        data = np.ascontiguousarray(records, dtype=TICK_DTYPE).tobytes()
+        self.handle.write(data)
+        self.bytes_written += len(data)
+
+
+    def flush(self) -> None:
+        if self.buffered > 0:
+            data = self.buffer[:self.buffered].tobytes()
+            self.handle.write(data)
+            self.bytes_written += len(data)
+            self.buffered = 0
+        self.handle.flush()
+
+
+    def close(self) -> None:
+        self.flush()
+        self.handle.close()
+
+
+
+class TickLogReader:
+    """
+    Read-only view of a tick log. `records` is a NumPy record array memory-mapped straight from the file.
+    """
+
+    def __init__(self, path: Union[str, Path]) -> None:
+        self.path = Path(path)
+        with open(self.path, "rb") as f:
+            self.header = TickLogHeader.from_bytes(f.read(TickLogHeader.size))
+        self.symbols: List[str] = self.header.symbols
+        num_records = (self.path.stat().st_size - TickLogHeader.size) // TICK_DTYPE.itemsize
+        if num_records > 0:
+            self.records = np.memmap(self.path, dtype=TICK_DTYPE, mode='r', offset=TickLogHeader.size,
+                                     shape=(num_records,))
+        else:
+            self.records = np.zeros(0, dtype=TICK_DTYPE)
+
+
+    def __len__(self) -> int:
+        return len(self.records)
+
+
+    def chunks(self, chunk_size: int = 65536) -> Iterator[np.ndarray]:
+        for start in range(0, len(self.records), chunk_size):
+            yield self.records[start:start + chunk_size]
+
+
+    def to_ticks(self, records: np.ndarray) -> List[Tick]:
+        symbols = self.symbols
+        return [
+            Tick(None, symbols[r[6]], r[1], r[2], SIDE_NAMES.get(int(r[5]), 'UNK'), r[3], r[4], time_ns=r[0])
+            for r in records.tolist()
+        ]
+
+
+    def to_batch(self, records: np.ndarray) -> TickBatch:
+        return TickBatch(
+            self.symbols,
+            records['symbol'],
+            records['time'],
+            np.stack([records[k] for k in TickBatch.value_fields]),
+            records['side'],
+        )
+
+
+    def iter_ticks(self, chunk_size: int = 65536) -> Iterator[Tick]:
+        for chunk in self.chunks(chunk_size):
+            for tick in self.to_ticks(chunk):
+                yield tick
+
+
+    def to_dataframe(self) -> pd.DataFrame:
+        r = self.records
+        df = pd.DataFrame({
+            'symbol': pd.Categorical.from_codes(np.asarray(r['symbol']).astype(np.int32), categories=self.symbols),
+            'price': r['price'],
+            'size': r['size'],
+            'side': np.asarray(r['side']),
+            'best_bid': r['best_bid'],
+            'best_ask': r['best_ask'],
+        }, index=pd.DatetimeIndex(np.asarray(r['time']).view('datetime64[ns]'), name='time').tz_localize('UTC'))
+        return df
+
+
+
+def convert_csv_capture(csv_path: Union[str, Path], out_path: Union[str, Path], chunk_size: int = 100000) -> int:
+    """
+    Converts a CSV tick capture (Tick.to_csv_header / to_csv_row) into a binary tick log, appending if it exists.
+    :return: number of ticks converted
+    """
+    writer = TickLogWriter(out_path)
+    num_ticks = 0
+    try:
+        for chunk in pd.read_csv(csv_path, sep=",", quotechar='"', chunksize=chunk_size,
+                                 float_precision='round_trip'):
+            records = np.zeros(len(chunk), dtype=TICK_DTYPE)
+            records['time'] = pd.to_datetime(chunk['time'], utc=True).values.view(np.int64)
+            for k in ['price', 'size', 'best_bid', 'best_ask']:
+                records[k] = chunk[k].to_numpy(dtype=np.float64)
+            records['side'] = chunk['side'].map(SIDES).fillna(0).to_numpy(dtype=np.int8)
+            codes, uniques = pd.factorize(chunk['symbol'])
+            ids = np.array([writer.get_symbol_id(str(s)) for s in uniques], dtype=np.uint16)
+            records['symbol'] = ids[codes]
+            writer.write_records(records)
+            num_ticks += len(records)
+    finally:
+        writer.close()
+    logger.info("converted {0} ticks from {1} to {2}".format(num_ticks, csv_path, out_path))
+    return num_ticks
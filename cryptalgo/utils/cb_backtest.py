@@ -4,7 +4,11 @@ from datetime import timedelta
 from pathlib import Path
 import pandas as pd
 from cryptalgo.backtest.backtest import BacktestHarness
+from cryptalgo.backtest.cache import BacktestCache
+from cryptalgo.backtest.grid import SMACParameterGrid
+from cryptalgo.backtest.sweep import ParameterSweep
 from cryptalgo.brain.models import SMACModel, MACDModel
+from cryptalgo.coredata.candles import CandleStore, DEFAULT_STORE_ROOT
 import logging
 import matplotlib.pyplot as plt
 from cryptalgo.inputs.feed_agg import AggPeriod
@@ -52,15 +56,32 @@ histories = {
 }
 
 
+# created by get_candle_store on first use, so importing this module touches no files
+candle_store: CandleStore = None
+
+
+
+def get_candle_store() -> CandleStore:
+    global candle_store
+    if candle_store is None:
+        candle_store = CandleStore(DEFAULT_STORE_ROOT)
+    return candle_store
+
+
+
 def load_dataframe(path: Path):
-    df = pd.read_csv(path, sep=",", quotechar='"', parse_dates=['time'])
-    df.set_index('time', inplace=True)
-    df.sort_index(ascending=True, inplace=True)
-    return df
+    return get_candle_store().load_csv(path)
 
 
 
-def smac_parameter_hunt(key: str, agg_period: AggPeriod):
+def smac_parameter_hunt(key: str, agg_period: AggPeriod, vectorized: bool = False, max_workers: int = None,
+                        cache: BacktestCache = None):
+    """
+    :param cache: serves pairs already backtested (e.g. by an earlier hunt) from it and stores the new ones
+    :param vectorized: evaluate the grid with SMACParameterGrid instead of backtesting every pair; much faster, but
+        the rows hold float64 values that agree with the Account's 5 digit Decimal ones only to about 1e-3. The
+        'approx' column of the CSV says which way a file was produced.
+    """
     k = key
     df = load_dataframe(Path(histories[k]))
 
@@ -68,24 +89,30 @@ def smac_parameter_hunt(key: str, agg_period: AggPeriod):
         writer = csv.writer(f, "excel")
         hdr = ['st', 'lt']
         hdr.extend([str(x) for x in BacktestHarness.generate_report_header()])
+        hdr.append('approx')
         writer.writerow(hdr)
 
-        for st in range(10, 250, 10):
-            for lt in range((st + 10), 250, 10):
-                logger.info("modeling {2}: {0}, {1}".format(st, lt, k))
-                model = SMACModel("{0}-USD".format(k), short_lb=st, long_lb=lt)
-                bt = BacktestHarness(model, seed_investment=1000.00, agg_period=agg_period)
-                bt.backtest_single_pass(df)
-                with decimal.localcontext() as ctx:
-                    ctx.prec = 5
-                    rpt = [st, lt]
-                    rpt.extend([str(x) for x in bt.generate_report()])
-                    writer.writerow(rpt)
-                    f.flush()
-
-
-
-def macd_parameter_hunt(key: str, agg_period: AggPeriod):
+        params = [(st, lt) for st in range(10, 250, 10) for lt in range((st + 10), 250, 10)]
+        logger.info("modeling {0}: {1} parameter sets".format(k, len(params)))
+        if vectorized:
+            grid = SMACParameterGrid(df, params, seed_investment=1000.00, agg_period=agg_period)
+            reports = grid.generate_reports()
+        else:
+            sweep = ParameterSweep(df, max_workers=max_workers, seed_investment=1000.00, cache=cache)
+            reports = sweep.run([(SMACModel, {'short_lb': st, 'long_lb': lt}, agg_period) for st, lt in params])
+        for (st, lt), report in zip(params, reports):
+            rpt = [st, lt]
+            rpt.extend([str(x) for x in report])
+            rpt.append(str(vectorized))
+            writer.writerow(rpt)
+        f.flush()
+
+
+
+def macd_parameter_hunt(key: str, agg_period: AggPeriod, max_workers: int = None, cache: BacktestCache = None):
+    """
+    :param cache: serves pairs already backtested (e.g. by an earlier hunt) from it and stores the new ones
+    """
     k = key
     df = load_dataframe(Path(histories[k]))
 
@@ -95,18 +122,15 @@ def macd_parameter_hunt(key: str, agg_period: AggPeriod):
         hdr.extend([str(x) for x in BacktestHarness.generate_report_header()])
         writer.writerow(hdr)
 
-        for st in range(10, 16, 1):
-            for lt in range(20, 30, 1):
-                logger.info("modeling {2}: {0}, {1}".format(st, lt, k))
-                model = MACDModel("{0}-USD".format(k), low_ewm=st, high_ewm=lt)
-                bt = BacktestHarness(model, seed_investment=1000.00, agg_period=agg_period)
-                bt.backtest_single_pass(df)
-                with decimal.localcontext() as ctx:
-                    ctx.prec = 5
-                    rpt = [st, lt]
-                    rpt.extend([str(x) for x in bt.generate_report()])
-                    writer.writerow(rpt)
-                    f.flush()
+        params = [(st, lt) for st in range(10, 16, 1) for lt in range(20, 30, 1)]
+        logger.info("modeling {0}: {1} parameter sets".format(k, len(params)))
+        sweep = ParameterSweep(df, max_workers=max_workers, seed_investment=1000.00, cache=cache)
+        reports = sweep.run([(MACDModel, {'low_ewm': st, 'high_ewm': lt}, agg_period) for st, lt in params])
+        for (st, lt), report in zip(params, reports):
+            rpt = [st, lt]
+            rpt.extend([str(x) for x in report])
+            writer.writerow(rpt)
+        f.flush()
 
 
 
@@ -123,24 +147,28 @@ def macd_time_progression_results(key: str, lewm: int = 12, hewm: int = 26, agg_
         start_date = df.index[0] + timedelta(days=2)
         if agg_period == AggPeriod.ONE_DAY:
             start_date = df.index[0] + timedelta(days=26)
-        for date in pd.date_range(start_date, df.index[-1], freq='D'):
-            logger.info("modeling {2}: {0}, {1} through {3}".format(lewm, hewm, k, date))
-            model = MACDModel("{0}-USD".format(k), low_ewm=lewm, high_ewm=hewm)
-            bt = BacktestHarness(model, seed_investment=1000.00, agg_period=agg_period)
-            bt.backtest_single_pass(df[df.index <= date])
-            with decimal.localcontext() as ctx:
-                ctx.prec = 5
+        dates = pd.date_range(start_date, df.index[-1], freq='D')
+        logger.info("modeling {2}: {0}, {1} walking forward over {3} days".format(lewm, hewm, k, len(dates)))
+        model = MACDModel("{0}-USD".format(k), low_ewm=lewm, high_ewm=hewm)
+        bt = BacktestHarness(model, seed_investment=1000.00, agg_period=agg_period)
+        reports = bt.backtest_walk_forward(df, dates)
+        with decimal.localcontext() as ctx:
+            ctx.prec = 5
+            for date, report in zip(dates, reports):
                 rpt = [date, lewm, hewm]
-                rpt.extend([str(x) for x in bt.generate_report()])
+                rpt.extend([str(x) for x in report])
                 writer.writerow(rpt)
-                f.flush()
+        f.flush()
 
     dfv = pd.read_csv("./data/out/algo_macd/macd_backtests_{0}_time.csv".format(k), parse_dates=['date'])
     ax = plt.gca()
     dfv[['price_chg','growth']].plot.line(ax=ax)
     plt.show()
 
-    # TODO add graph showing account balance over time
+    # account balance over time, marked to market at every bar
+    ax = plt.gca()
+    bt.generate_equity_curve()['equity'].plot.line(ax=ax)
+    plt.show()
 
 
 if __name__ == '__main__':
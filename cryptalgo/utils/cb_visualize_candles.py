@@ -9,6 +9,7 @@ import matplotlib.dates as mpdates
 
 from cryptalgo.backtest.backtest import BacktestHarness
 from cryptalgo.brain.models import MACDModel
+from cryptalgo.coredata.candles import CandleStore, DEFAULT_STORE_ROOT
 import logging
 
 from cryptalgo.inputs.feed_agg import AggPeriod
@@ -21,9 +22,7 @@ logging.basicConfig(
 plt.style.use('dark_background')
 
 symbol = 'BTC'
-df = pd.read_csv(Path('./data/candles/{0}-USD-2021-01-01 00:00:00-2021-06-01 00:00:00-300-candles.csv'.format(symbol)), sep=",", quotechar='"', parse_dates=['time'])
-df.set_index('time', inplace=True)
-df.sort_index(ascending=True, inplace=True)
+df = CandleStore(DEFAULT_STORE_ROOT).load_csv(Path('./data/candles/{0}-USD-2021-01-01 00:00:00-2021-06-01 00:00:00-300-candles.csv'.format(symbol)))
 model = MACDModel("{0}-USD".format(symbol), low_ewm=12, high_ewm=26)
 bt = BacktestHarness(model, seed_investment=1000.00, agg_period=AggPeriod.ONE_DAY)
 bt.backtest_single_pass(df[0:(120*24*12)])
@@ -0,0 +1,59 @@
+import threading
+import time
+
+import logging
+
+logging.getLogger(__name__).addHandler(logging.NullHandler())
+logger = logging.getLogger(__name__)
+
+
+
+class TokenBucket:
+    """
+    Thread safe token bucket. Tokens refill continuously at `rate` per second up to `capacity`; every request takes
+    one (or more) tokens and waits until enough are available.
+    """
+
+    def __init__(self, rate: float, capacity: float = None) -> None:
+        if rate is None or rate <= 0:
+            raise ValueError("rate must be positive; rate={0}".format(rate))
+        self.rate = float(rate)
+        self.capacity = float(capacity) if capacity is not None else max(1.0, self.rate)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+
+    def _refill(self, now: float) -> None:
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+
+    def try_acquire(self, tokens: float = 1.0) -> bool:
+        with self.lock:
+            self._refill(time.monotonic())
+            if self.tokens >= tokens:
+                self.tokens -= tokens
+                return True
+            return False
+
+
+    def acquire(self, tokens: float = 1.0, timeout: float = None) -> bool:
+        """
+        Blocks until `tokens` are available.
+        :return: True once acquired, False if the timeout passed first
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self._refill(now)
+                if self.tokens >= tokens:
+                    self.tokens -= tokens
+                    return True
+                wait = (tokens - self.tokens) / self.rate
+            if deadline is not None:
+                if now >= deadline:
+                    return False
+                wait = min(wait, deadline - now)
+            time.sleep(wait)
@@ -0,0 +1,161 @@
+import decimal
+import shutil
+import tempfile
+from datetime import timedelta
+from pathlib import Path
+from unittest import TestCase
+
+import numpy as np
+import pandas as pd
+
+from cryptalgo.backtest.backtest import BacktestHarness
+from cryptalgo.backtest.metrics import RISK_METRICS, bars_per_year, equity_curve, risk_metrics
+from cryptalgo.brain.models import MACDModel, SMACModel
+from cryptalgo.coredata.candles import CandleStore
+from cryptalgo.inputs.dispatch import OverflowPolicy
+from cryptalgo.inputs.feed_agg import AggPeriod
+from test.test_utils import generate_hloc_dataframe
+
+
+
+class TestBacktestHarness(TestCase):
+    df = None
+
+
+    @classmethod
+    def setUpClass(cls) -> None:
+        super().setUpClass()
+        TestBacktestHarness.df = generate_hloc_dataframe()
+
+
+    def test_backtest_walk_forward(self):
+        df = TestBacktestHarness.df
+        # deliberately off the hour so the last 15 minute / 1 hour bar is still forming at each date
+        dates = pd.date_range(df.index[0] + timedelta(hours=6, minutes=5), df.index[-1], freq='155T')
+        for agg_period in [AggPeriod.FIVE_MINUTES, AggPeriod.FIFTEEN_MINUTES, AggPeriod.ONE_HOUR]:
+            for model_fn in [lambda: MACDModel("LTC-USD", low_ewm=3, high_ewm=7),
+                             lambda: SMACModel("LTC-USD", short_lb=5, long_lb=12)]:
+                bt = BacktestHarness(model_fn(), seed_investment=1000.0, agg_period=agg_period)
+                reports = bt.backtest_walk_forward(df, dates)
+                self.assertEqual(len(dates), len(reports))
+                for date, report in zip(dates, reports):
+                    expected_bt = BacktestHarness(model_fn(), seed_investment=1000.0, agg_period=agg_period)
+                    expected_bt.backtest_single_pass(df[df.index <= date])
+                    with decimal.localcontext() as ctx:
+                        ctx.prec = 5
+                        self.assertListEqual([str(x) for x in expected_bt.generate_report()], [str(x) for x in report])
+
+
+    def test_equity_curve(self):
+        df = TestBacktestHarness.df
+        bt = BacktestHarness(SMACModel("LTC-USD", short_lb=5, long_lb=12), seed_investment=1000.0)
+        bt.backtest_single_pass(df)
+        curve = bt.generate_equity_curve()
+        self.assertEqual(len(df), len(curve))
+        self.assertTrue(bt.account.num_trades() > 2)
+
+        # replay the trades bar by bar
+        trades = bt.account.trade_history.trades
+        trade_times = bt.account.trade_history.time_ns
+        cash, shares, t = 1000.0, 0.0, 0
+        for time, close, equity in zip(curve.index, curve['close'], curve['equity']):
+            while t < len(trades) and trade_times[t] <= time.value:
+                sign = 1 if trades[t].side.value == 1 else -1
+                shares += sign * trades[t].amount
+                cash -= sign * trades[t].amount * trades[t].price + trades[t].fee
+                t += 1
+            self.assertAlmostEqual(cash + shares * close, equity, places=6)
+        with decimal.localcontext() as ctx:
+            ctx.prec = 5
+            self.assertAlmostEqual(float(bt.generate_report()[5]), curve['equity'].iloc[-1], delta=1.0)
+
+        max_drawdown, sharpe, sortino, exposure, turnover = bt.generate_risk_report()
+        peaks = np.maximum.accumulate(curve['equity'].values)
+        self.assertAlmostEqual(np.max(1.0 - curve['equity'].values / peaks), max_drawdown)
+        self.assertTrue(0.0 < max_drawdown < 1.0)
+        self.assertAlmostEqual((curve['position'] != 0).mean(), exposure)
+        self.assertTrue(turnover > 0.0)
+        self.assertTrue(np.isfinite(sharpe) and np.isfinite(sortino))
+
+
+    def test_equity_curve_gap(self):
+        # bars 3 and 4 are empty rollup periods without a close; they are valued at the close of bar 2
+        bar_times = np.arange(8, dtype=np.int64) * 3600 * 10 ** 9
+        closes = np.array([10.0, 11.0, 12.0, np.nan, np.nan, 13.0, 12.0, 14.0])
+        cash, position, equity = equity_curve(bar_times, closes, bar_times[[1, 6]], np.array([2.0, -2.0]),
+                                              np.array([-22.0, 24.0]), 100.0)
+        np.testing.assert_array_equal([100.0, 78.0, 78.0, 78.0, 78.0, 78.0, 102.0, 102.0], cash)
+        np.testing.assert_array_equal([100.0, 100.0, 102.0, 102.0, 102.0, 104.0, 102.0, 102.0], equity)
+        metrics = risk_metrics(equity, position, 46.0, bars_per_year(AggPeriod.ONE_HOUR))
+        self.assertTrue(all([np.isfinite(metrics[k]) for k in RISK_METRICS]))
+
+
+
+    def test_backtest_by_replay(self):
+        df = TestBacktestHarness.df
+        cases = [(AggPeriod.FIVE_MINUTES, lambda: MACDModel("LTC-USD", low_ewm=3, high_ewm=7)),
+                 (AggPeriod.ONE_HOUR, lambda: MACDModel("LTC-USD", low_ewm=3, high_ewm=7)),
+                 (AggPeriod.FIVE_MINUTES, lambda: SMACModel("LTC-USD", streaming=True)),
+                 (AggPeriod.FIVE_MINUTES, lambda: SMACModel("LTC-USD", short_lb=5, long_lb=12, streaming=True)),
+                 (AggPeriod.ONE_HOUR, lambda: SMACModel("LTC-USD", short_lb=5, long_lb=12, streaming=True))]
+        for agg_period, model_fn in cases:
+            expected_bt = BacktestHarness(model_fn(), seed_investment=1000.0, agg_period=agg_period)
+            evts = expected_bt.backtest_single_pass(df)
+            for batch_size in [1, 64]:
+                bt = BacktestHarness(model_fn(), seed_investment=1000.0, agg_period=agg_period)
+                bars_per_sec = bt.backtest_by_replay(df, batch_size=batch_size)
+                self.assertTrue(bars_per_sec > 0)
+                self.assertTrue(len(evts) > 0)
+                self.assertEqual(len(evts), bt.account.num_trades())
+                self.assertListEqual(list(expected_bt.account.trade_history.time_ns),
+                                     list(bt.account.trade_history.time_ns))
+                with decimal.localcontext() as ctx:
+                    ctx.prec = 5
+                    self.assertListEqual([str(x) for x in expected_bt.generate_report()],
+                                         [str(x) for x in bt.generate_report()])
+                    self.assertListEqual([str(x) for x in expected_bt.generate_risk_report()],
+                                         [str(x) for x in bt.generate_risk_report()])
+
+
+    def test_backtest_by_replay_queued(self):
+        df = TestBacktestHarness.df
+        expected_bt = BacktestHarness(MACDModel("LTC-USD", low_ewm=3, high_ewm=7), seed_investment=1000.0)
+        expected_bt.backtest_single_pass(df)
+
+        # signals reach the harness on the queue's thread, outside the replay's decimal context
+        bt = BacktestHarness(MACDModel("LTC-USD", low_ewm=3, high_ewm=7), seed_investment=1000.0)
+        bt.alpha_model.listeners = []
+        queued = bt.alpha_model.subscribe(bt, policy=OverflowPolicy.BLOCK)
+        bt.backtest_by_replay(df)
+        self.assertTrue(queued.join(10))
+        queued.close()
+        self.assertEqual(expected_bt.account.num_trades(), bt.account.num_trades())
+        with decimal.localcontext() as ctx:
+            ctx.prec = 5
+            self.assertListEqual([str(x) for x in expected_bt.generate_report()],
+                                 [str(x) for x in bt.generate_report()])
+
+
+    def test_backtest_by_replay_max_records(self):
+        df = TestBacktestHarness.df
+        bt = BacktestHarness(MACDModel("LTC-USD", low_ewm=3, high_ewm=7), seed_investment=1000.0)
+        bt.backtest_by_replay(df, max_records=100)
+        self.assertEqual(100, len(bt.bars))
+        self.assertEqual(str(df['close'].iloc[99]), str(float(bt.end_price)))
+        self.assertTrue((bt.account.trade_history.time_ns <= df.index[99].value).all())
+
+
+    def test_candle_store(self):
+        bt = BacktestHarness(MACDModel("LTC-USD", low_ewm=3, high_ewm=7), seed_investment=1000.0)
+        self.assertIsNone(bt.candle_store)
+
+        root = Path(tempfile.mkdtemp())
+        try:
+            store = CandleStore(root)
+            bt = BacktestHarness(MACDModel("LTC-USD", low_ewm=3, high_ewm=7), seed_investment=1000.0,
+                                 backtest_data=Path("./test/data/test_candles_1000.csv"), candle_store=store)
+            evts = bt.backtest_single_pass()
+            self.assertTrue(len(evts) > 0)
+            self.assertTrue(Path(root, "csv").is_dir())
+        finally:
+            shutil.rmtree(root, ignore_errors=True)
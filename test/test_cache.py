@@ -0,0 +1,140 @@
+import multiprocessing
+import os
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+from unittest import TestCase
+
+from cryptalgo.backtest.backtest import BacktestHarness
+from cryptalgo.backtest.cache import BacktestCache
+from cryptalgo.backtest.sweep import ParameterSweep
+from cryptalgo.brain.models import SMACModel, MACDModel
+from cryptalgo.coredata.rollup import data_hash
+from cryptalgo.inputs.feed_agg import AggPeriod
+from test.test_utils import generate_hloc_dataframe
+
+
+
+def _write_entries(cache_dir: str, worker: int) -> int:
+    cache = BacktestCache(cache_dir, max_bytes=40 * 1024)
+    for i in range(50):
+        # every worker writes the shared keys too
+        cache.put("{0:040x}".format(i if i % 2 else worker * 1000 + i), {'report': (worker, i), 'signals': None})
+    return worker
+
+
+
+class TestBacktestCache(TestCase):
+
+    def setUp(self) -> None:
+        self.directory = tempfile.TemporaryDirectory()
+        self.cache_dir = Path(self.directory.name)
+
+
+    def tearDown(self) -> None:
+        self.directory.cleanup()
+
+
+    def test_make_key(self):
+        df = generate_hloc_dataframe()
+        key = data_hash(df)
+        base = BacktestCache.make_key(key, SMACModel, {'short_lb': 5, 'long_lb': 12}, AggPeriod.FIVE_MINUTES)
+        self.assertEqual(base, BacktestCache.make_key(key, SMACModel, {'long_lb': 12, 'short_lb': 5},
+                                                      AggPeriod.FIVE_MINUTES))
+        self.assertNotEqual(base, BacktestCache.make_key(key, SMACModel, {'short_lb': 5, 'long_lb': 13},
+                                                         AggPeriod.FIVE_MINUTES))
+        self.assertNotEqual(base, BacktestCache.make_key(key, SMACModel, {'short_lb': 5, 'long_lb': 12},
+                                                         AggPeriod.ONE_HOUR))
+        self.assertNotEqual(base, BacktestCache.make_key(key, MACDModel, {'short_lb': 5, 'long_lb': 12},
+                                                         AggPeriod.FIVE_MINUTES))
+        changed = df.copy()
+        changed.iloc[10, changed.columns.get_loc('close')] += 0.01
+        self.assertNotEqual(base, BacktestCache.make_key(data_hash(changed), SMACModel,
+                                                         {'short_lb': 5, 'long_lb': 12}, AggPeriod.FIVE_MINUTES))
+
+        class NewSMACModel(SMACModel):
+            version = 2
+
+        self.assertNotEqual(BacktestCache.make_key(key, NewSMACModel, {}, AggPeriod.FIVE_MINUTES),
+                            BacktestCache.make_key(key, SMACModel, {}, AggPeriod.FIVE_MINUTES))
+
+
+    def test_run(self):
+        df = generate_hloc_dataframe()
+        cache = BacktestCache(self.cache_dir)
+        bt = BacktestHarness(SMACModel("LTC-USD", short_lb=5, long_lb=12), seed_investment=1000.0)
+        expected_signals = bt.backtest_single_pass(df)
+
+        entry = cache.run(SMACModel, {'short_lb': 5, 'long_lb': 12}, df, AggPeriod.FIVE_MINUTES)
+        self.assertTupleEqual(bt.generate_report(), entry['report'])
+        self.assertIsNone(entry['signals'])
+        self.assertEqual((0, 1), (cache.hits, cache.misses))
+        # signals asked for: reruns once, then both are served
+        entry = cache.run(SMACModel, {'short_lb': 5, 'long_lb': 12}, df, AggPeriod.FIVE_MINUTES, with_signals=True)
+        self.assertTrue(expected_signals.equals(entry['signals']))
+        entry = BacktestCache(self.cache_dir).run(SMACModel, {'short_lb': 5, 'long_lb': 12}, df,
+                                                  AggPeriod.FIVE_MINUTES, with_signals=True)
+        self.assertTupleEqual(bt.generate_report(), entry['report'])
+        self.assertTrue(expected_signals.equals(entry['signals']))
+
+
+    def test_unreadable_entry(self):
+        cache = BacktestCache(self.cache_dir)
+        key = "ab" * 20
+        cache.put(key, {'report': (1,), 'signals': None})
+        with open(cache._path_for(key), "wb") as f:
+            f.write(b"torn")
+        self.assertIsNone(cache.get(key))
+        self.assertFalse(cache._path_for(key).exists())
+
+
+    def test_lru_eviction(self):
+        cache = BacktestCache(self.cache_dir, max_bytes=10 ** 9)
+        keys = ["{0:040x}".format(i) for i in range(20)]
+        for i, key in enumerate(keys):
+            cache.put(key, {'report': (i,), 'signals': None})
+            os.utime(cache._path_for(key), (1000 + i, 1000 + i))
+        size = cache._path_for(keys[0]).stat().st_size
+        # a read makes the oldest entry the most recent
+        self.assertEqual((0,), cache.get(keys[0])['report'])
+        cache.max_bytes = size * 10
+        self.assertEqual(11, cache.evict())
+        self.assertIsNotNone(cache.get(keys[0]))
+        self.assertIsNone(cache.get(keys[1]))
+        self.assertIsNone(cache.get(keys[11]))
+        self.assertIsNotNone(cache.get(keys[12]))
+
+
+    def test_concurrent_writers(self):
+        with ProcessPoolExecutor(max_workers=4, mp_context=multiprocessing.get_context('spawn')) as executor:
+            self.assertListEqual(list(range(4)), list(executor.map(_write_entries, [str(self.cache_dir)] * 4,
+                                                                   range(4))))
+        cache = BacktestCache(self.cache_dir, max_bytes=40 * 1024)
+        files = [p for p in self.cache_dir.rglob("*") if p.is_file()]
+        self.assertTrue(all(p.suffix == ".pkl" and not p.name.startswith(".tmp-") for p in files))
+        # every surviving entry loads
+        for p in files:
+            self.assertIsNotNone(cache.get(p.stem))
+        cache.evict()
+        self.assertLessEqual(sum(p.stat().st_size for p in self.cache_dir.rglob("*.pkl")), 40 * 1024)
+
+
+    def test_sweep(self):
+        df = generate_hloc_dataframe()
+        jobs = [
+            (SMACModel, {'short_lb': 30, 'long_lb': 90}, AggPeriod.FIVE_MINUTES),
+            (MACDModel, {'low_ewm': 12, 'high_ewm': 26}, AggPeriod.FIFTEEN_MINUTES),
+        ]
+        cache = BacktestCache(self.cache_dir)
+        reports = ParameterSweep(df, max_workers=2, cache=cache).run(jobs[:1])
+        reports = ParameterSweep(df, max_workers=2, cache=cache).run(jobs)
+        for (model_cls, params, agg_period), report in zip(jobs, reports):
+            bt = BacktestHarness(model_cls("LTC-USD", **params), seed_investment=1000.0, agg_period=agg_period)
+            bt.backtest_single_pass(df)
+            self.assertTupleEqual(bt.generate_report(), report)
+
+        start = time.perf_counter()
+        self.assertListEqual(reports, ParameterSweep(df, max_workers=2, cache=cache).run(jobs))
+        self.assertLess(time.perf_counter() - start, 1.0)
+        self.assertEqual(len(jobs) + 1, cache.hits)
@@ -0,0 +1,140 @@
+import json
+import threading
+import time
+from datetime import datetime, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from unittest import TestCase
+from urllib.parse import urlparse, parse_qs
+
+from cryptalgo.inputs.candle_fetcher import CandleFetcher
+from cryptalgo.inputs.feed_agg import CBProPeriodicHLOCSource, PeriodScheduler, AggPeriod
+from test.test_utils import FakeClock, HLOCCollector
+
+
+
+class FakeExchangeHandler(BaseHTTPRequestHandler):
+    """
+    /products/<product>/candles returning one candle per request. SLOW products answer after `delay_sec`, FAIL products
+    fail `failures` times before answering.
+    """
+
+    delay_sec = 0.2
+    failures = 2
+    fail_ct = {}
+    lock = threading.Lock()
+
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        product = url.path.split("/")[2]
+        query = parse_qs(url.query)
+        if product.startswith("SLOW"):
+            time.sleep(self.delay_sec)
+        if product.startswith("FAIL"):
+            with self.lock:
+                ct = self.fail_ct.get(product, 0)
+                self.fail_ct[product] = ct + 1
+            if ct < self.failures:
+                self.send_response(502)
+                self.end_headers()
+                return
+        t = int(datetime.fromisoformat(query['start'][0]).timestamp())
+        # [time, low, high, open, close, volume]
+        body = json.dumps([[t, 1.0, 4.0, 2.0, 3.0, float(len(product))]]).encode('utf-8')
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+    def log_message(self, format, *args):
+        pass
+
+
+
+class TestCandleFetcher(TestCase):
+
+    def setUp(self) -> None:
+        FakeExchangeHandler.fail_ct = {}
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), FakeExchangeHandler)
+        self.server.daemon_threads = True
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+        self.url = "http://127.0.0.1:{0}".format(self.server.server_address[1])
+
+
+    def tearDown(self) -> None:
+        self.server.shutdown()
+        self.server.server_close()
+
+
+    def test_fetch_all_concurrent(self):
+        fetcher = CandleFetcher(self.url, requests_per_sec=100, max_workers=20)
+        start = datetime(2021, 6, 1, 10, 0, tzinfo=timezone.utc)
+        batch = [("SLOW-{0}".format(i), start, start, 60) for i in range(20)]
+        t = time.monotonic()
+        results = fetcher.fetch_all(batch)
+        elapsed = time.monotonic() - t
+        fetcher.close()
+        # 20 x 0.2s sequentially
+        self.assertLess(elapsed, 2.0)
+        self.assertEqual(20, len(results))
+        self.assertEqual(int(start.timestamp()), results[0][0][0])
+        self.assertEqual(float(len("SLOW-15")), results[15][0][5])
+
+
+    def test_retries(self):
+        fetcher = CandleFetcher(self.url, retries=2, retry_delay_sec=0.01)
+        start = datetime(2021, 6, 1, 10, 0, tzinfo=timezone.utc)
+        results = fetcher.fetch_all([("FAIL-A", start, start, 60), ("OK-B", start, start, 60)])
+        self.assertEqual(3, FakeExchangeHandler.fail_ct["FAIL-A"])
+        self.assertEqual(2, fetcher.error_ct)
+        self.assertEqual(4, fetcher.request_ct)
+        self.assertIsInstance(results[0], list)
+
+        fetcher.retries = 0
+        results = fetcher.fetch_all([("FAIL-C", start, start, 60)])
+        self.assertIsInstance(results[0], IOError)
+        fetcher.close()
+
+
+    def test_timeout(self):
+        fetcher = CandleFetcher(self.url, timeout_sec=0.05, retries=1, retry_delay_sec=0.01)
+        start = datetime(2021, 6, 1, 10, 0, tzinfo=timezone.utc)
+        results = fetcher.fetch_all([("SLOW-A", start, start, 60)])
+        self.assertIsInstance(results[0], IOError)
+        self.assertEqual(2, fetcher.error_ct)
+        fetcher.close()
+
+
+    def test_fan_out(self):
+        fetcher = CandleFetcher(self.url, requests_per_sec=100, max_workers=8)
+        clock = FakeClock(datetime(2021, 6, 1, 10, 0, 30, tzinfo=timezone.utc).timestamp())
+        scheduler = PeriodScheduler(clock=clock)
+        sources = []
+        sinks = []
+        for product in ["SLOW-BTC", "ETH-USD", "FAIL-LTC", "SLOW-LINK"]:
+            source = CBProPeriodicHLOCSource(product, AggPeriod.ONE_MINUTE, scheduler=scheduler, fetcher=fetcher)
+            sink = HLOCCollector()
+            source.subscribe(sink)
+            source.start()
+            sources.append(source)
+            sinks.append(sink)
+
+        clock.t += 31
+        fetcher.retries = 0
+        self.assertEqual(4, scheduler.fire_due())
+        for product, sink in zip(["SLOW-BTC", "ETH-USD", "SLOW-LINK"], [sinks[0], sinks[1], sinks[3]]):
+            self.assertEqual(1, len(sink.hlocs))
+            hloc = sink.hlocs[0]
+            self.assertEqual(product, hloc.symbol)
+            self.assertEqual(datetime(2021, 6, 1, 10, 0, tzinfo=timezone.utc), hloc.time)
+            self.assertListEqual([4.0, 1.0, 2.0, 3.0, float(len(product)), 60],
+                                 [hloc.high, hloc.low, hloc.open, hloc.close, hloc.volume, hloc.duration_sec])
+        # a failed fetch is skipped and the source moves on to the next period
+        self.assertEqual(0, len(sinks[2].hlocs))
+        self.assertEqual(datetime(2021, 6, 1, 10, 2), sources[2].period_end)
+        for source in sources:
+            source.stop()
+        fetcher.close()
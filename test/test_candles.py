@@ -0,0 +1,137 @@
+import csv
+import shutil
+import tempfile
+from pathlib import Path
+from unittest import TestCase
+
+import numpy as np
+import pandas as pd
+
+from cryptalgo.coredata.candles import CandleStore, CandleSeries
+from test.test_utils import generate_hloc_dataframe
+
+CSV_PATH = Path("./test/data/test_candles_1000.csv")
+
+
+
+class TestCandleStore(TestCase):
+
+    def setUp(self) -> None:
+        self.root = Path(tempfile.mkdtemp())
+        self.store = CandleStore(self.root)
+
+
+    def tearDown(self) -> None:
+        shutil.rmtree(self.root, ignore_errors=True)
+
+
+    def test_import_csv(self):
+        symbol, granularity = self.store.import_csv(CSV_PATH)
+        self.assertEqual(("LTC-USD", 300), (symbol, granularity))
+        self.assertTrue(self.store.has(symbol, granularity))
+
+        expected = generate_hloc_dataframe()
+        df = self.store.load_dataframe(symbol, granularity)
+        self.assertListEqual(expected.columns.values.tolist(), df.columns.values.tolist())
+        self.assertTrue(expected.index.equals(df.index))
+        for k in CandleSeries.columns:
+            np.testing.assert_array_equal(expected[k].values, df[k].values)
+        self.assertTrue((df['duration_secs'] == 300).all())
+
+        # the frame is a view of the mapped files
+        series = self.store.read(symbol, granularity)
+        df = series.to_dataframe()
+        self.assertTrue(np.shares_memory(series.times, df.index.asi8))
+        for k in CandleSeries.columns:
+            self.assertTrue(np.shares_memory(series.values[k], df[k].values))
+
+
+    def test_read_slice(self):
+        symbol, granularity = self.store.import_csv(CSV_PATH)
+        series = self.store.read(symbol, granularity)
+        self.assertIsInstance(series.close, np.memmap)
+        self.assertEqual(1000, len(series))
+
+        expected = generate_hloc_dataframe()
+        start, end = expected.index[100], expected.index[199]
+        sliced = self.store.read(symbol, granularity, start=start, end=end)
+        self.assertEqual(100, len(sliced))
+        self.assertTrue(np.shares_memory(series.close, series.slice(start, end).close))
+        np.testing.assert_array_equal(expected['close'].values[100:200], sliced.close)
+        self.assertEqual(0, len(series.slice(start=expected.index[-1] + pd.Timedelta(minutes=5))))
+
+
+    def test_append(self):
+        expected = generate_hloc_dataframe()
+        times = expected.index.asi8
+        values = {k: expected[k].values for k in CandleSeries.columns}
+        self.store.append("LTC-USD", 300, times[:600], {k: v[:600] for k, v in values.items()})
+        self.store.append("LTC-USD", 300, times[600:], {k: v[600:] for k, v in values.items()})
+        # overlapping rows are merged, keeping the newest values
+        changed = dict(values)
+        changed['close'] = values['close'] + 1.0
+        self.store.append("LTC-USD", 300, times[590:610], {k: v[590:610] for k, v in changed.items()})
+
+        series = self.store.read("LTC-USD", 300)
+        self.assertEqual(1000, len(series))
+        np.testing.assert_array_equal(times, series.times)
+        np.testing.assert_array_equal(values['close'][:590], series.close[:590])
+        np.testing.assert_array_equal(changed['close'][590:610], series.close[590:610])
+        self.assertEqual(int(times[-1]), self.store.get_last_time("LTC-USD", 300))
+
+
+    def test_load_csv(self):
+        work = Path(self.root, "candles.csv")
+        shutil.copy(CSV_PATH, work)
+        df = self.store.load_csv(work)
+        self.assertEqual(1000, len(df))
+        source_store = self.store.for_source(work)
+        mtime = source_store.get_meta("LTC-USD", 300)['source_mtime']
+
+        # unchanged source is served from the store
+        self.store.load_csv(work)
+        self.assertEqual(mtime, source_store.get_meta("LTC-USD", 300)['source_mtime'])
+
+        with open(work, "a") as f:
+            f.write('\n"LTC-USD","2021-01-05T00:00:00+00:00",1.0,1.0,1.0,1.0,1.0,300\n')
+        self.assertEqual(1001, len(self.store.load_csv(work)))
+
+
+    def test_load_csv_sources(self):
+        # two files for the same symbol and granularity keep separate copies
+        first = Path(self.root, "candles.csv")
+        second = Path(self.root, "candles-inv.csv")
+        shutil.copy(CSV_PATH, first)
+        expected = generate_hloc_dataframe()
+        inverted = expected.copy()
+        inverted['close'] = np.round(1.0 / inverted['close'], 6)
+        inverted.to_csv(second, quoting=csv.QUOTE_NONNUMERIC)
+
+        for _ in range(2):
+            np.testing.assert_array_equal(expected['close'].values, self.store.load_csv(first)['close'].values)
+            np.testing.assert_array_equal(inverted['close'].values, self.store.load_csv(second)['close'].values)
+        self.assertNotEqual(self.store.for_source(first).root, self.store.for_source(second).root)
+        self.assertFalse(self.store.has("LTC-USD", 300))
+
+
+    def test_write_swaps_data(self):
+        expected = generate_hloc_dataframe()
+        times = expected.index.asi8
+        values = {k: expected[k].values for k in CandleSeries.columns}
+        self.store.write("LTC-USD", 300, times, values)
+        mapped = self.store.read("LTC-USD", 300)
+
+        # a rewrite leaves the mapped columns alone
+        changed = {k: v + 1.0 for k, v in values.items()}
+        self.store.write("LTC-USD", 300, times[:500], {k: v[:500] for k, v in changed.items()})
+        np.testing.assert_array_equal(values['close'], mapped.close)
+        series = self.store.read("LTC-USD", 300)
+        self.assertEqual(500, len(series))
+        np.testing.assert_array_equal(changed['close'][:500], series.close)
+
+        # only the current and the previous data directories are kept
+        self.store.write("LTC-USD", 300, times, values)
+        path = self.store.path_for("LTC-USD", 300)
+        self.assertEqual(2, len([p for p in path.iterdir() if p.is_dir()]))
+        self.assertTrue(Path(path, self.store.get_meta("LTC-USD", 300)['data']).is_dir())
+        np.testing.assert_array_equal(values['close'], self.store.read("LTC-USD", 300).close)
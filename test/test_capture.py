@@ -0,0 +1,125 @@
+import csv
+import shutil
+import tempfile
+import threading
+from datetime import datetime, timezone, timedelta
+from pathlib import Path
+from unittest import TestCase
+
+from cryptalgo.inputs.capture import TickCaptureWriter
+from cryptalgo.inputs.feed import Tick
+
+
+
+def make_ticks(n: int, symbols=("BTC-USD", "ETH-USD"), start=datetime(2021, 6, 1, 11, 50, tzinfo=timezone.utc)):
+    return [Tick(start + timedelta(seconds=i), symbols[i % len(symbols)], 100.0 + i, 0.5, "buy", 99.0, 101.0)
+            for i in range(n)]
+
+
+
+class TestTickCaptureWriter(TestCase):
+
+    def setUp(self) -> None:
+        self.dir = Path(tempfile.mkdtemp())
+
+
+    def tearDown(self) -> None:
+        shutil.rmtree(self.dir, ignore_errors=True)
+
+
+    def read_rows(self):
+        rows = []
+        for path in sorted(self.dir.iterdir()):
+            with open(path, "r") as f:
+                reader = csv.reader(f)
+                self.assertListEqual(["time", "symbol", "price", "size", "side", "best_bid", "best_ask"], next(reader))
+                rows.extend(list(reader))
+        return rows
+
+
+    def test_submit_stop_drains(self):
+        writer = TickCaptureWriter(self.dir, batch_size=100, flush_interval_sec=0.05, rotate_hourly=False)
+        writer.start()
+        ticks = make_ticks(5000)
+        for t in ticks:
+            self.assertTrue(writer.submit(t))
+        writer.stop()
+        stats = writer.get_stats()
+        self.assertEqual(5000, stats['flushed'])
+        self.assertEqual(0, stats['dropped'])
+        self.assertEqual(2, stats['files_opened'])
+
+        rows = self.read_rows()
+        self.assertEqual(5000, len(rows))
+        self.assertSetEqual(set([t.time.isoformat() for t in ticks]), set([r[0] for r in rows]))
+
+
+    def test_rotation(self):
+        # 20 minutes of ticks across the hour and small files
+        writer = TickCaptureWriter(self.dir, batch_size=50, flush_interval_sec=0.05, rotate_bytes=20000)
+        writer.start()
+        for t in make_ticks(1200, symbols=("BTC-USD",)):
+            writer.submit(t)
+        writer.stop()
+        self.assertEqual(1200, len(self.read_rows()))
+        self.assertGreater(writer.files_opened, 2)
+        for path in self.dir.iterdir():
+            self.assertLess(path.stat().st_size, 20000 + 5000)
+
+
+    def test_dropped(self):
+        writer = TickCaptureWriter(self.dir, max_queue=10)
+        for t in make_ticks(15):
+            writer.submit(t)
+        self.assertEqual(10, writer.submitted_ct)
+        self.assertEqual(5, writer.dropped_ct)
+        writer.start()
+        writer.stop()
+        self.assertEqual(10, writer.flushed_ct)
+
+
+    def test_write_errors(self):
+        writer = TickCaptureWriter(self.dir, batch_size=10, flush_interval_sec=0.05, rotate_hourly=False)
+        write = writer._write
+        failures = []
+
+        def failing_write(batch):
+            # the first batch fails, the rest are written
+            if len(failures) == 0:
+                failures.append(len(batch))
+                raise OSError("disk full")
+            write(batch)
+
+        writer._write = failing_write
+        writer.start()
+        for t in make_ticks(100):
+            writer.submit(t)
+        self.assertFalse(writer.stop())
+        self.assertIsNone(writer.thread)
+        self.assertIsInstance(writer.last_error, OSError)
+        stats = writer.get_stats()
+        self.assertEqual(failures[0], stats['failed'])
+        self.assertEqual(100, stats['flushed'] + stats['failed'])
+        self.assertEqual(stats['flushed'], len(self.read_rows()))
+
+
+    def test_stop_timeout(self):
+        writer = TickCaptureWriter(self.dir, batch_size=10, flush_interval_sec=0.05, rotate_hourly=False)
+        release = threading.Event()
+        write = writer._write
+
+        def slow_write(batch):
+            release.wait(10)
+            write(batch)
+
+        writer._write = slow_write
+        writer.start()
+        for t in make_ticks(20):
+            writer.submit(t)
+        # the writer is still draining, so it is kept and stop can be retried
+        self.assertFalse(writer.stop(timeout=0.1))
+        self.assertTrue(writer.thread.is_alive())
+        release.set()
+        self.assertTrue(writer.stop(timeout=10))
+        self.assertIsNone(writer.thread)
+        self.assertEqual(20, len(self.read_rows()))
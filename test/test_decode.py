@@ -0,0 +1,77 @@
+import os
+from datetime import datetime, timezone
+from pathlib import Path
+from unittest import TestCase, skipUnless
+
+from cryptalgo.inputs.decode import TickerDecoder, benchmark, load_corpus, parse_iso_ns, _decode_legacy
+from cryptalgo.inputs.feed import Tick, datetime_to_ns
+
+CORPUS = Path(Path(__file__).parent, "data", "cbpro_messages.jsonl")
+
+
+
+class TestParseIsoNs(TestCase):
+
+    def test_corpus_times(self):
+        for msg in load_corpus(CORPUS):
+            if 'time' in msg:
+                expected = datetime_to_ns(datetime.strptime(msg['time'], '%Y-%m-%dT%H:%M:%S.%f%z'))
+                self.assertEqual(expected, parse_iso_ns(msg['time']), msg['time'])
+
+
+    def test_other_forms(self):
+        base = datetime_to_ns(datetime(2021, 6, 1, 12, 34, 56, tzinfo=timezone.utc))
+        self.assertEqual(base, parse_iso_ns("2021-06-01T12:34:56Z"))
+        self.assertEqual(base + 123000000, parse_iso_ns("2021-06-01T12:34:56.123Z"))
+        self.assertEqual(base + 123456789, parse_iso_ns("2021-06-01T12:34:56.123456789Z"))
+        self.assertEqual(base + 500000, parse_iso_ns("2021-06-01T14:34:56.0005+02:00"))
+        self.assertEqual(base, parse_iso_ns("2021-06-01T12:34:56+00:00"))
+        with self.assertRaises(ValueError):
+            parse_iso_ns("not a time")
+
+
+
+class TestTickerDecoder(TestCase):
+
+    def test_decode(self):
+        corpus = load_corpus(CORPUS)
+        decoder = TickerDecoder()
+        ticks = [decoder.decode(msg) for msg in corpus]
+        legacy = [_decode_legacy(msg) for msg in corpus]
+        self.assertEqual(len([t for t in legacy if t is not None]), decoder.decoded_ct)
+        self.assertEqual(len(corpus) - decoder.decoded_ct, decoder.skipped_ct)
+        self.assertEqual(0, decoder.error_ct)
+        for tick, old in zip(ticks, legacy):
+            self.assertEqual(old is None, tick is None)
+            if tick is not None:
+                self.assertEqual(old.to_json(), tick.to_json())
+                self.assertEqual(old.time, tick.time)
+
+
+    def test_bad_message(self):
+        decoder = TickerDecoder()
+        self.assertIsNone(decoder.decode({'type': 'ticker', 'time': "2021-06-01T12:34:56.123456Z", 'price': "1"}))
+        self.assertEqual(1, decoder.error_ct)
+
+
+    # wall clock timing is flaky on loaded machines, so it only runs on request
+    @skipUnless(os.environ.get("CRYPTALGO_BENCHMARKS"), "set CRYPTALGO_BENCHMARKS=1 to run timing benchmarks")
+    def test_faster(self):
+        res = benchmark(load_corpus(CORPUS) * 5, repeat=3)
+        # the corpus runs at ~5x; leave room for noisy machines
+        self.assertGreater(res['speedup'], 2.0)
+
+
+
+class TestTickTime(TestCase):
+
+    def test_lazy_time(self):
+        t = datetime(2021, 6, 1, 12, 34, 56, 123456, tzinfo=timezone.utc)
+        ns = datetime_to_ns(t)
+        tick = Tick(None, "BTC-USD", 1.0, 1.0, time_ns=ns)
+        self.assertIsNone(tick._time)
+        self.assertEqual(t, tick.time)
+        self.assertEqual(ns, Tick(t, "BTC-USD", 1.0, 1.0).time_ns)
+
+        tick.time = datetime(2021, 6, 1, tzinfo=timezone.utc)
+        self.assertEqual(datetime_to_ns(datetime(2021, 6, 1, tzinfo=timezone.utc)), tick.time_ns)
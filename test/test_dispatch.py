@@ -0,0 +1,182 @@
+import threading
+import time
+from datetime import datetime, timezone, timedelta
+from unittest import TestCase
+
+from cryptalgo.brain.models import SMACModel, Signal
+from cryptalgo.inputs.dispatch import QueuedListener, OverflowPolicy
+from cryptalgo.inputs.feed import Feed, Tick
+from cryptalgo.inputs.feed_agg import OHLC, FileOHLC
+
+
+
+class StubFeed(Feed):
+
+    def start(self):
+        pass
+
+
+    def stop(self):
+        pass
+
+
+
+class GatedTickSink:
+    """
+    Blocks in on_tick until the gate is opened.
+    """
+
+    def __init__(self):
+        self.gate = threading.Event()
+        self.ticks = []
+        self.thread_names = set()
+
+    def on_tick(self, tick: Tick):
+        self.gate.wait()
+        self.thread_names.add(threading.current_thread().name)
+        self.ticks.append(tick)
+
+
+
+class TickSink:
+    def __init__(self):
+        self.ticks = []
+
+    def on_tick(self, tick: Tick):
+        self.ticks.append(tick)
+
+
+
+def make_ticks(n: int, symbols=("BTC-USD",)):
+    start = datetime(2021, 6, 1, 12, tzinfo=timezone.utc)
+    return [Tick(start + timedelta(seconds=i), symbols[i % len(symbols)], 100.0 + i, 1.0) for i in range(n)]
+
+
+
+class TestQueuedListener(TestCase):
+
+    def test_sync_unchanged(self):
+        feed = StubFeed()
+        sink = TickSink()
+        self.assertIs(sink, feed.subscribe(sink))
+        for t in make_ticks(10):
+            feed.on_tick(t)
+        self.assertEqual(10, len(sink.ticks))
+
+
+    def test_drop_oldest(self):
+        feed = StubFeed()
+        slow = GatedTickSink()
+        fast = TickSink()
+        queued = feed.subscribe(slow, policy=OverflowPolicy.DROP_OLDEST, max_queue=10)
+        feed.subscribe(fast)
+        self.assertIsInstance(queued, QueuedListener)
+
+        ticks = make_ticks(100)
+        started = time.monotonic()
+        for t in ticks:
+            feed.on_tick(t)
+        # the producer never waited on the blocked listener
+        self.assertLess(time.monotonic() - started, 1.0)
+        self.assertEqual(100, len(fast.ticks))
+        self.assertLessEqual(queued.get_depth(), 10)
+
+        slow.gate.set()
+        self.assertTrue(queued.join(5))
+        stats = queued.get_stats()
+        # one tick may have been taken by the listener thread before the gate
+        self.assertEqual(100, stats['delivered'] + stats['dropped'])
+        self.assertGreaterEqual(stats['dropped'], 89)
+        self.assertEqual(ticks[-10:], slow.ticks[-10:])
+        self.assertSetEqual({"QueuedListener"}, slow.thread_names)
+        queued.close()
+
+
+    def test_block(self):
+        slow = GatedTickSink()
+        queued = QueuedListener(slow, max_queue=5, policy=OverflowPolicy.BLOCK)
+        ticks = make_ticks(50)
+
+        def produce():
+            for t in ticks:
+                queued.on_tick(t)
+
+        producer = threading.Thread(target=produce)
+        producer.start()
+        time.sleep(0.1)
+        # held up by the full queue
+        self.assertTrue(producer.is_alive())
+        self.assertLessEqual(queued.get_depth(), 5)
+        slow.gate.set()
+        producer.join(5)
+        queued.close()
+        self.assertEqual(ticks, slow.ticks)
+        self.assertEqual(0, queued.get_stats()['dropped'])
+        self.assertEqual(5, queued.get_stats()['max_depth'])
+
+
+    def test_block_closed(self):
+        # a producer waiting for room when the queue is closed gets an error instead of queueing its event
+        slow = GatedTickSink()
+        queued = QueuedListener(slow, max_queue=1, policy=OverflowPolicy.BLOCK)
+        ticks = make_ticks(3)
+        errors = []
+
+        def produce():
+            try:
+                for t in ticks:
+                    queued.on_tick(t)
+            except RuntimeError as e:
+                errors.append(e)
+
+        producer = threading.Thread(target=produce)
+        producer.start()
+        time.sleep(0.1)
+        self.assertTrue(producer.is_alive())
+        closer = threading.Thread(target=queued.close, kwargs={'drain': False})
+        closer.start()
+        producer.join(5)
+        self.assertFalse(producer.is_alive())
+        self.assertEqual(1, len(errors))
+        slow.gate.set()
+        closer.join(5)
+        self.assertEqual(ticks[:2], slow.ticks)
+        self.assertEqual(2, queued.get_stats()['enqueued'])
+
+
+    def test_conflate(self):
+        slow = GatedTickSink()
+        queued = QueuedListener(slow, max_queue=10, policy=OverflowPolicy.CONFLATE)
+        ticks = make_ticks(300, symbols=("BTC-USD", "ETH-USD", "LTC-USD"))
+        for t in ticks:
+            queued.on_tick(t)
+        slow.gate.set()
+        queued.close()
+        stats = queued.get_stats()
+        self.assertEqual(0, stats['dropped'])
+        self.assertEqual(300, stats['enqueued'] + stats['conflated'])
+        # the latest tick of every symbol made it through
+        for symbol in ["BTC-USD", "ETH-USD", "LTC-USD"]:
+            latest = [t for t in ticks if t.symbol == symbol][-1]
+            self.assertIs(latest, [t for t in slow.ticks if t.symbol == symbol][-1])
+        self.assertLessEqual(len(slow.ticks), 4)
+
+
+    def test_listener_types(self):
+        class SignalSink:
+            def __init__(self):
+                self.signals = []
+
+            def on_signal(self, signal):
+                self.signals.append(signal)
+
+        model = SMACModel("BTC-USD")
+        sink = SignalSink()
+        queued = model.subscribe(sink, policy=OverflowPolicy.BLOCK)
+        model.fire_signal(Signal.BUY, OHLC("BTC-USD", datetime.now(), 1.0, 1.0, 1.0, 1.0, 1.0, 300))
+        queued.close()
+        self.assertListEqual([Signal.BUY], sink.signals)
+        # only the wrapped listener's callbacks are exposed
+        self.assertFalse(hasattr(queued, "on_tick"))
+        with self.assertRaises(TypeError):
+            FileOHLC("x.csv", "BTC-USD").subscribe(QueuedListener(TickSink()), policy=OverflowPolicy.BLOCK)
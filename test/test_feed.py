@@ -1,9 +1,19 @@
+import collections
+import csv
+import shutil
+import tempfile
+from datetime import datetime, timezone, timedelta
+from pathlib import Path
 from unittest import TestCase
 
 import cryptalgo.inputs
 import time
 
+import numpy as np
+
+from cryptalgo.inputs.feed import NAT_NS, Feed, FileFeed, Tick
 from cryptalgo.inputs.feed_agg import OHLC
+from cryptalgo.inputs.ticklog import TickLogWriter
 
 
 
@@ -16,6 +26,134 @@ class HLOCSink:
             self.event_ct += 1
 
 
+class TickSink:
+    def __init__(self):
+        self.ticks = []
+
+    def on_tick(self, tick: Tick):
+        self.ticks.append(tick)
+
+
+
+def make_ticks(n: int, step_ms: int = 250):
+    start = datetime(2021, 6, 1, 12, 0, 0, 500, tzinfo=timezone.utc)
+    return [Tick(start + timedelta(milliseconds=step_ms * i), "BTC-USD", 35000.0 + i * 0.01, 0.001 * (i + 1),
+                 "buy" if i % 2 else "sell", 34999.5, 35000.5) for i in range(n)]
+
+
+
+class FeedStub(Feed):
+
+    def start(self):
+        pass
+
+
+    def stop(self):
+        pass
+
+
+
+class TestFeed(TestCase):
+
+    def test_csv_row_ticks(self):
+        ticks = make_ticks(5)
+        rows = [Tick.from_csv_row(next(csv.reader([t.to_csv_row()]))) for t in ticks]
+        feed = FeedStub(max_buffer=3)
+        sink = TickSink()
+        feed.subscribe(sink)
+        for tick in rows:
+            feed.on_tick(tick)
+        feed.on_tick(Tick(None, "BTC-USD", 1.0, 2.0))
+        self.assertEqual(6, len(sink.ticks))
+        # the string time is kept as read
+        self.assertEqual(ticks[-1].time.isoformat(), sink.ticks[4].time)
+        self.assertEqual(ticks[-1].time_ns, rows[-1].time_ns)
+        self.assertListEqual([ticks[-2].time_ns, ticks[-1].time_ns, NAT_NS],
+                             feed.get_tick_columns()['time'].tolist())
+        self.assertTrue(np.isnat(feed.get_tick_columns(1)['time'].view('datetime64[ns]')[0]))
+
+
+    def test_get_ticks(self):
+        ticks = make_ticks(5)
+        feed = FeedStub(max_buffer=3)
+        for tick in ticks:
+            feed.on_tick(tick)
+        buffered = feed.get_ticks()
+        self.assertIsInstance(buffered, collections.deque)
+        self.assertEqual(3, buffered.maxlen)
+        # rebuilt from the buffer's columns
+        self.assertListEqual([t.to_json() for t in [ticks[4], ticks[3], ticks[2]]], [t.to_json() for t in buffered])
+
+
+
+class TestFileFeed(TestCase):
+
+    def setUp(self) -> None:
+        self.dir = Path(tempfile.mkdtemp())
+
+
+    def tearDown(self) -> None:
+        shutil.rmtree(self.dir, ignore_errors=True)
+
+
+    def write_csv(self, ticks) -> Path:
+        path = Path(self.dir, "ticks.csv")
+        with open(path, "w") as f:
+            f.write(Tick.to_csv_header())
+            f.write("".join([t.to_csv_row() for t in ticks]))
+        return path
+
+
+    def replay(self, path, **kwargs):
+        feed = FileFeed(str(path), **kwargs)
+        sink = TickSink()
+        feed.subscribe(sink)
+        feed.start()
+        self.assertTrue(feed.wait(10))
+        feed.stop()
+        return feed, sink
+
+
+    def test_replay_csv(self):
+        ticks = make_ticks(2500)
+        feed, sink = self.replay(self.write_csv(ticks), chunk_size=1000)
+        self.assertEqual(2500, feed.tick_ct)
+        self.assertGreater(feed.get_ticks_per_sec(), 0)
+        self.assertListEqual([t.to_csv_row() for t in ticks], [t.to_csv_row() for t in sink.ticks])
+        self.assertEqual(ticks[-1].to_csv_row(), feed.get_ticks()[0].to_csv_row())
+
+
+    def test_replay_tick_log(self):
+        ticks = make_ticks(2500)
+        path = Path(self.dir, "ticks.bin")
+        writer = TickLogWriter(path)
+        writer.write_many(ticks)
+        writer.close()
+        feed, sink = self.replay(path, chunk_size=1000)
+        self.assertListEqual([t.to_csv_row() for t in ticks], [t.to_csv_row() for t in sink.ticks])
+
+
+    def test_speed(self):
+        # 2s of recorded ticks at 10x
+        path = self.write_csv(make_ticks(9))
+        feed, sink = self.replay(path, speed=10)
+        self.assertEqual(9, len(sink.ticks))
+        self.assertGreaterEqual(feed.elapsed_sec, 0.19)
+
+
+    def test_stop(self):
+        path = self.write_csv(make_ticks(100, step_ms=1000))
+        feed = FileFeed(str(path), speed=100)
+        sink = TickSink()
+        feed.subscribe(sink)
+        feed.start()
+        time.sleep(0.1)
+        feed.stop()
+        self.assertLess(len(sink.ticks), 100)
+        self.assertTrue(feed.done.is_set())
+
+
+
 class TestFileHLOC(TestCase):
 
     def test_start(self):
@@ -1,8 +1,16 @@
+import csv
 import time
-from datetime import datetime
+from datetime import datetime, timedelta, timezone
+from pathlib import Path
 from unittest import TestCase
 
-from cryptalgo.inputs.feed_agg import FileOHLC, AggPeriod, PeriodicOHLCSource, OHLC, CBProPeriodicHLOCSource
+import numpy as np
+import pandas as pd
+
+from cryptalgo.inputs.feed import Tick, ns_to_datetime
+from cryptalgo.inputs.feed_agg import FileOHLC, AggPeriod, PeriodicOHLCSource, OHLC, CBProPeriodicHLOCSource, \
+    TickOHLCAggregator, PeriodScheduler, OHLCBatch
+from test.test_utils import FakeClock, HLOCCollector
 
 
 
@@ -82,6 +90,60 @@ class TestPeriodicHLOCSource(TestCase):
 
 
 
+class TestPeriodScheduler(TestCase):
+
+    def test_fire_due(self):
+        # 10:00:30 UTC
+        clock = FakeClock(datetime(2021, 6, 1, 10, 0, 30, tzinfo=timezone.utc).timestamp())
+        scheduler = PeriodScheduler(delay_sec=1.0, clock=clock)
+        sources = [PeriodicHLOCSourceStub(s, agg_period=AggPeriod.ONE_MINUTE, scheduler=scheduler)
+                   for s in ["A", "B", "C"]]
+        hourly = PeriodicHLOCSourceStub("D", agg_period=AggPeriod.ONE_HOUR, scheduler=scheduler)
+        for s in sources + [hourly]:
+            s.start()
+            self.assertIsNone(s.timer)
+        self.assertEqual(2, len(scheduler.heap))
+
+        clock.t += 30.5
+        self.assertEqual(0, scheduler.fire_due())
+        clock.t += 0.75
+        self.assertEqual(3, scheduler.fire_due())
+        self.assertEqual(datetime(2021, 6, 1, 10, 1), sources[0].period_start)
+        self.assertAlmostEqual(0.25, scheduler.firings[-1]['lateness_sec'])
+        self.assertEqual(3, scheduler.firings[-1]['sources'])
+
+        # stalled for three minutes: fires once, aligned to the grid again
+        clock.t += 180
+        self.assertEqual(3, scheduler.fire_due())
+        self.assertEqual(2, scheduler.get_stats()['missed'])
+        self.assertEqual(datetime(2021, 6, 1, 10, 4), sources[1].period_start)
+        self.assertEqual(datetime(2021, 6, 1, 10, 5), sources[1].period_end)
+
+        sources[2].stop()
+        clock.t = datetime(2021, 6, 1, 11, 0, 1, tzinfo=timezone.utc).timestamp()
+        self.assertEqual(3, scheduler.fire_due())
+        self.assertEqual(datetime(2021, 6, 1, 11), hourly.period_start)
+        self.assertEqual(4, scheduler.get_stats()['firings'])
+
+        for s in sources[:2] + [hourly]:
+            s.stop()
+        clock.t += 3600
+        self.assertEqual(0, scheduler.fire_due())
+
+
+    def test_thread(self):
+        scheduler = PeriodScheduler(delay_sec=0.0)
+        scheduler.start()
+        s = PeriodicHLOCSourceStub("TEST", agg_period=AggPeriod.ONE_MINUTE, scheduler=scheduler)
+        s.start()
+        self.assertListEqual([s], scheduler.sources[60])
+        s.stop()
+        scheduler.stop()
+        self.assertIsNone(scheduler.thread)
+        self.assertNotIn(60, scheduler.sources)
+
+
+
 class HLOCListener:
 
 
@@ -108,4 +170,184 @@ class TestCBProPeriodicHLOCSource(TestCase):
                 s.stop()
                 self.fail()
         self.assertIsNotNone(l.hlocs[0])
-        s.stop()
\ No newline at end of file
+        s.stop()
+
+
+
+class TestTickOHLCAggregator(TestCase):
+
+    def make_ticks(self, n: int = 5000, seed: int = 7):
+        rng = np.random.RandomState(seed)
+        start = pd.Timestamp("2021-06-01 11:58:13", tz="UTC").value
+        times = start + np.cumsum(rng.randint(1, 400, size=n)) * 1000000
+        symbols = np.array(["BTC-USD", "ETH-USD", "LTC-USD"])[rng.randint(0, 3, size=n)]
+        prices = 100 + np.round(rng.randn(n).cumsum(), 2)
+        sizes = np.round(rng.rand(n), 4)
+        return [Tick(ns_to_datetime(t), s, p, z, "buy") for t, s, p, z in zip(times, symbols, prices, sizes)]
+
+
+    def expected(self, ticks, rule):
+        df = pd.DataFrame({"symbol": [t.symbol for t in ticks], "price": [t.price for t in ticks],
+                           "size": [t.size for t in ticks]},
+                          index=pd.DatetimeIndex([t.time for t in ticks]))
+        rows = []
+        for symbol, g in df.groupby("symbol"):
+            bars = g['price'].resample(rule).ohlc()
+            bars['volume'] = g['size'].resample(rule).sum()
+            for ts, r in bars.dropna().iterrows():
+                rows.append((symbol, ts.to_pydatetime(), r['high'], r['low'], r['open'], r['close'],
+                             round(r['volume'], 8)))
+        return sorted(rows, key=lambda r: (r[1], r[0]))
+
+
+    def actual(self, hlocs, duration_sec):
+        return sorted([(h.symbol, h.time, h.high, h.low, h.open, h.close, round(h.volume, 8))
+                       for h in hlocs if h.duration_sec == duration_sec], key=lambda r: (r[1], r[0]))
+
+
+    def test_matches_resample(self):
+        ticks = self.make_ticks()
+        agg = TickOHLCAggregator(agg_periods=[AggPeriod.ONE_MINUTE, AggPeriod.FIVE_MINUTES])
+        sink = HLOCCollector()
+        agg.subscribe(sink)
+        five = HLOCCollector()
+        agg.subscribe(five, agg_period=AggPeriod.FIVE_MINUTES, symbol="ETH-USD")
+        for t in ticks:
+            agg.on_tick(t)
+        # every bar but the last of each symbol closes on tick time alone
+        closed_before_flush = len(sink.hlocs)
+        agg.flush()
+        self.assertGreater(len(sink.hlocs), closed_before_flush)
+
+        self.assertListEqual(self.expected(ticks, "1min"), self.actual(sink.hlocs, 60))
+        self.assertListEqual(self.expected(ticks, "5min"), self.actual(sink.hlocs, 300))
+        self.assertListEqual([r for r in self.expected(ticks, "5min") if r[0] == "ETH-USD"],
+                             self.actual(five.hlocs, 300))
+        self.assertEqual(0, agg.late_ct)
+        self.assertListEqual(["BTC-USD", "ETH-USD", "LTC-USD"], sorted(agg.symbols))
+
+
+    def test_late_ticks(self):
+        ticks = self.make_ticks(3000)
+        # swap neighbours so ticks arrive out of order by well under the grace window
+        shuffled = list(ticks)
+        for i in range(0, len(shuffled) - 1, 2):
+            shuffled[i], shuffled[i + 1] = shuffled[i + 1], shuffled[i]
+        agg = TickOHLCAggregator(agg_periods=[AggPeriod.ONE_MINUTE], grace_sec=2.0)
+        sink = HLOCCollector()
+        agg.subscribe(sink)
+        for t in shuffled:
+            agg.on_tick(t)
+        agg.flush()
+        self.assertEqual(0, agg.late_ct)
+        self.assertListEqual(self.expected(ticks, "1min"), self.actual(sink.hlocs, 60))
+
+        # past the grace window the tick is dropped
+        agg.on_tick(Tick(ticks[-1].time - timedelta(minutes=3), "BTC-USD", 1.0, 1.0))
+        self.assertEqual(1, agg.late_ct)
+
+
+    def test_csv_row_ticks(self):
+        ticks = self.make_ticks(2000)
+        rows = [Tick.from_csv_row(next(csv.reader([t.to_csv_row()]))) for t in ticks]
+        agg = TickOHLCAggregator(agg_periods=[AggPeriod.ONE_MINUTE])
+        sink = HLOCCollector()
+        agg.subscribe(sink)
+        for t in rows:
+            agg.on_tick(t)
+        # a tick without a time can't be placed in a bar
+        agg.on_tick(Tick(None, "BTC-USD", 1.0, 1.0))
+        agg.flush()
+        self.assertEqual(len(rows), agg.tick_ct)
+        self.assertListEqual(self.expected(ticks, "1min"), self.actual(sink.hlocs, 60))
+
+
+    def test_advance_to(self):
+        agg = TickOHLCAggregator(["BTC-USD"], agg_periods=[AggPeriod.ONE_MINUTE], grace_sec=1.0)
+        sink = HLOCCollector()
+        agg.subscribe(sink)
+        t0 = datetime(2021, 6, 1, 12, 0, 5, tzinfo=timezone.utc)
+        agg.on_tick(Tick(t0, "BTC-USD", 10.0, 1.0))
+        agg.on_tick(Tick(t0 + timedelta(seconds=20), "BTC-USD", 12.0, 2.0))
+        agg.advance_to(t0 + timedelta(seconds=55, microseconds=500000))
+        self.assertEqual(0, len(sink.hlocs))
+        agg.advance_to(t0 + timedelta(seconds=56))
+        self.assertEqual(1, len(sink.hlocs))
+        h = sink.hlocs[0]
+        self.assertEqual(datetime(2021, 6, 1, 12, 0, 0, tzinfo=timezone.utc), h.time)
+        self.assertListEqual([12.0, 10.0, 10.0, 12.0, 3.0, 60], [h.high, h.low, h.open, h.close, h.volume,
+                                                                 h.duration_sec])
+
+
+
+class TestOHLCBatch(TestCase):
+
+    def setUp(self) -> None:
+        t0 = datetime(2021, 6, 1, 12, tzinfo=timezone.utc)
+        self.hlocs = [OHLC("BTC-USD" if i % 3 else "ETH-USD", t0 + timedelta(minutes=5 * i), 101.5 + i, 99.25 - i,
+                           100.0, 100.125 + i, 0.5 * i, 300) for i in range(50)]
+
+
+    def test_slots(self):
+        h = self.hlocs[0]
+        self.assertFalse(hasattr(h, "__dict__"))
+        self.assertEqual('{"symbol": "ETH-USD", "time": "2021-06-01T12:00:00+00:00", "high": 101.5, "low": 99.25, '
+                         '"open": 100.0, "close": 100.125, "volume": 0.0, "duration_sec": 300}', str(h))
+        self.assertEqual(h.to_list(), OHLC.from_dict(h.to_dict()).to_list())
+        self.assertEqual(h.to_csv_row(), OHLC.from_csv(h.to_list(), timestamp_as_str=True).to_csv_row())
+        s = h.to_pandas_series()
+        self.assertEqual(h.time, s.name)
+        self.assertListEqual(['symbol', 'high', 'low', 'open', 'close', 'volume', 'duration_secs'], list(s.index))
+
+
+    def test_round_trip(self):
+        batch = OHLCBatch.from_ohlcs(self.hlocs)
+        self.assertEqual(50, len(batch))
+        self.assertListEqual([h.to_csv_row() for h in self.hlocs], [h.to_csv_row() for h in batch])
+        self.assertEqual(self.hlocs[7].to_csv_row(), batch[7].to_csv_row())
+
+        df = batch.to_dataframe()
+        self.assertTrue(np.shares_memory(df['close'].values, batch.close))
+        self.assertEqual("BTC-USD", df['symbol'].iloc[1])
+        self.assertEqual(self.hlocs[3].time, df.index[3].to_pydatetime())
+
+        copy = OHLCBatch.from_dataframe(df)
+        window = copy[10:20]
+        self.assertEqual(10, len(window))
+        self.assertTrue(np.shares_memory(window.high, copy.high))
+        self.assertListEqual([h.to_csv_row() for h in self.hlocs[10:20]], [h.to_csv_row() for h in window])
+
+
+
+class BatchCollector:
+    def __init__(self):
+        self.batches = []
+
+    def on_hloc(self, hloc: OHLC):
+        raise AssertionError("batch listeners get batches")
+
+    def on_hloc_batch(self, batch: OHLCBatch):
+        self.batches.append(batch)
+
+
+
+class TestFileOHLC(TestCase):
+
+    def test_batches(self):
+        path = Path(Path(__file__).parent, "data", "test_candles_1000.csv")
+        source = FileOHLC(str(path), "ETH-USD", chunk_size=300)
+        batches = BatchCollector()
+        bars = HLOCCollector()
+        source.subscribe(batches)
+        source.subscribe(bars)
+        source.start()
+        source.thread.join(10)
+        self.assertEqual(1000, source.event_ct)
+        self.assertListEqual([300, 300, 300, 100], [len(b) for b in batches.batches])
+        self.assertEqual(1000, len(bars.hlocs))
+
+        df = pd.read_csv(path, index_col='time', parse_dates=True)
+        expected = OHLC.from_dict(dict(df.iloc[500].to_dict(), time=df.index[500], symbol="ETH-USD"))
+        self.assertEqual(expected.to_csv_row(), bars.hlocs[500].to_csv_row())
+        self.assertEqual(expected.to_csv_row(), batches.batches[1][200].to_csv_row())
+        self.assertListEqual([h.close for h in bars.hlocs[-10:]], source.hlocs.view('close', 10).tolist())
@@ -0,0 +1,106 @@
+from decimal import Decimal
+from unittest import TestCase
+
+import numpy as np
+
+from cryptalgo.backtest.backtest import BacktestHarness
+from cryptalgo.backtest.grid import SMACParameterGrid
+from cryptalgo.brain.models import SMACModel
+from cryptalgo.coredata.holdings import FeeModel
+from cryptalgo.inputs.feed_agg import AggPeriod
+from test.test_utils import generate_hloc_dataframe
+
+
+
+class RateFeeModel(FeeModel):
+
+    def __init__(self, rate: float) -> None:
+        self.rate = rate
+
+
+    def calculate_fee(self, symbol, amount, price, side) -> Decimal:
+        return Decimal(amount) * Decimal(price) * Decimal(self.rate)
+
+
+
+class TestSMACParameterGrid(TestCase):
+    df = None
+    params = [(st, lt) for st in range(10, 60, 10) for lt in range(st + 10, 130, 20)]
+
+
+    @classmethod
+    def setUpClass(cls) -> None:
+        super().setUpClass()
+        TestSMACParameterGrid.df = generate_hloc_dataframe()
+
+
+    def test_get_signal_matrix(self):
+        df = TestSMACParameterGrid.df.copy()
+        grid = SMACParameterGrid(df, self.params)
+        signals = grid.get_signal_matrix()
+        positions = grid.get_position_matrix()
+        self.assertEqual((len(self.params), len(df)), signals.shape)
+        for i, (st, lt) in enumerate(self.params):
+            model = SMACModel("LTC-USD", short_lb=st, long_lb=lt)
+            model.load_data(df)
+            sdf = model.get_signal_df()
+            np.testing.assert_array_equal(sdf['signal'].values, signals[i])
+            np.testing.assert_array_equal(sdf['positions'].fillna(0).values, positions[i])
+
+
+    def test_generate_reports(self):
+        df = TestSMACParameterGrid.df.copy()
+        for agg_period in [AggPeriod.FIVE_MINUTES, AggPeriod.FIFTEEN_MINUTES]:
+            grid = SMACParameterGrid(df, self.params, seed_investment=1000.0, agg_period=agg_period)
+            reports = grid.generate_reports()
+            self.assertEqual(len(self.params), len(reports))
+            for (st, lt), report in zip(self.params, reports):
+                bt = BacktestHarness(SMACModel("LTC-USD", short_lb=st, long_lb=lt), seed_investment=1000.0,
+                                     agg_period=agg_period)
+                bt.backtest_single_pass(df)
+                expected = bt.generate_report()
+                self.assertEqual(len(BacktestHarness.generate_report_header()), len(report))
+                self.assertEqual(float(expected[0]), report[0])
+                self.assertEqual(float(expected[1]), report[1])
+                self.assertAlmostEqual(float(expected[2]), report[2], places=8)
+                self.assertEqual(expected[3], report[3])
+                self.assertEqual(float(expected[4]), report[4])
+                # the Account rounds to 5 significant digits on every trade
+                self.assertAlmostEqual(float(expected[5]), report[5], delta=float(expected[5]) * 1e-3)
+                self.assertAlmostEqual(float(expected[7]), report[7], delta=1e-3)
+
+
+    def test_generate_risk_reports(self):
+        df = TestSMACParameterGrid.df.copy()
+        grid = SMACParameterGrid(df, self.params, seed_investment=1000.0)
+        equity, holding, notional = grid.get_equity_curves()
+        np.testing.assert_allclose(grid.get_account_values()[0], equity[:, -1], rtol=1e-12)
+        reports = grid.generate_risk_reports()
+        self.assertEqual(len(self.params), len(reports))
+        for (st, lt), report in list(zip(self.params, reports))[::5]:
+            bt = BacktestHarness(SMACModel("LTC-USD", short_lb=st, long_lb=lt), seed_investment=1000.0)
+            bt.backtest_single_pass(df)
+            expected = bt.generate_risk_report()
+            self.assertEqual(len(BacktestHarness.generate_risk_report_header()), len(report))
+            # max drawdown, exposure and turnover agree to the Account's rounding; the ratios closely
+            self.assertAlmostEqual(expected[0], report[0], delta=1e-3)
+            self.assertAlmostEqual(expected[1], report[1], delta=abs(expected[1]) * 1e-2)
+            self.assertAlmostEqual(expected[2], report[2], delta=abs(expected[2]) * 1e-2)
+            self.assertEqual(expected[3], report[3])
+            self.assertAlmostEqual(expected[4], report[4], delta=expected[4] * 1e-3)
+
+
+
+    def test_generate_reports_fees(self):
+        # fees on every trade; an open position is marked at the last close without an exit fee, like the Account
+        df = TestSMACParameterGrid.df.copy()
+        grid = SMACParameterGrid(df, self.params, seed_investment=1000.0, fee_rate=0.005)
+        open_at_end = grid.get_signal_matrix()[:, -1] == 1
+        self.assertTrue(open_at_end.any() and not open_at_end.all())
+        for (st, lt), report in zip(self.params, grid.generate_reports()):
+            bt = BacktestHarness(SMACModel("LTC-USD", short_lb=st, long_lb=lt), seed_investment=1000.0,
+                                 brokerage_model=RateFeeModel(0.005))
+            bt.backtest_single_pass(df)
+            expected = bt.generate_report()
+            self.assertEqual(expected[3], report[3])
+            self.assertAlmostEqual(float(expected[5]), report[5], delta=float(expected[5]) * 1e-3)
@@ -0,0 +1,115 @@
+import shutil
+import tempfile
+import threading
+import time
+from datetime import datetime, timezone
+from pathlib import Path
+from unittest import TestCase
+
+import numpy as np
+
+from cryptalgo.backtest.history_downloader import HistoryDownloader
+from cryptalgo.coredata.candles import CandleStore
+from cryptalgo.utils.ratelimit import TokenBucket
+
+
+
+class FakePublicClient:
+    """
+    Local stand-in for cbpro.PublicClient.get_product_historic_rates. Serves a candle every granularity seconds except
+    inside `holes`, newest first, and fails the first request for any window start listed in `fail_once`.
+    """
+
+    def __init__(self, holes=(), fail_once=(), fail_always=()) -> None:
+        self.holes = holes
+        self.fail_once = set(fail_once)
+        self.fail_always = set(fail_always)
+        self.requests = []
+        self.lock = threading.Lock()
+
+
+    def get_product_historic_rates(self, product_id, start=None, end=None, granularity=None):
+        first = int(datetime.fromisoformat(start).timestamp())
+        last = int(datetime.fromisoformat(end).timestamp())
+        with self.lock:
+            self.requests.append((product_id, first, last))
+            if first in self.fail_always:
+                return {"message": "boom"}
+            if first in self.fail_once:
+                self.fail_once.remove(first)
+                raise ConnectionError("reset")
+        rows = []
+        for t in range(first, last + granularity, granularity):
+            if any(lo <= t <= hi for lo, hi in self.holes):
+                continue
+            price = float(t % 1000)
+            rows.append([t, price - 1.0, price + 1.0, price, price + 0.5, 10.0])
+        return list(reversed(rows))
+
+
+
+class TestTokenBucket(TestCase):
+
+    def test_acquire(self):
+        bucket = TokenBucket(rate=50.0, capacity=5)
+        for i in range(5):
+            self.assertTrue(bucket.try_acquire())
+        self.assertFalse(bucket.try_acquire())
+        start = time.monotonic()
+        self.assertTrue(bucket.acquire())
+        self.assertGreater(time.monotonic() - start, 0.01)
+        self.assertFalse(bucket.acquire(tokens=5, timeout=0.01))
+
+
+
+class TestHistoryDownloader(TestCase):
+
+    start = datetime(2021, 1, 1, tzinfo=timezone.utc)
+    end = datetime(2021, 1, 5, tzinfo=timezone.utc)
+
+
+    def setUp(self) -> None:
+        self.root = Path(tempfile.mkdtemp())
+        self.store = CandleStore(self.root)
+
+
+    def tearDown(self) -> None:
+        shutil.rmtree(self.root, ignore_errors=True)
+
+
+    def test_download(self):
+        t0 = int(self.start.timestamp())
+        hole = (t0 + 3600, t0 + 3600 + 600)
+        client = FakePublicClient(holes=[hole], fail_once=[t0 + 300 * 300])
+        downloader = HistoryDownloader(client, self.store, requests_per_sec=1000.0, max_workers=4,
+                                       retries=2, retry_delay_sec=0.0)
+        written = downloader.download(['BTC-USD', 'ETH-USD'], self.start, self.end, 300)
+
+        expected = 4 * 24 * 12 - 3
+        self.assertEqual({'BTC-USD': expected, 'ETH-USD': expected}, written)
+        series = self.store.read('BTC-USD', 300)
+        self.assertEqual(expected, len(series))
+        self.assertTrue(np.all(np.diff(series.times) > 0))
+        self.assertEqual(t0 * 10 ** 9, int(series.times[0]))
+        self.assertEqual((t0 + 300) % 1000 + 0.5, series.close[1])
+        self.assertListEqual([[hole[0] * 10 ** 9, hole[1] * 10 ** 9]], self.store.get_meta('BTC-USD', 300)['gaps'])
+        self.assertEqual(0, len(downloader.failed))
+
+        # resume only asks for what is new
+        client.requests.clear()
+        later = datetime(2021, 1, 6, tzinfo=timezone.utc)
+        written = downloader.download(['BTC-USD'], self.start, later, 300)
+        self.assertEqual({'BTC-USD': 24 * 12}, written)
+        self.assertTrue(all(first >= int(self.end.timestamp()) for _, first, _ in client.requests))
+
+
+    def test_download_failed_window(self):
+        t0 = int(self.start.timestamp())
+        client = FakePublicClient(fail_always=[t0 + 300 * 300])
+        downloader = HistoryDownloader(client, self.store, requests_per_sec=1000.0, retries=1, retry_delay_sec=0.0)
+        written = downloader.download(['BTC-USD'], self.start, self.end, 300)
+
+        # only the window before the failure is kept so a later run can fill the hole
+        self.assertEqual({'BTC-USD': 300}, written)
+        self.assertEqual(1, len(downloader.failed))
+        self.assertEqual(t0 + 299 * 300, self.store.get_last_time('BTC-USD', 300) // 10 ** 9)
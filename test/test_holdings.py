@@ -2,8 +2,10 @@ import decimal
 from decimal import Decimal
 from unittest import TestCase
 
-from cryptalgo.coredata.holdings import Ledger, Account, FeeModel
-from cryptalgo.coredata.trades import TradeSide
+from cryptalgo.coredata.holdings import Ledger, Account, FeeModel, FixedPointLedger, div_round
+import numpy as np
+
+from cryptalgo.coredata.trades import TradeSide, Trade, TradeBatch
 
 
 
@@ -193,3 +195,171 @@ class TestAccount(TestCase):
             a.sell_shares('sym', 1.0, None)
         with self.assertRaises(ValueError):
             a.sell_shares('sym', -1.0, -1.0)
+
+
+
+class TestFixedPointLedger(TestCase):
+    def test_add_remove(self):
+        l = FixedPointLedger(name="test", scales={'USD': 2})
+        self.assertEqual(0, len(l.holdings))
+        l.add('sym', 1.1)
+        l.add('USD', 1.1)
+        self.assertEqual(2, len(l.holdings))
+        self.assertEqual(Decimal('1.1'), l.holdings['sym'])
+        self.assertEqual(110000000, l.units['sym'])
+        self.assertEqual(110, l.units['USD'])
+        l.remove('sym', 1.00)
+        self.assertEqual(Decimal('0.1'), l.holdings['sym'])
+        with self.assertRaises(ValueError):
+            l.remove('sym', 1.0)
+        with self.assertRaises(ValueError):
+            l.remove('other', 1.0)
+        with self.assertRaises(ValueError):
+            l.add('sym', None)
+        with self.assertRaises(ValueError):
+            l.add(None, 1.1)
+        with self.assertRaises(ValueError):
+            l.remove('sym', -1.0)
+        with self.assertRaises(ValueError):
+            l.add('sym', 2 ** 63)
+
+
+    def test_exact_balances(self):
+        l = FixedPointLedger(name="test")
+        l.add('BTC', 12345.6789)
+        l.add('BTC', 0.00000001)
+        self.assertEqual(Decimal('12345.67890001'), l.holdings['BTC'])
+        for _ in range(1000):
+            l.add('BTC', 0.1)
+        self.assertEqual(Decimal('12445.67890001'), l.holdings['BTC'])
+        # the Decimal ledger keeps 5 significant digits
+        d = Ledger(name="test")
+        d.add('BTC', 12345.6789)
+        d.add('BTC', 0.00000001)
+        self.assertEqual(Decimal('12346'), d.holdings['BTC'])
+
+        self.assertEqual(0, l.to_units('BTC', Decimal('0.000000005')))
+        self.assertEqual(2, l.to_units('BTC', Decimal('0.000000015')))
+        self.assertEqual(10 ** 10, l.to_units('BTC', 100))
+        self.assertEqual(2, div_round(5, 2))
+        self.assertEqual(4, div_round(7, 2))
+        self.assertEqual(-2, div_round(-5, 2))
+
+
+    def test_history(self):
+        l = FixedPointLedger(name="test", keep_history=True)
+        l.add('sym', 2.0)
+        l.remove('sym', 0.5)
+        series = l.balance_history_as_series()
+        self.assertListEqual([Decimal('2'), Decimal('1.5')], series.tolist())
+        self.assertEqual(0, len(FixedPointLedger(name="test").balance_history_as_series()))
+
+
+
+class TestFixedPointAccount(TestCase):
+    def test_deposit_withdraw(self):
+        a = Account(fixed_point=True)
+        a.deposit_cash(100.00)
+        a.deposit_cash(2.95)
+        self.assertEqual(Decimal('102.95000'), a.get_cash_balance())
+        a.withdraw_cash(97.94)
+        self.assertEqual(Decimal('5.01000'), a.get_cash_balance())
+        with self.assertRaises(ValueError):
+            a.withdraw_cash(100.0)
+        with self.assertRaises(ValueError):
+            a.deposit_cash(-1.0)
+
+
+    def test_buy_sell_shares(self):
+        a = Account(fixed_point=True, default_trade_fee_model=TestFeeModel())
+        a.deposit_cash(100.00)
+        a.buy_shares('sym', 5.0, price=2.00)
+        a.buy_shares('sym', 1.0, price=3.00)
+        self.assertEqual(Decimal('6.00000'), a.get_num_shares_for('sym'))
+        self.assertEqual(Decimal('81.02000'), a.get_cash_balance())
+        a.sell_shares('sym', 6.0, price=3.00, fee=1.99)
+        self.assertEqual(Decimal('0'), a.get_num_shares_for('sym'))
+        self.assertEqual(Decimal('97.03000'), a.get_cash_balance())
+        self.assertEqual(3, a.num_trades())
+        self.assertEqual(1.99, a.trade_history[-1].fee)
+
+        with self.assertRaises(ValueError):
+            a.buy_shares('sym', 1000.0, 10000.00)
+        with self.assertRaises(ValueError):
+            a.sell_shares('sym', 1.0, 1.0)
+        with self.assertRaises(ValueError):
+            a.buy_shares('sym', None, 1.0)
+        with self.assertRaises(ValueError):
+            a.sell_shares('sym', -1.0, -1.0)
+        # a failed trade leaves the account untouched
+        self.assertEqual(Decimal('97.03000'), a.get_cash_balance())
+        self.assertEqual(3, a.num_trades())
+
+
+    def test_btc_sized_trade(self):
+        a = Account(start_cash_balance=1000000.0, fixed_point=True, scales={'USD': 2})
+        a.buy_shares('BTC', 12.34567891, price=43210.99)
+        # 533469.0079232209 rounds to 533469.01
+        self.assertEqual(Decimal('12.34567891'), a.get_num_shares_for('BTC'))
+        self.assertEqual(Decimal('466530.99'), a.get_cash_balance())
+        self.assertEqual(Decimal('999999.9979232209'), a.get_account_value({'BTC': Decimal('43210.99')}))
+
+
+
+def make_trades():
+    rng = np.random.default_rng(7)
+    trades = []
+    for i in range(200):
+        symbol = ['BTC-USD', 'ETH-USD'][i % 2]
+        amount = float(np.round(rng.uniform(0.5, 2.0), 6))
+        price = float(np.round(rng.uniform(100.0, 500.0), 2))
+        fee = np.nan if i % 3 == 0 else float(np.round(rng.uniform(0.0, 0.2), 2))
+        trades.append(Trade(symbol, amount, price, TradeSide.BUY, fee))
+        if i % 4 == 3:
+            trades.append(Trade(symbol, amount / 2, price * 1.01, TradeSide.SELL, fee))
+    return trades
+
+
+
+class TestApplyTrades(TestCase):
+    def test_matches_sequential(self):
+        trades = make_trades()
+        for fixed_point in [False, True]:
+            sequential = Account(100000.0, default_trade_fee_model=TestFeeModel(), fixed_point=fixed_point)
+            for t in trades:
+                trade = sequential.buy_shares if t.side == TradeSide.BUY else sequential.sell_shares
+                trade(t.symbol, t.amount, t.price, fee=None if np.isnan(t.fee) else t.fee)
+            batched = Account(100000.0, default_trade_fee_model=TestFeeModel(), fixed_point=fixed_point)
+            batched.apply_trades(TradeBatch.from_trades(trades[:50]))
+            batched.apply_trades(TradeBatch.from_trades(trades[50:]))
+            self.assertEqual(sequential.get_cash_balance(), batched.get_cash_balance())
+            self.assertDictEqual(dict(sequential.securities_ledger.holdings), dict(batched.securities_ledger.holdings))
+            self.assertEqual(sequential.num_trades(), batched.num_trades())
+            np.testing.assert_array_equal(sequential.trade_history.fee, batched.trade_history.fee)
+            if not fixed_point:
+                self.assertListEqual(sequential.cash_ledger.balance_history_as_series().tolist(),
+                                     batched.cash_ledger.balance_history_as_series().tolist())
+
+
+    def test_invalid_rows(self):
+        trades = make_trades()[:10]
+        for fixed_point in [False, True]:
+            a = Account(5000.0, fixed_point=fixed_point)
+            bad = TradeBatch.from_trades(trades)
+            bad.values[1, 6] = np.nan
+            bad.values[0, 8] = -1.0
+            with self.assertRaisesRegex(ValueError, "trade 6: price"):
+                a.apply_trades(bad)
+
+            # overdrawn at row 4: nothing is applied
+            overdrawn = TradeBatch.from_trades(trades)
+            overdrawn.values[0, 4] = 100.0
+            with self.assertRaisesRegex(ValueError, "trade 4: can't remove"):
+                a.apply_trades(overdrawn)
+            selling = TradeBatch.from_trades([Trade('XRP-USD', 1.0, 1.0, TradeSide.SELL, 0.0)])
+            with self.assertRaisesRegex(ValueError, "trade 0: can't remove XRP-USD"):
+                a.apply_trades(selling)
+            self.assertEqual(Decimal('5000'), a.get_cash_balance())
+            self.assertEqual(0, len(a.securities_ledger.holdings))
+            self.assertEqual(0, a.num_trades())
+
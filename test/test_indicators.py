@@ -0,0 +1,81 @@
+from unittest import TestCase
+
+import numpy as np
+import pandas as pd
+
+from cryptalgo.brain.indicators import RollingMean, ExponentialMean
+from test.test_utils import generate_hloc_dataframe
+
+
+
+class TestRollingMean(TestCase):
+
+    def test_update(self):
+        closes = generate_hloc_dataframe()['close']
+        for window in [1, 2, 30, 90, 2000]:
+            expected = closes.rolling(window=window, min_periods=1, center=False).mean().values
+            rm = RollingMean(window)
+            actual = np.array([rm.update(x) for x in closes.values])
+            np.testing.assert_array_equal(expected, actual)
+
+
+    def test_update_with_gaps(self):
+        values = pd.Series([1.0, np.nan, 3.0, 3.0, 3.0, np.nan, np.nan, np.nan, -2.0, 5.5])
+        expected = values.rolling(window=3, min_periods=1).mean().values
+        rm = RollingMean(3)
+        actual = np.array([rm.update(x) for x in values.values])
+        np.testing.assert_array_equal(expected, actual)
+
+
+    def test_update_many(self):
+        closes = generate_hloc_dataframe()['close']
+        expected = closes.rolling(window=30, min_periods=1).mean().values
+        rm = RollingMean(30)
+        actual = np.concatenate([rm.update_many(closes.values[:45]), rm.update_many(closes.values[45:])])
+        np.testing.assert_array_equal(expected, actual)
+
+
+    def test_invalid_window(self):
+        with self.assertRaises(ValueError):
+            RollingMean(0)
+
+
+
+class TestExponentialMean(TestCase):
+
+    def test_update(self):
+        closes = generate_hloc_dataframe()['close']
+        for span in [1, 12, 26, 200]:
+            expected = closes.ewm(span=span, adjust=False).mean().values
+            em = ExponentialMean(span)
+            actual = np.array([em.update(x) for x in closes.values])
+            np.testing.assert_array_equal(expected, actual)
+
+
+    def test_update_with_gaps(self):
+        values = pd.Series([np.nan, 1.0, np.nan, 3.0, 3.0, np.nan, np.nan, -2.0, 5.5])
+        expected = values.ewm(span=3, adjust=False).mean().values
+        em = ExponentialMean(3)
+        actual = np.array([em.update(x) for x in values.values])
+        np.testing.assert_array_equal(expected, actual)
+
+
+    def test_update_many(self):
+        closes = generate_hloc_dataframe()['close']
+        for span in [1, 12, 26, 200]:
+            expected = closes.ewm(span=span, adjust=False).mean().values
+            em = ExponentialMean(span)
+            # short and long blocks, fresh and seeded
+            bounds = [0, 5, 300, 301, 1000, len(closes)]
+            actual = np.concatenate([em.update_many(closes.values[a:b]) for a, b in zip(bounds[:-1], bounds[1:])])
+            np.testing.assert_array_equal(expected, actual)
+            self.assertEqual(expected[-1], em.value)
+
+        values = pd.Series([1.0, 2.0, np.nan, 3.0] * 20)
+        em = ExponentialMean(3)
+        np.testing.assert_array_equal(values.ewm(span=3, adjust=False).mean().values, em.update_many(values.values))
+
+
+    def test_invalid_span(self):
+        with self.assertRaises(ValueError):
+            ExponentialMean(0.5)
@@ -2,8 +2,8 @@ import unittest
 from unittest import TestCase
 import pandas as pd
 
-from cryptalgo.brain.models import SMACModel
-from cryptalgo.inputs.feed_agg import OHLC
+from cryptalgo.brain.models import SMACModel, MACDModel
+from cryptalgo.inputs.feed_agg import OHLC, OHLCBatch
 from test.test_utils import generate_hloc_dataframe
 
 
@@ -95,3 +95,135 @@ class TestSMACModel(TestCase):
         model.on_hloc(hloc)
         self.assertEqual(96, len(model.hloc_data))
         self.assertEqual(1, len(hloc_sink.hlocs))
+
+
+    def test_on_hloc_streaming(self):
+        df = TestSMACModel.df.copy()
+        batch = SMACModel("LTC-USD", short_lb=30, long_lb=90)
+        batch.load_data(df)
+        sdf = batch.get_signal_df()
+        positions = sdf['positions'].values
+        expected = [(i, positions[i]) for i in range(len(df)) if positions[i] in (-1, 1)]
+
+        model = SMACModel("LTC-USD", short_lb=30, long_lb=90, streaming=True)
+        hloc_sink = HLOCListener()
+        model.subscribe(hloc_sink)
+        fired = []
+        for i in range(len(df)):
+            row = df.iloc[i]
+            rowd = row.to_dict()
+            rowd['time'] = row.name
+            model.on_hloc(OHLC.from_dict(rowd))
+            if len(hloc_sink.hlocs) > len(fired):
+                fired.append((i, hloc_sink.hlocs[-1].value))
+            if i < 30:
+                self.assertEqual(0, len(hloc_sink.hlocs))
+
+        self.assertEqual(0, len(model.hloc_data))
+        self.assertListEqual(expected, fired)
+
+
+
+class TestMACDModel(TestCase):
+    df = None
+
+
+    @classmethod
+    def setUpClass(cls) -> None:
+        super().setUpClass()
+        TestMACDModel.df = generate_hloc_dataframe()
+
+
+    def test_get_signal_df_cache(self):
+        df = TestMACDModel.df.copy()
+        model = MACDModel("LTC-USD", low_ewm=12, high_ewm=26)
+        model.load_data(df)
+        sdf = model.get_signal_df()
+        self.assertEqual(len(df), len(sdf))
+        self.assertIs(sdf, model.get_signal_df())
+
+        sdf_limited = model.get_signal_df(data_limit=200)
+        self.assertEqual(200, len(sdf_limited))
+
+        model.load_data(df.iloc[0:500])
+        self.assertEqual(500, len(model.get_signal_df()))
+
+        # rows appended to the frame in place
+        data = df.iloc[0:500].copy()
+        model.load_data(data)
+        self.assertEqual(500, len(model.get_signal_df()))
+        data.loc[df.index[500]] = df.iloc[500]
+        sdf = model.get_signal_df()
+        self.assertEqual(501, len(sdf))
+        self.assertEqual(df['close'].iloc[500], sdf['price'].iloc[-1])
+
+        # a new frame of the same length and end, e.g. one that took a collected frame's id
+        changed = data.copy()
+        changed['close'] = changed['close'] * 2
+        model.hloc_data = changed
+        self.assertEqual(df['close'].iloc[500] * 2, model.get_signal_df()['price'].iloc[-1])
+
+
+    def test_on_hloc(self):
+        df = TestMACDModel.df.copy()
+        batch = MACDModel("LTC-USD", low_ewm=12, high_ewm=26)
+        batch.load_data(df)
+        positions = batch.get_signal_df()['positions'].values
+        expected = [(i, positions[i]) for i in range(len(df)) if positions[i] in (-1, 1)]
+        self.assertGreater(len(expected), 0)
+
+        model = MACDModel("LTC-USD", low_ewm=12, high_ewm=26)
+        hloc_sink = HLOCListener()
+        model.subscribe(hloc_sink)
+        fired = []
+        for i in range(len(df)):
+            row = df.iloc[i]
+            rowd = row.to_dict()
+            rowd['time'] = row.name
+            model.on_hloc(OHLC.from_dict(rowd))
+            if len(hloc_sink.hlocs) > len(fired):
+                fired.append((i, hloc_sink.hlocs[-1].value))
+
+        self.assertEqual(0, len(model.hloc_data))
+        self.assertListEqual(expected, fired)
+
+
+
+class TestOnHlocBatch(TestCase):
+
+    def fired(self, model, df, chunks=None):
+        fired = []
+        model.fire_signal = lambda signal, hloc: fired.append((hloc.time, signal))
+        if chunks is None:
+            for i in range(len(df)):
+                row = df.iloc[i]
+                rowd = row.to_dict()
+                rowd['time'] = row.name
+                model.on_hloc(OHLC.from_dict(rowd))
+        else:
+            batch = OHLCBatch.from_dataframe(df)
+            for a, b in zip(chunks[:-1], chunks[1:]):
+                model.on_hloc_batch(batch[a:b])
+        return fired
+
+
+    def test_matches_on_hloc(self):
+        df = generate_hloc_dataframe()
+        chunks = [0, 1, 40, 47, 120, 700, len(df)]
+        for make in [lambda: SMACModel("LTC-USD", short_lb=30, long_lb=90, streaming=True),
+                     lambda: SMACModel("LTC-USD", short_lb=30, long_lb=90),
+                     lambda: MACDModel("LTC-USD", low_ewm=12, high_ewm=26)]:
+            expected = self.fired(make(), df)
+            self.assertGreater(len(expected), 0)
+            self.assertListEqual(expected, self.fired(make(), df, chunks))
+
+
+    def test_other_symbols(self):
+        df = generate_hloc_dataframe()
+        other = df.copy()
+        other['symbol'] = "BTC-USD"
+        mixed = pd.concat([df, other]).sort_index(kind='stable')
+        model = MACDModel("LTC-USD", low_ewm=12, high_ewm=26)
+        with self.assertLogs("cryptalgo.brain.models", level="WARNING"):
+            fired = self.fired(model, mixed, [0, len(mixed)])
+        self.assertListEqual(self.fired(MACDModel("LTC-USD", low_ewm=12, high_ewm=26), df), fired)
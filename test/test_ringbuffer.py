@@ -0,0 +1,81 @@
+from datetime import datetime, timedelta, timezone
+from unittest import TestCase
+
+import numpy as np
+
+from cryptalgo.coredata.ringbuffer import RingBuffer
+from cryptalgo.inputs.feed import TickBuffer, Tick
+from cryptalgo.inputs.feed_agg import OHLC, OHLCBatch, OHLCBuffer
+
+
+
+def make_hlocs(n: int):
+    t0 = datetime(2021, 6, 1, 12, tzinfo=timezone.utc)
+    return [OHLC("BTC-USD", t0 + timedelta(minutes=i), 101.0 + i, 99.0 + i, 100.0 + i, 100.5 + i, 1.0 * i, 60)
+            for i in range(n)]
+
+
+
+class TestRingBuffer(TestCase):
+
+    def test_wraparound_views(self):
+        buffer = RingBuffer(5, {'x': 'f8', 'n': 'i8'})
+        self.assertEqual(0, len(buffer.view('x')))
+        for i in range(13):
+            buffer.append(float(i), i)
+            expected = list(range(max(0, i - 4), i + 1))
+            self.assertListEqual(expected, buffer.view('n').tolist())
+            self.assertListEqual(expected[-3:], buffer.view('n', 3).tolist())
+        self.assertEqual(5, len(buffer))
+        self.assertEqual(13, buffer.total)
+        # a view, not a copy, and not writable
+        x = buffer.view('x')
+        self.assertTrue(np.shares_memory(x, buffer.columns['x']))
+        self.assertFalse(x.flags.writeable)
+        with self.assertRaises(TypeError):
+            buffer[0]
+
+
+    def test_extend(self):
+        buffer = RingBuffer(8, {'x': 'f8', 'n': 'i8'})
+        buffer.append(0.5, 0)
+        buffer.extend({'n': np.arange(1, 7)})
+        self.assertListEqual(list(range(7)), buffer.view('n').tolist())
+        self.assertTrue(np.isnan(buffer.view('x')[1:]).all())
+        # wraps, then more than the capacity at once
+        buffer.extend({'n': np.arange(7, 12), 'x': np.arange(7, 12) * 1.0})
+        self.assertListEqual(list(range(4, 12)), buffer.view('n').tolist())
+        buffer.extend({'n': np.arange(12, 30), 'x': np.arange(12, 30) * 1.0})
+        self.assertListEqual(list(range(22, 30)), buffer.view('n').tolist())
+        self.assertListEqual(list(range(22, 30)), buffer.view('x').astype(int).tolist())
+        self.assertEqual(30, buffer.total)
+        buffer.append(1.0, 30)
+        self.assertListEqual(list(range(23, 31)), buffer.view('n').tolist())
+
+
+    def test_ohlc_buffer(self):
+        hlocs = make_hlocs(30)
+        buffer = OHLCBuffer(10)
+        for h in hlocs[:15]:
+            buffer.append(h)
+        self.assertListEqual(hlocs[5:15], list(buffer))
+        self.assertIs(hlocs[14], buffer[-1])
+        self.assertListEqual([h.close for h in hlocs[10:15]], buffer.view('close', 5).tolist())
+
+        buffer.extend_batch(OHLCBatch.from_ohlcs(hlocs[15:]))
+        self.assertListEqual([h.to_csv_row() for h in hlocs[20:]], [h.to_csv_row() for h in buffer])
+        df = buffer.to_dataframe(4)
+        self.assertListEqual([h.close for h in hlocs[-4:]], df['close'].tolist())
+        self.assertEqual(hlocs[-4].time, df.index[0].to_pydatetime())
+
+
+    def test_tick_buffer(self):
+        t0 = datetime(2021, 6, 1, 12, tzinfo=timezone.utc)
+        ticks = [Tick(t0 + timedelta(seconds=i), "BTC-USD", 100.0 + i, 1.0, "buy" if i % 2 else "sell") for i in range(7)]
+        buffer = TickBuffer(4)
+        for t in ticks:
+            buffer.append(t)
+        self.assertListEqual([t.to_json() for t in ticks[3:]], [t.to_json() for t in buffer])
+        self.assertEqual(ticks[-1].time, buffer[-1].time)
+        self.assertListEqual([1, -1, 1, -1], buffer.view('side').tolist())
+        self.assertEqual(ticks[-1].time_ns, int(buffer.view('time')[-1]))
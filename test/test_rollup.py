@@ -0,0 +1,137 @@
+import shutil
+import tempfile
+from pathlib import Path
+from unittest import TestCase, mock
+
+import numpy as np
+import pandas as pd
+
+from cryptalgo.coredata.rollup import rollup_ohlc, RollupPyramid, LiveRollup, data_hash
+from cryptalgo.inputs.feed_agg import AggPeriod, OHLC
+from test.test_utils import HLOCCollector
+
+FREQS = {AggPeriod.FIFTEEN_MINUTES: '15T', AggPeriod.ONE_HOUR: '1H', AggPeriod.ONE_DAY: '1D'}
+
+
+
+def make_candles(n: int = 20000, seed: int = 3) -> pd.DataFrame:
+    rng = np.random.RandomState(seed)
+    index = pd.date_range("2021-01-01 00:05", periods=n, freq="5T", tz="UTC", name="time")
+    close = 100 + rng.randn(n).cumsum()
+    df = pd.DataFrame({
+        'symbol': 'BTC-USD',
+        'high': close + rng.rand(n),
+        'low': close - rng.rand(n),
+        'open': close + rng.randn(n) * 0.1,
+        'close': close,
+        'volume': rng.rand(n) * rng.choice([1e-3, 1.0, 1e6], n),
+        'duration_secs': 300,
+    }, index=index)
+    # drop some candles, including whole hours, to get empty periods
+    keep = rng.rand(n) > 0.03
+    keep[1000:1040] = False
+    return df[keep]
+
+
+
+def resample(data: pd.DataFrame, agg_period: AggPeriod) -> pd.DataFrame:
+    df = data.resample(FREQS[agg_period]).agg({
+        'symbol': 'first',
+        'high': np.max,
+        'low': np.min,
+        'open': 'first',
+        'close': 'last',
+        'volume': np.sum,
+        'duration_secs': 'first',
+    })
+    df['duration_secs'] = agg_period.value * 60
+    return df
+
+
+
+class TestRollup(TestCase):
+
+    def setUp(self) -> None:
+        self.dir = Path(tempfile.mkdtemp())
+        self.data = make_candles()
+
+
+    def tearDown(self) -> None:
+        shutil.rmtree(self.dir, ignore_errors=True)
+
+
+    def test_rollup_matches_resample(self):
+        for agg_period in FREQS.keys():
+            pd.testing.assert_frame_equal(resample(self.data, agg_period), rollup_ohlc(self.data, agg_period),
+                                          check_exact=True)
+
+
+    def test_pyramid_cache(self):
+        pyramid = RollupPyramid(self.dir)
+        levels = pyramid.get_all(self.data)
+        self.assertListEqual([AggPeriod.FIFTEEN_MINUTES, AggPeriod.ONE_HOUR, AggPeriod.ONE_DAY], list(levels.keys()))
+        self.assertEqual(3, pyramid.misses)
+
+        # a shallow copy of the cached level: assigned columns stay in the copy, in place writes raise
+        level = pyramid.get(self.data, AggPeriod.ONE_HOUR)
+        self.assertEqual(1, pyramid.hits)
+        self.assertIsNot(levels[AggPeriod.ONE_HOUR], level)
+        self.assertTrue(np.shares_memory(levels[AggPeriod.ONE_HOUR]['close'].values, level['close'].values))
+        for k in level.columns:
+            with self.assertRaises(ValueError):
+                level.iloc[0, level.columns.get_loc(k)] = level.iloc[1, level.columns.get_loc(k)]
+        with self.assertRaises(ValueError):
+            level['close'].values[0] = 0.0
+        level['symbol'] = 'ETH-USD'
+        level['duration_secs'] = 0
+        level['close'] = 0.0
+        level['signal'] = 1.0
+        pd.testing.assert_frame_equal(resample(self.data, AggPeriod.ONE_HOUR), pyramid.get(self.data, AggPeriod.ONE_HOUR))
+
+        # a frame already seen is not hashed again; another frame gets its own key
+        self.assertEqual(data_hash(self.data), pyramid.key_for(self.data))
+        with mock.patch('cryptalgo.coredata.rollup.data_hash') as hashed:
+            pyramid.get(self.data, AggPeriod.ONE_HOUR)
+            hashed.assert_not_called()
+        head = self.data.iloc[:100]
+        self.assertEqual(data_hash(head), pyramid.key_for(head))
+
+        # from disk in a new pyramid
+        pyramid = RollupPyramid(self.dir)
+        for agg_period, level in levels.items():
+            pd.testing.assert_frame_equal(resample(self.data, agg_period), pyramid.get(self.data, agg_period),
+                                          check_exact=True)
+        self.assertEqual(0, pyramid.misses)
+        self.assertTrue(Path(self.dir, data_hash(self.data), "3600", "meta.json").is_file())
+
+        # different data, different key
+        changed = self.data.copy()
+        changed.iloc[5, changed.columns.get_loc('close')] += 1.0
+        self.assertNotEqual(data_hash(self.data), data_hash(changed))
+
+
+    def test_live_rollup(self):
+        data = self.data.iloc[:3000]
+        live = LiveRollup([AggPeriod.FIFTEEN_MINUTES, AggPeriod.ONE_HOUR])
+        sink = HLOCCollector()
+        live.subscribe(sink)
+        hourly = HLOCCollector()
+        live.subscribe(hourly, agg_period=AggPeriod.ONE_HOUR)
+        for t, row in data.iterrows():
+            live.on_hloc(OHLC(row['symbol'], t.to_pydatetime(), row['high'], row['low'], row['open'], row['close'],
+                              row['volume'], 300))
+
+        for agg_period in [AggPeriod.FIFTEEN_MINUTES, AggPeriod.ONE_HOUR]:
+            expected = rollup_ohlc(data, agg_period).dropna()
+            # the last period may still be open
+            bars = [h for h in sink.hlocs if h.duration_sec == agg_period.value * 60]
+            expected = expected.iloc[:len(bars)]
+            self.assertGreaterEqual(len(bars), len(rollup_ohlc(data, agg_period).dropna()) - 1)
+            self.assertListEqual(list(expected.index.to_pydatetime()), [h.time for h in bars])
+            np.testing.assert_array_equal(expected['high'].to_numpy(), [h.high for h in bars])
+            np.testing.assert_array_equal(expected['low'].to_numpy(), [h.low for h in bars])
+            np.testing.assert_array_equal(expected['open'].to_numpy(), [h.open for h in bars])
+            np.testing.assert_array_equal(expected['close'].to_numpy(), [h.close for h in bars])
+            np.testing.assert_allclose(expected['volume'].to_numpy(), [h.volume for h in bars])
+        self.assertTrue(all([h.duration_sec == 3600 for h in hourly.hlocs]))
+        self.assertEqual(len([h for h in sink.hlocs if h.duration_sec == 3600]), len(hourly.hlocs))
@@ -0,0 +1,45 @@
+from unittest import TestCase
+
+import numpy as np
+
+from cryptalgo.backtest.backtest import BacktestHarness
+from cryptalgo.backtest.sweep import ParameterSweep, SharedCandles
+from cryptalgo.brain.models import SMACModel, MACDModel
+from cryptalgo.inputs.feed_agg import AggPeriod
+from test.test_utils import generate_hloc_dataframe
+
+
+
+class TestSharedCandles(TestCase):
+
+    def test_publish_load(self):
+        df = generate_hloc_dataframe()
+        shared = SharedCandles.publish(df)
+        try:
+            loaded = shared.load()
+            self.assertListEqual(df.columns.values.tolist(), loaded.columns.values.tolist())
+            self.assertTrue(df.index.equals(loaded.index))
+            np.testing.assert_array_equal(df['close'].values, loaded['close'].values)
+            self.assertEqual("LTC-USD", shared.get_symbol())
+        finally:
+            shared.close()
+        self.assertFalse(shared.directory.exists())
+
+
+
+class TestParameterSweep(TestCase):
+
+    def test_run(self):
+        df = generate_hloc_dataframe()
+        jobs = [
+            (SMACModel, {'short_lb': 30, 'long_lb': 90}, AggPeriod.FIVE_MINUTES),
+            (MACDModel, {'low_ewm': 12, 'high_ewm': 26}, AggPeriod.FIFTEEN_MINUTES),
+            (MACDModel, {'low_ewm': 10, 'high_ewm': 20}, AggPeriod.FIVE_MINUTES),
+            (SMACModel, {'short_lb': 10, 'long_lb': 40}, AggPeriod.ONE_HOUR),
+        ]
+        reports = ParameterSweep(df, max_workers=2).run(jobs)
+        self.assertEqual(len(jobs), len(reports))
+        for (model_cls, params, agg_period), report in zip(jobs, reports):
+            bt = BacktestHarness(model_cls("LTC-USD", **params), seed_investment=1000.0, agg_period=agg_period)
+            bt.backtest_single_pass(df)
+            self.assertTupleEqual(bt.generate_report(), report)
@@ -0,0 +1,132 @@
+import shutil
+import tempfile
+from datetime import datetime, timezone, timedelta
+from pathlib import Path
+from unittest import TestCase
+
+import numpy as np
+
+from cryptalgo.inputs.capture import TickLogCaptureWriter
+from cryptalgo.inputs.feed import Tick, TickBatch, datetime_to_ns
+from cryptalgo.inputs.ticklog import TickLogWriter, TickLogReader, TICK_DTYPE, TickLogHeader, convert_csv_capture
+
+
+
+def make_ticks(n: int, symbols=("BTC-USD", "ETH-USD")):
+    start = datetime(2021, 6, 1, 11, 50, 0, 123456, tzinfo=timezone.utc)
+    return [Tick(start + timedelta(milliseconds=137 * i), symbols[i % len(symbols)], 35000.0 + i * 0.01,
+                 0.001 * (i + 1), "buy" if i % 3 else "sell", 34999.5 + i, 35000.5 + i) for i in range(n)]
+
+
+
+class TestTickLog(TestCase):
+
+    def setUp(self) -> None:
+        self.dir = Path(tempfile.mkdtemp())
+
+
+    def tearDown(self) -> None:
+        shutil.rmtree(self.dir, ignore_errors=True)
+
+
+    def assertTicksEqual(self, expected, actual):
+        self.assertEqual(len(expected), len(actual))
+        for e, a in zip(expected, actual):
+            self.assertEqual(e.time, a.time)
+            self.assertEqual(e.symbol, a.symbol)
+            self.assertEqual(e.price, a.price)
+            self.assertEqual(e.size, a.size)
+            self.assertEqual(e.side, a.side)
+            self.assertEqual(e.best_bid, a.best_bid)
+            self.assertEqual(e.best_ask, a.best_ask)
+
+
+    def test_round_trip(self):
+        path = Path(self.dir, "ticks.bin")
+        ticks = make_ticks(10000)
+        writer = TickLogWriter(path, buffer_size=1000)
+        writer.write_many(ticks)
+        writer.close()
+
+        self.assertEqual(43, TICK_DTYPE.itemsize)
+        self.assertEqual(TickLogHeader.size + 10000 * TICK_DTYPE.itemsize, path.stat().st_size)
+
+        reader = TickLogReader(path)
+        self.assertEqual(10000, len(reader))
+        self.assertListEqual(["BTC-USD", "ETH-USD"], reader.symbols)
+        self.assertIsInstance(reader.records, np.memmap)
+        self.assertEqual(datetime_to_ns(ticks[5].time), int(reader.records['time'][5]))
+        self.assertTicksEqual(ticks, list(reader.iter_ticks(chunk_size=3000)))
+
+        df = reader.to_dataframe()
+        self.assertEqual(10000, len(df))
+        self.assertEqual(ticks[1].time, df.index[1].to_pydatetime())
+        self.assertEqual("ETH-USD", df['symbol'].iloc[1])
+
+        batch = reader.to_batch(reader.records[100:200])
+        self.assertTicksEqual(ticks[100:200], list(batch))
+        self.assertTicksEqual(ticks[100:200], TickBatch.from_ticks(ticks[100:200]).to_ticks())
+        batch_df = batch.to_dataframe()
+        self.assertTrue(np.shares_memory(batch_df['price'].values, batch.price))
+        self.assertListEqual(df['price'].iloc[100:200].tolist(), batch_df['price'].tolist())
+        self.assertFalse(hasattr(ticks[0], "__dict__"))
+
+
+    def test_append_reopen(self):
+        path = Path(self.dir, "ticks.bin")
+        ticks = make_ticks(300)
+        writer = TickLogWriter(path)
+        writer.write_many(ticks[:100])
+        writer.close()
+        # a torn record from an interrupted write is dropped on reopen
+        with open(path, "ab") as f:
+            f.write(b"\x01\x02\x03")
+
+        writer = TickLogWriter(path)
+        writer.write_many(ticks[100:200])
+        writer.write_many(make_ticks(100, symbols=("LTC-USD",)))
+        writer.close()
+
+        reader = TickLogReader(path)
+        self.assertListEqual(["BTC-USD", "ETH-USD", "LTC-USD"], reader.symbols)
+        self.assertTicksEqual(ticks[:200], reader.to_ticks(reader.records[:200]))
+        self.assertEqual("LTC-USD", reader.to_ticks(reader.records[-1:])[0].symbol)
+
+
+    def test_write_without_time(self):
+        writer = TickLogWriter(Path(self.dir, "ticks.bin"))
+        with self.assertRaises(ValueError):
+            writer.write(Tick(None, "BTC-USD", 35000.0, 0.1))
+        writer.write_many(make_ticks(2))
+        writer.close()
+        self.assertEqual(2, len(TickLogReader(Path(self.dir, "ticks.bin")).records))
+
+
+    def test_convert_csv_capture(self):
+        csv_path = Path(self.dir, "ticks.csv")
+        ticks = make_ticks(5000)
+        with open(csv_path, "w") as f:
+            f.write(Tick.to_csv_header())
+            f.write("".join([t.to_csv_row() for t in ticks]))
+
+        bin_path = Path(self.dir, "ticks.bin")
+        self.assertEqual(5000, convert_csv_capture(csv_path, bin_path, chunk_size=1024))
+        self.assertLess(bin_path.stat().st_size * 1.5, csv_path.stat().st_size)
+        self.assertTicksEqual(ticks, list(TickLogReader(bin_path).iter_ticks()))
+
+
+    def test_capture_writer(self):
+        writer = TickLogCaptureWriter(self.dir, batch_size=100, flush_interval_sec=0.05, rotate_hourly=False)
+        writer.start()
+        ticks = make_ticks(2000)
+        for t in ticks:
+            writer.submit(t)
+        writer.stop()
+
+        paths = sorted(self.dir.glob("*.ticks"))
+        self.assertEqual(2, len(paths))
+        read = []
+        for path in paths:
+            read.extend(TickLogReader(path).iter_ticks())
+        self.assertTicksEqual(sorted(ticks, key=lambda t: (t.symbol, t.time)),
+                              sorted(read, key=lambda t: (t.symbol, t.time)))
@@ -0,0 +1,93 @@
+from datetime import datetime, timedelta, timezone
+from unittest import TestCase
+
+import numpy as np
+
+from cryptalgo.coredata.holdings import Account
+from cryptalgo.coredata.trades import TradeLog, TradeSide, Trade
+
+
+
+T0 = datetime(2021, 6, 1, 12, tzinfo=timezone.utc)
+
+
+
+def make_log() -> TradeLog:
+    log = TradeLog(capacity=2)
+    # BTC: buy 2 @ 100, buy 1 @ 130, sell 3 @ 120 -> flat; ETH: buy 10 @ 5, still open
+    log.add_trade(Trade("BTC-USD", 2.0, 100.0, TradeSide.BUY, 1.0, T0))
+    log.add_trade(Trade("ETH-USD", 10.0, 5.0, TradeSide.BUY, 0.5, T0 + timedelta(minutes=30)))
+    log.add_trade(Trade("BTC-USD", 1.0, 130.0, TradeSide.BUY, 1.0, T0 + timedelta(hours=1)))
+    log.add_trade(Trade("BTC-USD", 3.0, 120.0, TradeSide.SELL, 1.0, T0 + timedelta(hours=2)))
+    return log
+
+
+
+class TestTradeLog(TestCase):
+
+    def test_append_and_get(self):
+        log = make_log()
+        self.assertEqual(4, len(log))
+        self.assertListEqual(["BTC-USD", "ETH-USD"], log.symbols)
+        trade = log[-1]
+        self.assertEqual("BTC-USD", trade.symbol)
+        self.assertEqual(TradeSide.SELL, trade.side)
+        self.assertEqual(3.0, trade.amount)
+        self.assertEqual(T0 + timedelta(hours=2), trade.time)
+        self.assertEqual(4, len(log.trades))
+        with self.assertRaises(IndexError):
+            log[4]
+        with self.assertRaises(ValueError):
+            log.append("BTC-USD", 1.0, None, TradeSide.BUY, 0.0)
+
+
+    def test_select(self):
+        log = make_log()
+        self.assertListEqual([0, 2, 3], log.select("BTC-USD").tolist())
+        self.assertListEqual([1], log.select("ETH-USD").tolist())
+        self.assertEqual(0, len(log.select("XRP-USD")))
+        self.assertListEqual([1, 2], log.select(start=T0 + timedelta(minutes=1), end=T0 + timedelta(hours=2)).tolist())
+        self.assertListEqual([2, 3], log.select("BTC-USD", start=T0 + timedelta(minutes=1)).tolist())
+
+        # out of order appends fall back to masking
+        log.add_trade(Trade("ETH-USD", 10.0, 6.0, TradeSide.SELL, 0.5, T0 - timedelta(hours=1)))
+        self.assertFalse(log.time_ordered)
+        self.assertListEqual([0, 1, 4], log.select(end=T0 + timedelta(hours=1)).tolist())
+        self.assertListEqual([4], log.select("ETH-USD", end=T0).tolist())
+
+
+    def test_aggregates(self):
+        log = make_log()
+        self.assertEqual(4, log.num_trades())
+        self.assertEqual(3.5, log.fees())
+        self.assertEqual(200.0 + 50.0 + 130.0 + 360.0, log.turnover())
+        # 360 - 330 - 3 in fees; the open ETH position realizes nothing
+        self.assertEqual(27.0, log.realized_pnl())
+        self.assertEqual(27.0, log.realized_pnl("BTC-USD"))
+        self.assertEqual(0.0, log.realized_pnl("ETH-USD"))
+        self.assertEqual(0.0, log.realized_pnl(end=T0 + timedelta(hours=2)))
+
+        df = log.per_window('1H')
+        self.assertListEqual([T0, T0 + timedelta(hours=1), T0 + timedelta(hours=2)],
+                             [t.to_pydatetime() for t in df.index])
+        self.assertListEqual([2, 1, 1], df['num_trades'].tolist())
+        self.assertListEqual([250.0, 130.0, 360.0], df['turnover'].tolist())
+        self.assertListEqual([0.0, 0.0, 27.0], df['realized_pnl'].tolist())
+
+
+    def test_to_dataframe(self):
+        log = make_log()
+        df = log.to_dataframe()
+        self.assertListEqual(["BTC-USD", "ETH-USD", "BTC-USD", "BTC-USD"], df['symbol'].tolist())
+        self.assertListEqual([1, 1, 1, -1], df['side'].tolist())
+        self.assertEqual(T0, df.index[0].to_pydatetime())
+        self.assertTrue(np.shares_memory(df['price'].values, log.price))
+
+
+    def test_account_trades(self):
+        a = Account(start_cash_balance=1000.0)
+        a.buy_shares("BTC-USD", 2.0, 100.0, fee=1.0, time=T0)
+        a.sell_shares("BTC-USD", 2.0, 110.0, fee=1.0, time=T0 + timedelta(hours=1))
+        self.assertEqual(2, a.num_trades())
+        self.assertEqual(18.0, a.trade_history.realized_pnl())
+        self.assertEqual(T0 + timedelta(hours=1), a.trade_history[1].time)
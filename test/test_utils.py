@@ -11,3 +11,25 @@ def generate_hloc_dataframe():
     df.set_index('time', inplace=True)
     df.sort_index(ascending=True, inplace=True)
     return df
+
+
+
+class HLOCCollector:
+    def __init__(self):
+        self.hlocs = []
+
+    def on_hloc(self, hloc: OHLC):
+        self.hlocs.append(hloc)
+
+
+
+class FakeClock:
+    """
+    A clock for code taking a `clock` callable; returns t, which the test moves forward.
+    """
+
+    def __init__(self, t: float):
+        self.t = t
+
+    def __call__(self):
+        return self.t